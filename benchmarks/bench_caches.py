@@ -0,0 +1,33 @@
+"""
+Hit and miss paths of OpBlockedArrayCache.
+"""
+
+import numpy
+import vigra
+
+from lazyflow.graph import Graph
+from lazyflow.operators import OpBlockedArrayCache
+
+
+class TimeBlockedArrayCache:
+    params = [(1, 1, 64, 64, 64), (1, 1, 1, 256, 256)]
+    param_names = ["blockshape"]
+
+    def setup(self, blockshape):
+        data = numpy.random.randint(0, 255, (1, 1, 128, 512, 512), dtype=numpy.uint8)
+        self.op = OpBlockedArrayCache(graph=Graph())
+        self.op.Input.setValue(vigra.taggedView(data, "tczyx"))
+        self.op.BlockShape.setValue(blockshape)
+
+    def time_miss(self, blockshape):
+        self.op.Input.setDirty(slice(None))
+        self.op.Output[:].wait()
+
+    def time_hit(self, blockshape):
+        # asv calls setup before every repeat, so warm the cache first
+        self.op.Output[:].wait()
+        self.op.Output[:].wait()
+
+    def time_hit_single_slice(self, blockshape):
+        self.op.Output[:, :, 64:65].wait()
+        self.op.Output[:, :, 64:65].wait()
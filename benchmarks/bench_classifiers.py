@@ -0,0 +1,87 @@
+"""
+Random forest training and prediction via the lazyflow classifier interface.
+"""
+
+import io
+
+import h5py
+import numpy
+
+from lazyflow.classifiers import ParallelVigraRfLazyflowClassifier, ParallelVigraRfLazyflowClassifierFactory
+
+
+def _samples(num_samples, num_features=30, num_classes=3):
+    rng = numpy.random.default_rng(0)
+    y = rng.integers(1, num_classes + 1, num_samples).astype(numpy.uint32)
+    X = rng.random((num_samples, num_features), dtype=numpy.float32) + y[:, None] * 0.1
+    return X, y
+
+
+class TimeRandomForest:
+    params = [1000, 100000]
+    param_names = ["num_samples"]
+    timeout = 300
+
+    def setup(self, num_samples):
+        self.X, self.y = _samples(num_samples)
+        self.factory = ParallelVigraRfLazyflowClassifierFactory(100)
+        self.classifier = self.factory.create_and_train(*_samples(10000))
+        self.X_predict = numpy.random.rand(256 * 256, self.X.shape[1]).astype(numpy.float32)
+
+    def time_train(self, num_samples):
+        self.factory.create_and_train(self.X, self.y)
+
+    def time_predict_block(self, num_samples):
+        self.classifier.predict_probabilities(self.X_predict)
+
+    def time_predict_block_vigra(self, num_samples):
+        self.classifier.USE_FLAT_FOREST = False
+        self.classifier.predict_probabilities(self.X_predict)
+
+
+class TimeRandomForestLabelStroke:
+    """
+    Latency of a retrain after a single label stroke (a few hundred new samples),
+    with a full retrain vs. an incremental update of the previous classifier.
+    """
+
+    params = [10000, 100000]
+    param_names = ["num_samples"]
+    timeout = 300
+
+    def setup(self, num_samples):
+        self.factory = ParallelVigraRfLazyflowClassifierFactory(100)
+        X, y = _samples(num_samples + 300)
+        self.classifier = self.factory.create_and_train(X[:num_samples], y[:num_samples])
+        self.X, self.y = X, y
+
+    def time_full_retrain(self, num_samples):
+        self.factory.create_and_train(self.X, self.y)
+
+    def time_incremental_update(self, num_samples):
+        self.factory.update_and_train(self.classifier, self.X, self.y)
+
+
+class TimeRandomForestSerialization:
+    """
+    Saving/loading a trained forest to/from a project file (here: an in-memory hdf5 file).
+    """
+
+    params = [100, 1000]
+    param_names = ["num_trees"]
+    timeout = 600
+
+    def setup(self, num_trees):
+        self.classifier = ParallelVigraRfLazyflowClassifierFactory(num_trees).create_and_train(*_samples(10000))
+        self.saved = h5py.File(io.BytesIO(), "w")
+        self.classifier.serialize_hdf5(self.saved.create_group("classifier"))
+
+    def teardown(self, num_trees):
+        self.saved.close()
+
+    def time_save(self, num_trees):
+        with h5py.File(io.BytesIO(), "w") as f:
+            self.classifier.serialize_hdf5(f.create_group("classifier"))
+
+    def time_load(self, num_trees):
+        ParallelVigraRfLazyflowClassifier.deserialize_hdf5(self.saved["classifier"])
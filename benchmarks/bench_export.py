@@ -0,0 +1,35 @@
+"""
+Exporting a computed image blockwise with BigRequestStreamer.
+"""
+
+import numpy
+import vigra
+
+from lazyflow.graph import Graph
+from lazyflow.operators import OpPixelFeaturesPresmoothed
+from lazyflow.utility import BigRequestStreamer
+
+
+class TimeBigRequestStreamer:
+    params = [None, (1, 1, 32, 128, 128)]
+    param_names = ["blockshape"]
+    timeout = 300
+
+    def setup(self, blockshape):
+        data = numpy.random.rand(1, 1, 64, 512, 512).astype(numpy.float32)
+        self.op = OpPixelFeaturesPresmoothed(graph=Graph())
+        self.op.Scales.setValue([1.0])
+        self.op.FeatureIds.setValue(["GaussianSmoothing"])
+        self.op.SelectionMatrix.setValue(numpy.ones((1, 1), dtype=bool))
+        self.op.ComputeIn2d.setValue([False])
+        self.op.Input.setValue(vigra.taggedView(data, "tczyx"))
+        self.export = numpy.zeros(self.op.Output.meta.shape, dtype=numpy.float32)
+
+    def _write_block(self, roi, result):
+        self.export[tuple(slice(start, stop) for start, stop in zip(*roi))] = result
+
+    def time_export(self, blockshape):
+        roi = ((0,) * 5, self.op.Output.meta.shape)
+        streamer = BigRequestStreamer(self.op.Output, roi, blockshape, allowParallelResults=True)
+        streamer.resultSignal.subscribe(self._write_block)
+        streamer.execute()
@@ -0,0 +1,59 @@
+"""
+Object feature computation (OpRegionFeatures) for images with many small objects.
+"""
+
+from functools import partial
+
+import numpy
+import vigra
+
+from ilastik.applets.objectExtraction.opObjectExtraction import OpRegionFeatures
+from ilastik.plugins import ObjectFeaturesPlugin
+from ilastik.plugins.manager import pluginManager
+from lazyflow.graph import Graph
+
+NAME = "Standard Object Features"
+
+
+def _grid_of_objects(num_objects, spacing=8):
+    """A 2D txyzc image with num_objects 3x3 squares, and matching raw data."""
+    side = int(numpy.ceil(numpy.sqrt(num_objects)))
+    labels = numpy.zeros((1, side * spacing, side * spacing, 1, 1), dtype=numpy.uint32)
+    for i in range(num_objects):
+        x, y = divmod(i, side)
+        labels[0, x * spacing + 2 : x * spacing + 5, y * spacing + 2 : y * spacing + 5, 0, 0] = i + 1
+    raw = numpy.random.rand(*labels.shape).astype(numpy.float32)
+    return vigra.taggedView(raw, "txyzc"), vigra.taggedView(labels, "txyzc")
+
+
+class TimeLocalObjectFeatures:
+    """
+    Neighborhood features: computed for batches of objects with one plugin call each,
+    vs. one plugin call per object (the plugin base class implementation).
+    """
+
+    params = [100, 1000, 10000]
+    param_names = ["num_objects"]
+    timeout = 600
+
+    def setup(self, num_objects):
+        raw, labels = _grid_of_objects(num_objects)
+        self.op = OpRegionFeatures(graph=Graph())
+        self.op.RawVolume.setValue(raw)
+        self.op.LabelVolume.setValue(labels)
+        self.op.Features.setValue(
+            {NAME: {"Count": {}, "Mean in neighborhood": {"margin": (3, 3, 1)}, "Sum in neighborhood": {}}}
+        )
+        self.plugin = pluginManager.getPluginByName(NAME, "ObjectFeatures").plugin_object
+
+    def teardown(self, num_objects):
+        self.plugin.__dict__.pop("compute_local_batch", None)
+
+    def time_batched(self, num_objects):
+        self.op.forget_previous_features()  # don't reuse the features of the previous run
+        self.op.Output[0:1].wait()
+
+    def time_per_object(self, num_objects):
+        self.plugin.compute_local_batch = partial(ObjectFeaturesPlugin.compute_local_batch, self.plugin)
+        self.op.forget_previous_features()
+        self.op.Output[0:1].wait()
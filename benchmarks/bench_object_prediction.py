@@ -0,0 +1,53 @@
+"""
+Object classification (OpObjectPredict) of long time series with few objects per frame, as in tracking.
+"""
+
+import numpy
+
+from ilastik.applets.objectClassification.opObjectClassification import OpObjectPredict
+from lazyflow.classifiers import ParallelVigraRfLazyflowClassifierFactory
+from lazyflow.graph import Graph
+
+NAME = "Standard Object Features"
+FEATURE_NAMES = ["Count", "Mean", "Variance", "RegionCenter"]
+
+
+def _frame_features(num_objects, rng):
+    return {NAME: {name: rng.random((num_objects + 1, 2), dtype=numpy.float32) for name in FEATURE_NAMES}}
+
+
+class TimeObjectPredictTimeSeries:
+    """
+    Prediction of all frames, with the frames stacked into batches (one classifier call per batch),
+    vs. one classifier call per frame.
+    """
+
+    params = [1000, 5000]
+    param_names = ["num_frames"]
+    timeout = 600
+
+    def setup(self, num_frames):
+        rng = numpy.random.default_rng(0)
+        features = {t: _frame_features(20, rng) for t in range(num_frames)}
+        num_columns = 2 * len(FEATURE_NAMES)
+        classifier = ParallelVigraRfLazyflowClassifierFactory(100).create_and_train(
+            rng.random((1000, num_columns), dtype=numpy.float32), rng.integers(1, 3, 1000).astype(numpy.uint32)
+        )
+
+        self.op = OpObjectPredict(graph=Graph())
+        self.op.Features.setValue(features)
+        self.op.SelectedFeatures.setValue({NAME: {name: {} for name in FEATURE_NAMES}})
+        self.op.Classifier.setValue(classifier)
+        self.op.LabelsCount.setValue(2)
+        self.times = list(range(num_frames))
+
+    def _predict(self):
+        self.op.Classifier.setDirty(slice(None))  # forget the predictions of the previous run
+        self.op.Probabilities(self.times).wait()
+
+    def time_batched(self, num_frames):
+        self._predict()
+
+    def time_per_frame(self, num_frames):
+        self.op.PREDICTION_BATCH_ROWS = 1
+        self._predict()
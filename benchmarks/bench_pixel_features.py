@@ -0,0 +1,39 @@
+"""
+OpPixelFeaturesPresmoothed for every feature and scale separately.
+"""
+
+import numpy
+import vigra
+
+from lazyflow.graph import Graph
+from lazyflow.operators import OpPixelFeaturesPresmoothed
+
+FEATURE_IDS = [
+    "GaussianSmoothing",
+    "LaplacianOfGaussian",
+    "GaussianGradientMagnitude",
+    "DifferenceOfGaussians",
+    "StructureTensorEigenvalues",
+    "HessianOfGaussianEigenvalues",
+]
+
+
+class TimePixelFeatures:
+    params = (FEATURE_IDS, [0.7, 1.6, 5.0, 10.0], [False, True])
+    param_names = ["feature", "sigma", "in2d"]
+    timeout = 120
+
+    def setup(self, feature, sigma, in2d):
+        data = numpy.random.rand(1, 1, 64, 256, 256).astype(numpy.float32)
+        self.op = OpPixelFeaturesPresmoothed(graph=Graph())
+        self.op.Scales.setValue([sigma])
+        self.op.FeatureIds.setValue([feature])
+        self.op.SelectionMatrix.setValue(numpy.ones((1, 1), dtype=bool))
+        self.op.ComputeIn2d.setValue([in2d])
+        self.op.Input.setValue(vigra.taggedView(data, "tczyx"))
+
+    def time_compute(self, feature, sigma, in2d):
+        self.op.Output[:].wait()
+
+    def peakmem_compute(self, feature, sigma, in2d):
+        self.op.Output[:].wait()
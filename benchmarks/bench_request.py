@@ -0,0 +1,42 @@
+"""
+Overhead of the lazyflow request system.
+"""
+
+from lazyflow.request import Request, RequestPool
+
+
+def _noop():
+    return None
+
+
+class TimeRequest:
+    params = [1, 100, 1000]
+    param_names = ["num_requests"]
+
+    def time_spawn_and_wait(self, num_requests):
+        for _ in range(num_requests):
+            Request(_noop).wait()
+
+    def time_nested_wait(self, num_requests):
+        def parent():
+            for _ in range(num_requests):
+                Request(_noop).wait()
+
+        Request(parent).wait()
+
+
+class TimeThreadPool:
+    params = ([0, 1, 4, 8], [1000])
+    param_names = ["num_workers", "num_requests"]
+
+    def setup(self, num_workers, num_requests):
+        Request.reset_thread_pool(num_workers)
+
+    def teardown(self, num_workers, num_requests):
+        Request.reset_thread_pool()
+
+    def time_request_pool(self, num_workers, num_requests):
+        pool = RequestPool()
+        for _ in range(num_requests):
+            pool.add(Request(_noop))
+        pool.wait()
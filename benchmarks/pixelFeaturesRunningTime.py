@@ -0,0 +1,69 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2014, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+#           http://ilastik.org/license.html
+###############################################################################
+"""
+Running time of OpPixelFeaturesPresmoothed for a single tczyx request with several
+time points and channels, for different numbers of worker threads.
+"""
+import numpy as np
+import vigra
+
+from lazyflow.graph import Graph
+from lazyflow.operators import OpPixelFeaturesPresmoothed
+from lazyflow.request import Request
+from lazyflow.utility import Timer
+
+SCALES = [0.7, 1.0, 1.6, 3.5, 5.0]
+FEATURE_IDS = [
+    "GaussianSmoothing",
+    "LaplacianOfGaussian",
+    "GaussianGradientMagnitude",
+    "DifferenceOfGaussians",
+    "StructureTensorEigenvalues",
+    "HessianOfGaussianEigenvalues",
+]
+
+
+def tczyxImage(shape=(4, 3, 32, 128, 128)):
+    img = np.random.rand(*shape).astype(np.float32).view(vigra.VigraArray)
+    img.axistags = vigra.defaultAxistags("tczyx")
+    return img
+
+
+class PixelFeaturesTimeComparison(object):
+    def __init__(self, shape=(4, 3, 32, 128, 128)):
+        self.op = OpPixelFeaturesPresmoothed(graph=Graph())
+        self.op.Scales.setValue(SCALES)
+        self.op.FeatureIds.setValue(FEATURE_IDS)
+        self.op.SelectionMatrix.setValue(np.ones((len(FEATURE_IDS), len(SCALES)), dtype=bool))
+        self.op.ComputeIn2d.setValue([False] * len(SCALES))
+        self.op.Input.setValue(tczyxImage(shape))
+
+    def run(self, thread_counts=(0, 1, 2, 4, 8)):
+        print("Output shape: {}".format(self.op.Output.meta.shape))
+        for num_workers in thread_counts:
+            Request.reset_thread_pool(num_workers)
+            with Timer() as timer:
+                self.op.Output[:].wait()
+            print("{} worker thread(s): {:.2f} seconds".format(num_workers, timer.seconds()))
+
+
+if __name__ == "__main__":
+    PixelFeaturesTimeComparison().run()
@@ -33,6 +33,7 @@ import numpy
 from ilastik import Project
 from ilastik.utility.commandLineProcessing import convertStringToList
 from ilastik.utility.maybe import maybe
+from lazyflow.operators.classifierOperators import trained_classifier_cache
 from lazyflow.operators.valueProviders import OpValueCache
 from lazyflow.roi import TinyVector, roiToSlice, sliceToRoi
 from lazyflow.slot import OutputSlot, Slot
@@ -637,6 +638,12 @@ class SerialClassifierSlot(SerialSlot):
         classifier_group = group.create_group(name)
         classifier.serialize_hdf5(classifier_group)
 
+        # Remember which training data the classifier belongs to, so that re-training
+        # on the same data after loading the project can re-use it.
+        training_data_hash = trained_classifier_cache.key_of(classifier)
+        if training_data_hash is not None:
+            group[name].attrs["training_data_hash"] = training_data_hash
+
     def deserialize(self, group):
         """
         Have to override this to ensure that dirty is always set False.
@@ -674,6 +681,10 @@ class SerialClassifierSlot(SerialSlot):
         # retrained.)
         self.cache.forceValue(classifier)
 
+        training_data_hash = classifierGroup.attrs.get("training_data_hash")
+        if training_data_hash is not None:
+            trained_classifier_cache.put(training_data_hash, classifier)
+
 
 class SerialCountingSlot(SerialSlot):
     """For saving a random forest classifier."""
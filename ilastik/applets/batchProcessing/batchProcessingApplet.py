@@ -12,6 +12,8 @@ from ilastik.applets.base.applet import Applet
 from ilastik.applets.dataExport.opDataExport import OpDataExport
 from ilastik.applets.dataSelection import DataSelectionApplet
 from ilastik.applets.dataSelection.opDataSelection import DatasetInfo, OpMultiLaneDataSelectionGroup
+from lazyflow.operators.classifierOperators import prediction_batcher
+from lazyflow.request import Request, RequestPool
 
 logger = logging.getLogger(__name__)  # noqa
 
@@ -94,19 +96,38 @@ class BatchProcessingApplet(Applet):
             default=default_block_roi,
         )
 
+        parser.add_argument(
+            "--lanes_per_batch",
+            "--lanes-per-batch",
+            help=textwrap.dedent(
+                """
+                Number of input datasets to process at the same time (default: 1).
+                With many small images, processing several of them together lets them share worker threads and
+                classifier calls, which can be considerably faster. Not supported in distributed mode.
+                """
+            ),
+            type=int,
+            default=1,
+        )
+
         parsed_args, unused_args = parser.parse_known_args(cmdline_args)
+        if parsed_args.lanes_per_batch < 1:
+            parser.error("--lanes_per_batch must be at least 1")
         return parsed_args, unused_args
 
     def run_export_from_parsed_args(self, parsed_args: argparse.Namespace):
         "Run the export for each dataset listed in parsed_args as interpreted by DataSelectionApplet."
+        lanes_per_batch = getattr(parsed_args, "lanes_per_batch", 1)
         if parsed_args.distributed:
             export_function = partial(self.do_distributed_export, block_roi=parsed_args.distributed_block_roi)
+            lanes_per_batch = 1
         else:
             export_function = self.do_normal_export
 
         return self.run_export(
             lane_configs=self.dataSelectionApplet.lane_configs_from_parsed_args(parsed_args),
             export_function=export_function,
+            lanes_per_batch=lanes_per_batch,
         )
 
     def run_export(
@@ -114,6 +135,7 @@ class BatchProcessingApplet(Applet):
         lane_configs: List[Dict[str, Optional[DatasetInfo]]],
         export_to_array: bool = False,
         export_function: Optional[Callable] = None,
+        lanes_per_batch: int = 1,
     ) -> Union[List[str], List[numpy.array]]:
         """Run the export for each dataset listed in role_data_dict
 
@@ -133,6 +155,8 @@ class BatchProcessingApplet(Applet):
             export_to_array: If True do NOT export to disk as usual.
               Instead, export the results to a list of arrays, which is returned.
               If False, return a list of the filenames we produced to.
+            lanes_per_batch: If larger than 1, that many lanes are appended at once and exported concurrently
+              (see export_datasets).
 
         Returns:
             list containing either strings of paths to exported files,
@@ -144,11 +168,25 @@ class BatchProcessingApplet(Applet):
         self.progressSignal(0)
         try:
             results = []
-            for batch_index, lane_config in enumerate(lane_configs):
 
-                def lerpProgressSignal(a, b, p):
-                    self.progressSignal((100 - p) * a + p * b)
+            def lerpProgressSignal(a, b, p):
+                self.progressSignal((100 - p) * a + p * b)
 
+            if lanes_per_batch > 1:
+                for batch_start in range(0, len(lane_configs), lanes_per_batch):
+                    batch_configs = lane_configs[batch_start : batch_start + lanes_per_batch]
+                    global_progress_start = batch_start / len(lane_configs)
+                    global_progress_end = (batch_start + len(batch_configs)) / len(lane_configs)
+
+                    results += self.export_datasets(
+                        batch_configs,
+                        export_function=export_function,
+                        progress_callback=partial(lerpProgressSignal, global_progress_start, global_progress_end),
+                    )
+                self.dataExportApplet.post_process_entire_export()
+                return results
+
+            for batch_index, lane_config in enumerate(lane_configs):
                 global_progress_start = batch_index / len(lane_configs)
                 global_progress_end = (batch_index + 1) / len(lane_configs)
 
@@ -201,3 +239,66 @@ class BatchProcessingApplet(Applet):
             return result
         finally:
             self.dataSelectionApplet.dropLastLane()
+
+    def export_datasets(
+        self,
+        lane_configs: List[Dict[str, DatasetInfo]],
+        export_function: Optional[Callable[[OpDataExport], Union[str, numpy.array]]] = None,
+        progress_callback: Optional[Callable[[int], None]] = None,
+    ) -> List[Union[str, numpy.array]]:
+        """
+        Like export_dataset, but for several datasets at once:
+        Appends one lane per dataset, exports all of them concurrently and removes the lanes again.
+
+        Exporting many small images this way keeps all worker threads busy and lets the prediction
+        of blocks from different images be batched into a single classifier call (see PredictionBatcher).
+        """
+        export_function = export_function or self.do_normal_export
+        progress_callback = progress_callback or self.progressSignal
+
+        # Call customization hook
+        self.dataExportApplet.prepare_for_entire_export()
+        first_lane_index = self.dataSelectionApplet.num_lanes
+        num_pushed_lanes = 0
+        try:
+            for lane_config in lane_configs:
+                self.dataSelectionApplet.pushLane(lane_config)
+                num_pushed_lanes += 1
+
+            lane_indexes = list(range(first_lane_index, first_lane_index + num_pushed_lanes))
+            lane_progress = [0] * len(lane_indexes)
+
+            def handle_lane_progress(i, p):
+                lane_progress[i] = p
+                progress_callback(sum(lane_progress) / len(lane_progress))
+
+            opDataExports = []
+            for i, lane_index in enumerate(lane_indexes):
+                # Call customization hook
+                self.dataExportApplet.prepare_lane_for_export(lane_index)
+                opDataExport = self.dataExportApplet.topLevelOperator.getLane(lane_index)
+                opDataExport.progressSignal.subscribe(partial(handle_lane_progress, i))
+                opDataExports.append(opDataExport)
+
+            results = [None] * len(opDataExports)
+
+            def export_lane(i):
+                results[i] = export_function(opDataExports[i])
+
+            with prediction_batcher.batching():
+                if Request.global_thread_pool.num_workers == 0:
+                    for i in range(len(opDataExports)):
+                        export_lane(i)
+                else:
+                    pool = RequestPool()
+                    for i in range(len(opDataExports)):
+                        pool.add(Request(partial(export_lane, i)))
+                    pool.wait()
+
+            for lane_index in lane_indexes:
+                # Call customization hook
+                self.dataExportApplet.post_process_lane_export(lane_index)
+            return results
+        finally:
+            for _ in range(num_pushed_lanes):
+                self.dataSelectionApplet.dropLastLane()
@@ -21,35 +21,236 @@
 # Built-in
 from __future__ import division
 import logging
+import threading
+from collections import OrderedDict
+from functools import partial
 
 # Third-party
 import numpy
 
 # lazyflow
 from lazyflow.graph import Operator, InputSlot, OutputSlot
-from lazyflow.request import RequestLock, RequestPool
+from lazyflow.request import Request, RequestLock, RequestPool
 from lazyflow.roi import getIntersectingBlocks, getBlockBounds, getIntersection, roiToSlice, TinyVector
 from lazyflow.operators import OpSubRegion, OpMultiArrayStacker, OpBlockedArrayCache
 from lazyflow.stype import Opaque
 from lazyflow.rtype import List
+from lazyflow.utility import Memory
 
 # ilastik
 from ilastik.utility import bind
-from ilastik.applets.objectExtraction.opObjectExtraction import OpObjectExtraction
+from ilastik.applets.objectExtraction.opObjectExtraction import OpObjectExtraction, default_features_key
 from ilastik.applets.objectClassification.opObjectClassification import (
-    OpObjectPredict,
     OpRelabelSegmentation,
     OpMaxLabel,
     OpMultiRelabelSegmentation,
+    make_feature_array,
+    replace_missing,
 )
 from ilastik.applets.base.applet import DatasetConstraintError
 
 logger = logging.getLogger(__name__)
 
 
+class BlockObjectRegistry(object):
+    """
+    The object probabilities of the block pipelines of OpBlockwiseObjectClassification, for the objects
+    that are seen by more than one pipeline (because they are in the halo of a block).
+
+    An object is identified by its time slice, bounding box and size in global coordinates, and is
+    owned by the block that contains the center of its bounding box. Results of the owner take
+    precedence over results of other blocks.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}  # key -> (probabilities, whether they are the owner's)
+        self.generation = 0  # results computed before the last clear() are not stored
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.generation += 1
+
+    def lookup(self, keys, owned):
+        """
+        :param keys: the object keys
+        :param owned: for each object, whether it is owned by the block asking
+        :returns: for each object, the probabilities to use, or None if it must be predicted
+            (the owner only uses its own results)
+        """
+        results = []
+        with self._lock:
+            for key, is_owner in zip(keys, owned):
+                probabilities, from_owner = self._entries.get(key, (None, False))
+                results.append(probabilities if from_owner or not is_owner else None)
+        return results
+
+    def publish(self, keys, probabilities, owned, generation):
+        with self._lock:
+            if generation != self.generation:
+                return
+            for key, object_probabilities, is_owner in zip(keys, probabilities, owned):
+                if is_owner or key not in self._entries:
+                    self._entries[key] = (object_probabilities, is_owner)
+
+
+class OpBlockObjectPredict(Operator):
+    """
+    Predicts the objects of a block pipeline, like OpObjectPredict, but takes the results of the objects
+    that are seen by neighbouring block pipelines, too, from a BlockObjectRegistry (see there) if possible.
+
+    So each of these objects is predicted by its owner block only, unless the owner has not been
+    computed yet. In that case, it is predicted once more, and the other blocks share this result until
+    the owner's is available. (If an object, including the margin of its features, lies in both blocks
+    with halo, it has the same features, and thus the same result, in both.) Objects that lie in the halo
+    only are not predicted at all (their probabilities are zero), they are not part of the block's output.
+    """
+
+    Features = InputSlot(rtype=List, stype=Opaque)
+    SelectedFeatures = InputSlot(rtype=List, stype=Opaque)
+    Classifier = InputSlot()
+    LabelsCount = InputSlot(stype="integer")
+    ObjectRegistry = InputSlot()
+    HaloOffset = InputSlot()  # Spatial start of the block with halo, in global coordinates (xyz order)
+    BlockBounds = InputSlot()  # Spatial (start, stop) of the block, in global coordinates (xyz order)
+    HaloPadding = InputSlot()  # Spatial halo padding of all blocks (xyz order)
+
+    Predictions = OutputSlot(stype=Opaque, rtype=List)
+    Probabilities = OutputSlot(stype=Opaque, rtype=List)
+    ProbabilityChannels = OutputSlot(stype=Opaque, rtype=List, level=1)
+
+    def __init__(self, *args, **kwargs):
+        super(OpBlockObjectPredict, self).__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+        self._prob_cache = {}
+
+    def setupOutputs(self):
+        self.Predictions.meta.shape = self.Features.meta.shape
+        self.Predictions.meta.dtype = object
+        self.Predictions.meta.axistags = None
+        self.Predictions.meta.mapping_dtype = numpy.uint8
+
+        self.Probabilities.meta.shape = self.Features.meta.shape
+        self.Probabilities.meta.dtype = object
+        self.Probabilities.meta.mapping_dtype = numpy.float32
+        self.Probabilities.meta.axistags = None
+
+        self.ProbabilityChannels.resize(self.LabelsCount.value)
+        for oslot in self.ProbabilityChannels:
+            oslot.meta.shape = self.Features.meta.shape
+            oslot.meta.dtype = object
+            oslot.meta.axistags = None
+            oslot.meta.mapping_dtype = numpy.float32
+
+    def execute(self, slot, subindex, roi, result):
+        times = roi._l
+        if len(times) == 0:
+            times = list(range(self.Predictions.meta.shape[0]))
+
+        if self.Classifier.value is None:
+            # this happens if there was no data to train with
+            return dict((t, numpy.array([])) for t in times)
+
+        with self._lock:
+            times_not_cached = [t for t in times if t not in self._prob_cache]
+        if times_not_cached:
+            probabilities = self._predict(times_not_cached)
+            with self._lock:
+                self._prob_cache.update(probabilities)
+        with self._lock:
+            probabilities = {t: self._prob_cache[t] for t in times}
+
+        if slot is self.Probabilities:
+            return probabilities
+        elif slot is self.Predictions:
+            labels = dict()
+            for t in times:
+                labels[t] = 1 + numpy.argmax(probabilities[t], axis=1)
+                labels[t][0] = 0  # Background gets the zero label
+            return labels
+        elif slot is self.ProbabilityChannels:
+            return {t: probabilities[t][:, subindex[0]] for t in times}
+        else:
+            assert False, "Unknown output slot: {}".format(slot.name)
+
+    def _predict(self, times):
+        classifier = self.Classifier.value
+        selected = self.SelectedFeatures([]).wait()
+        registry = self.ObjectRegistry.value
+        generation = registry.generation
+        features = self.Features(times).wait()
+
+        probabilities = {}
+        for t in times:
+            default_features = features[t][default_features_key]
+            ndim = default_features["Coord<Minimum>"].shape[1]
+            offset = numpy.array(self.HaloOffset.value)[:ndim]
+            block_start, block_stop = numpy.array(self.BlockBounds.value)[:, :ndim]
+            padding = numpy.array(self.HaloPadding.value)[:ndim]
+            # Coord<Maximum> is inclusive (the bounding box is [mins, maxs])
+            mins = default_features["Coord<Minimum>"] + offset
+            maxs = default_features["Coord<Maximum>"] + offset
+            counts = default_features["Count"]
+            num_objects = mins.shape[0]
+
+            # Objects that lie in the halo only are not part of the output
+            in_block = numpy.all((mins < block_stop) & (maxs >= block_start), axis=1)
+
+            # Objects that reach into the halo of a neighbouring block may be seen by that block, too.
+            # (Use the center of the bounding box, which is exactly the same in all blocks.)
+            near_border = numpy.any(mins < block_start + padding, axis=1) | numpy.any(
+                maxs >= block_stop - padding, axis=1
+            )
+            shared = numpy.flatnonzero(in_block & near_border)
+            shared = shared[shared > 0]
+            centers = (mins[shared] + maxs[shared]) / 2
+            owned = numpy.all((block_start <= centers) & (centers < block_stop), axis=1)
+            keys = [(t,) + tuple(mins[i]) + tuple(maxs[i]) + tuple(counts[i]) for i in shared]
+
+            prob = numpy.zeros((num_objects, len(self.ProbabilityChannels)), dtype=numpy.float32)
+            to_predict = in_block.copy()
+            to_predict[0] = False  # Background probability is always zero
+            for i, object_probabilities in zip(shared, registry.lookup(keys, owned)):
+                if object_probabilities is not None:
+                    prob[i] = object_probabilities
+                    to_predict[i] = False
+
+            rows = numpy.flatnonzero(to_predict)
+            logger.debug("Predicting {} of {} objects of time slice {}".format(len(rows), num_objects - 1, t))
+            if len(rows) > 0:
+                row_features = {
+                    plugin_name: {name: value[rows] for name, value in plugin_features.items()}
+                    for plugin_name, plugin_features in features[t].items()
+                }
+                ftmatrix, _, _ = make_feature_array({t: row_features}, selected)
+                replace_missing(ftmatrix)
+                predicted = classifier.predict_probabilities(ftmatrix.astype(numpy.float32))
+                prob[rows, : predicted.shape[1]] = predicted
+
+                computed = to_predict[shared]
+                registry.publish(
+                    [key for key, c in zip(keys, computed) if c], prob[shared[computed]], owned[computed], generation
+                )
+            probabilities[t] = prob
+        return probabilities
+
+    def propagateDirty(self, slot, subindex, roi):
+        with self._lock:
+            self._prob_cache = {}
+        self.Predictions.setDirty(())
+        self.Probabilities.setDirty(())
+        self.ProbabilityChannels.setDirty(())
+
+
 class OpSingleBlockObjectPrediction(Operator):
     RawImage = InputSlot()
     BinaryImage = InputSlot()
+    BlockRoi = InputSlot()  # (start, stop) in global coordinates, see setBlockRoi()
+    ObjectRegistry = InputSlot()  # A BlockObjectRegistry, shared by the pipelines of all blocks
 
     SelectedFeatures = InputSlot(rtype=List, stype=Opaque)
 
@@ -109,6 +310,8 @@ class OpSingleBlockObjectPrediction(Operator):
 
         self.block_roi = block_roi  # In global coordinates
         self._halo_padding = halo_padding
+        self._forwardDirty = True
+        self.BlockRoi.setValue(tuple(map(tuple, block_roi)))
 
         self._opBinarySubRegion = OpSubRegion(parent=self)
         self._opBinarySubRegion.Input.connect(self.BinaryImage)
@@ -124,11 +327,12 @@ class OpSingleBlockObjectPrediction(Operator):
 
         self._opExtract._opRegFeats._opCache.name = "blockwise-regionfeats-cache"
 
-        self._opPredict = OpObjectPredict(parent=self)
+        self._opPredict = OpBlockObjectPredict(parent=self)
         self._opPredict.Features.connect(self._opExtract.RegionFeatures)
         self._opPredict.SelectedFeatures.connect(self.SelectedFeatures)
         self._opPredict.Classifier.connect(self.Classifier)
         self._opPredict.LabelsCount.connect(self.LabelsCount)
+        self._opPredict.ObjectRegistry.connect(self.ObjectRegistry)
         self.ObjectwisePredictions.connect(self._opPredict.Predictions)
 
         self._opPredictionImage = OpRelabelSegmentation(parent=self)
@@ -151,7 +355,26 @@ class OpSingleBlockObjectPrediction(Operator):
         self._opProbabilityCache = OpBlockedArrayCache(parent=self)
         self._opProbabilityCache.Input.connect(self._opProbabilityChannelStacker.Output)
 
+        # Forward dirty regions to our own output
+        self._opPredictionImage.Output.notifyDirty(self._handleDirtyPrediction)
+
+    def setBlockRoi(self, block_roi):
+        """
+        Point this pipeline to another block of the image, so that it can be reused instead of
+        constructing a new pipeline for the block. The results of the previous block are discarded.
+        This is not forwarded as a dirty notification, the new block has not been requested from this
+        pipeline yet.
+        """
+        # Both setupOutputs (which points the internal operators to the new block) and propagateDirty
+        # make the internal pipeline dirty
+        self._forwardDirty = False
+        try:
+            self.BlockRoi.setValue(tuple(map(tuple, block_roi)))
+        finally:
+            self._forwardDirty = True
+
     def setupOutputs(self):
+        self.block_roi = self.BlockRoi.value
         tagged_input_shape = self.RawImage.meta.getTaggedShape()
         self._halo_roi = self.computeHaloRoi(
             tagged_input_shape, self._halo_padding, self.block_roi
@@ -173,6 +396,14 @@ class OpSingleBlockObjectPrediction(Operator):
 
         self._opBinarySubRegion.Roi.setValue((binary_halo_start, binary_halo_stop))
 
+        axiskeys = list(tagged_input_shape.keys())
+        spatial_indexes = [axiskeys.index(k) for k in "xyz" if k in axiskeys]
+        self._opPredict.HaloOffset.setValue(tuple(int(halo_start[i]) for i in spatial_indexes))
+        self._opPredict.BlockBounds.setValue(
+            tuple(tuple(int(coord[i]) for i in spatial_indexes) for coord in self.block_roi)
+        )
+        self._opPredict.HaloPadding.setValue(tuple(int(self._halo_padding[i]) for i in spatial_indexes))
+
         self.PredictionImage.meta.assignFrom(self._opPredictionImage.Output.meta)
         self.PredictionImage.meta.shape = tuple(numpy.subtract(self.block_roi[1], self.block_roi[0]))
 
@@ -185,9 +416,6 @@ class OpSingleBlockObjectPrediction(Operator):
         self._opPredictionCache.BlockShape.setValue(self._opPredictionCache.Input.meta.shape)
         self._opProbabilityCache.BlockShape.setValue(self._opProbabilityCache.Input.meta.shape)
 
-        # Forward dirty regions to our own output
-        self._opPredictionImage.Output.notifyDirty(self._handleDirtyPrediction)
-
     def execute(self, slot, subindex, roi, destination):
         assert slot is self.PredictionImage or slot is self.ProbabilityChannelImage, "Unknown input slot"
         assert (numpy.array(roi.stop) <= slot.meta.shape).all(), "Roi is out-of-bounds"
@@ -205,14 +433,25 @@ class OpSingleBlockObjectPrediction(Operator):
         Nothing to do here because dirty notifications are propagated
         through our internal pipeline and forwarded to our output via
         our notifyDirty handler.
+
+        Except when the pipeline is pointed to another block: then, the internal caches must be
+        cleared (the shape of the internal images is often the same as before). This is not forwarded
+        (see setBlockRoi).
         """
-        pass
+        if slot is self.BlockRoi:
+            # The features of the previous block can't be updated incrementally
+            self._opExtract._opRegFeats.forget_previous_features()
+            self._opRawSubRegion.Output.setDirty(slice(None))
+            self._opBinarySubRegion.Output.setDirty(slice(None))
 
     def _handleDirtyPrediction(self, slot, roi):
         """
         Foward dirty notifications from our internal output slot to the external one,
         but first discard the halo and offset the roi to compensate for the halo.
         """
+        if not self._forwardDirty:
+            return
+
         # Discard halo.  dirtyRoi is in internal coordinates (i.e. relative to halo start)
         dirtyRoi = getIntersection((roi.start, roi.stop), self._output_roi, assertIntersect=False)
         if dirtyRoi is not None:
@@ -249,6 +488,14 @@ class OpSingleBlockObjectPrediction(Operator):
 class OpBlockwiseObjectClassification(Operator):
     """
     Handles prediction ONLY.  Training must be provided externally and loaded via the serializer.
+
+    Blocks are computed by a pool of block pipelines (OpSingleBlockObjectPrediction). A pipeline keeps
+    the results of its block until it is pointed to another block, which is cheaper than constructing
+    a new pipeline for each block. Each pipeline computes one block at a time, and the number of
+    pipelines is limited by the number of worker threads and the RAM available for caches
+    (or by MAX_NUM_PIPELINES).
+
+    The pipelines share the predictions of objects in the halos of the blocks (see OpBlockObjectPredict).
     """
 
     RawImage = InputSlot()
@@ -263,10 +510,14 @@ class OpBlockwiseObjectClassification(Operator):
     ProbabilityChannelImage = OutputSlot()
     BlockwiseRegionFeatures = OutputSlot()
 
+    # If not None, overrides the number of block pipelines determined from the available resources
+    MAX_NUM_PIPELINES = None
+
     def __init__(self, *args, **kwargs):
         super(self.__class__, self).__init__(*args, **kwargs)
-        self._blockPipelines = {}  # indexed by blockstart
+        self._blockPipelines = OrderedDict()  # indexed by blockstart, least recently used first
         self._lock = RequestLock()
+        self._objectRegistry = BlockObjectRegistry()
 
     def setupOutputs(self):
         # Check for preconditions.
@@ -333,31 +584,31 @@ class OpBlockwiseObjectClassification(Operator):
         block_starts = getIntersectingBlocks(block_shape, roi_one_channel)
         block_starts = list(map(tuple, block_starts))
 
-        # Ensure that block pipelines exist (create first if necessary)
-        for block_start in block_starts:
-            self._ensurePipelineExists(block_start)
+        def predict_block(block_start, block_relative_intersection, destination_slice):
+            opBlockPipeline = self._acquirePipeline(block_start)
+            try:
+                block_slot = opBlockPipeline.PredictionImage
+                if slot == self.ProbabilityChannelImage:
+                    block_slot = opBlockPipeline.ProbabilityChannelImage
+                block_slot(*block_relative_intersection).writeInto(destination[destination_slice]).wait()
+            finally:
+                self._releasePipeline(opBlockPipeline)
 
         # Retrieve result from each block, and write into the appropriate region of the destination
         pool = RequestPool()
         for block_start in block_starts:
-            opBlockPipeline = self._blockPipelines[block_start]
-            block_roi = opBlockPipeline.block_roi
+            block_roi = self.get_block_roi(block_start)
             block_intersection = getIntersection(block_roi, roi_one_channel)
             block_relative_intersection = numpy.subtract(block_intersection, block_roi[0])
             destination_relative_intersection = numpy.subtract(block_intersection, roi_one_channel[0])
 
-            block_slot = opBlockPipeline.PredictionImage
             if slot == self.ProbabilityChannelImage:
-                block_slot = opBlockPipeline.ProbabilityChannelImage
                 # Add channels back to roi
                 block_relative_intersection[..., -1] = (roi.start[-1], roi.stop[-1])
                 destination_relative_intersection[..., -1] = (0, roi.stop[-1] - roi.start[-1])
 
-            # Request the data
             destination_slice = roiToSlice(*destination_relative_intersection)
-            req = block_slot(*block_relative_intersection)
-            req.writeInto(destination[destination_slice])
-            pool.add(req)
+            pool.add(Request(partial(predict_block, block_start, block_relative_intersection, destination_slice)))
         pool.wait()
 
         return destination
@@ -370,7 +621,8 @@ class OpBlockwiseObjectClassification(Operator):
                    (1,20,30,40,5) should be requested via roi [(1,2,3,4,5),(2,3,4,5,6)]
 
         Note: It is assumed that you will request these features for debug purposes, AFTER requesting the prediction image.
-              Therefore, it is considered an error to request features that are not already computed.
+              Therefore, it is considered an error to request features that are not already computed
+              (or whose pipeline has been pointed to another block since).
         """
         axiskeys = self.RawImage.meta.getAxisKeys()
         # Find the corresponding block start coordinates
@@ -408,34 +660,99 @@ class OpBlockwiseObjectClassification(Operator):
 
         return destination
 
-    def _ensurePipelineExists(self, block_start):
-        if block_start in self._blockPipelines:
-            return
-        with self._lock:
-            if block_start in self._blockPipelines:
-                return
-
-            logger.debug("Creating pipeline for block: {}".format(block_start))
-
-            block_shape = self._getFullShape(self._block_shape_dict)
-            halo_padding = self._getFullShape(self._halo_padding_dict)
+    def _acquirePipeline(self, block_start):
+        """
+        Get the pipeline for the given block, for exclusive use until _releasePipeline() is called.
+        If no pipeline computes this block at the moment, the least recently used idle pipeline is
+        pointed to it, or a new pipeline is created if the pool is not full yet.
+        Otherwise, wait for a pipeline to become idle.
+        """
+        while True:
+            opIdlePipeline = None
+            with self._lock:
+                opBlockPipeline = self._blockPipelines.get(block_start)
+                if opBlockPipeline is not None:
+                    self._blockPipelines.move_to_end(block_start)
+                elif len(self._blockPipelines) < self._maxNumPipelines():
+                    opBlockPipeline = self._createPipeline(block_start)
+                    opBlockPipeline._poolLock.acquire()
+                    self._blockPipelines[block_start] = opBlockPipeline
+                    return opBlockPipeline
+                else:
+                    for old_block_start, opCandidate in list(self._blockPipelines.items()):
+                        if opCandidate._poolLock.acquire(False):
+                            opIdlePipeline = opCandidate
+                            del self._blockPipelines[old_block_start]
+                            self._blockPipelines[block_start] = opIdlePipeline
+                            break
+                    else:
+                        # All pipelines are busy: wait for the least recently used one below
+                        opBlockPipeline = next(iter(self._blockPipelines.values()))
+
+            if opIdlePipeline is not None:
+                logger.debug("Reusing pipeline for block: {}".format(block_start))
+                try:
+                    opIdlePipeline.setBlockRoi(self.get_block_roi(block_start))
+                except:
+                    with self._lock:
+                        del self._blockPipelines[block_start]
+                    opIdlePipeline._poolLock.release()
+                    raise
+                return opIdlePipeline
+
+            opBlockPipeline._poolLock.acquire()
+            if tuple(opBlockPipeline.block_roi[0]) == tuple(block_start) and not opBlockPipeline._deleted:
+                return opBlockPipeline
+            # It has been pointed to another block in the meantime
+            opBlockPipeline._poolLock.release()
+
+    def _releasePipeline(self, opBlockPipeline):
+        opBlockPipeline._poolLock.release()
+
+    def _createPipeline(self, block_start):
+        logger.debug("Creating pipeline for block: {}".format(block_start))
+
+        halo_padding = self._getFullShape(self._halo_padding_dict)
+        block_roi = self.get_block_roi(block_start)
 
-            input_shape = self.RawImage.meta.shape
-            block_stop = getBlockBounds(input_shape, block_shape, block_start)[1]
-            block_roi = (block_start, block_stop)
+        # Instantiate pipeline
+        opBlockPipeline = OpSingleBlockObjectPrediction(block_roi, halo_padding, parent=self)
+        opBlockPipeline.RawImage.connect(self.RawImage)
+        opBlockPipeline.BinaryImage.connect(self.BinaryImage)
+        opBlockPipeline.Classifier.connect(self.Classifier)
+        opBlockPipeline.LabelsCount.connect(self.LabelsCount)
+        opBlockPipeline.SelectedFeatures.connect(self.SelectedFeatures)
+        opBlockPipeline.ObjectRegistry.setValue(self._objectRegistry)
+        opBlockPipeline._poolLock = RequestLock()
+        opBlockPipeline._deleted = False
 
-            # Instantiate pipeline
-            opBlockPipeline = OpSingleBlockObjectPrediction(block_roi, halo_padding, parent=self)
-            opBlockPipeline.RawImage.connect(self.RawImage)
-            opBlockPipeline.BinaryImage.connect(self.BinaryImage)
-            opBlockPipeline.Classifier.connect(self.Classifier)
-            opBlockPipeline.LabelsCount.connect(self.LabelsCount)
-            opBlockPipeline.SelectedFeatures.connect(self.SelectedFeatures)
+        # Forward dirtyness
+        opBlockPipeline.PredictionImage.notifyDirty(bind(self._handleDirtyBlock, opBlockPipeline))
 
-            # Forward dirtyness
-            opBlockPipeline.PredictionImage.notifyDirty(bind(self._handleDirtyBlock, block_start))
+        return opBlockPipeline
 
-            self._blockPipelines[block_start] = opBlockPipeline
+    def _maxNumPipelines(self):
+        """
+        Each pipeline caches the results of its block (with halo).
+        More pipelines than worker threads would not compute more blocks at the same time.
+        """
+        if self.MAX_NUM_PIPELINES is not None:
+            return self.MAX_NUM_PIPELINES
+
+        tagged_shape = self.RawImage.meta.getTaggedShape()
+        halo_pixels = 1
+        for k in "xyz":
+            if k in tagged_shape:
+                halo_pixels *= min(self._block_shape_dict[k] + 2 * self._halo_padding_dict[k], tagged_shape[k])
+        # raw data, label image, prediction image and probabilities
+        bytes_per_pixel = (
+            numpy.dtype(self.RawImage.meta.dtype).itemsize * tagged_shape["c"]
+            + 4
+            + numpy.dtype(self.PredictionImage.meta.dtype).itemsize
+            + 4 * self.LabelsCount.value
+        )
+        max_num_by_ram = Memory.getAvailableRamCaches() // (halo_pixels * bytes_per_pixel)
+        return int(max(1, min(Request.global_thread_pool.num_workers, max_num_by_ram)))
 
     def get_blockshape(self):
         return self._getFullShape(self.BlockShape3dDict.value)
@@ -473,20 +790,23 @@ class OpBlockwiseObjectClassification(Operator):
 
     def _deleteAllPipelines(self):
         logger.debug("Deleting all pipelines.")
-        oldBlockPipelines = self._blockPipelines
-        self._blockPipelines = {}
         with self._lock:
+            oldBlockPipelines = self._blockPipelines
+            self._blockPipelines = OrderedDict()
             for opBlockPipeline in list(oldBlockPipelines.values()):
+                opBlockPipeline._deleted = True
                 opBlockPipeline.cleanUp()
 
     def propagateDirty(self, slot, subindex, roi):
+        # The block pipelines are notified via their own inputs
+        self._objectRegistry.clear()
         if slot == self.BlockShape3dDict or slot == self.HaloPadding3dDict:
             self._deleteAllPipelines()
             self.PredictionImage.setDirty(slice(None))
 
-    def _handleDirtyBlock(self, block_start, slot, roi):
+    def _handleDirtyBlock(self, opBlockPipeline, slot, roi):
         # Convert roi from block coords to global coords
         block_relative_roi = (roi.start, roi.stop)
-        global_roi = block_relative_roi + numpy.array(block_start)
+        global_roi = block_relative_roi + numpy.array(opBlockPipeline.block_roi[0])
         logger.debug("Setting roi dirty: {}".format(global_roi))
         self.PredictionImage.setDirty(*global_roi)
@@ -25,11 +25,13 @@ import sys
 
 # lazyflow
 from lazyflow.graph import Operator, InputSlot, OutputSlot
-from lazyflow.roi import roiToSlice
+from lazyflow.roi import determine_halo_aware_blockshape, roiToSlice
 from lazyflow.operators import OpSlicedBlockedArrayCache
 from lazyflow.operators import OpPixelFeaturesPresmoothed
 from lazyflow.operators import OpReorderAxes
 from lazyflow.operatorWrapper import OperatorWrapper
+from lazyflow.request import Request
+from lazyflow.utility import Memory
 
 from ilastik.applets.featureSelection import FeatureSelectionConstraintError
 
@@ -249,6 +251,38 @@ class OpFeatureSelection(OpFeatureSelectionNoCache):
         c = tuple(c)
         self.opPixelFeatureCache.BlockShape.setValue(c)
 
+    def _get_feature_cache_blockshape(self, thin_axis):
+        """
+        Block shape of the feature cache for viewing slices orthogonal to thin_axis.
+
+        The blocks span 256 pixels in the slicing plane, their thickness along thin_axis is chosen
+        such that the halo of the feature filters does not dominate the computation.
+        """
+        # Overestimate number of feature channels:
+        # Cache block dimensions will be clipped to the size of the actual feature image
+        blockDims = {"t": 1, "c": 1000, "z": 256, "y": 256, "x": 256}
+        fixedDims = dict(blockDims)
+        fixedDims[thin_axis] = 0
+
+        tagged_halo = dict(zip("tczyx", self.opPixelFeatures.getHalo()))
+        tagged_shape = self.OutputImage.meta.getTaggedShape()
+        axisOrder = list(tagged_shape.keys())
+        # Only the spatial axes are tuned: ram_usage_per_requested_pixel already accounts for all channels
+        spatialAxes = [k for k in axisOrder if k in "zyx"]
+
+        blockshape = determine_halo_aware_blockshape(
+            data_shape=[tagged_shape[k] for k in spatialAxes],
+            halo=[tagged_halo[k] for k in spatialAxes],
+            ram_usage_per_requested_pixel=self.opPixelFeatures.Output.meta.ram_usage_per_requested_pixel,
+            num_threads=max(1, Request.global_thread_pool.num_workers),
+            available_ram=Memory.getAvailableRamComputation(),
+            max_blockshape=[blockDims[k] for k in spatialAxes],
+            fixed_blockshape=[fixedDims[k] for k in spatialAxes],
+            min_block_side=32,
+        )
+        blockDims.update(zip(spatialAxes, blockshape))
+        return tuple(blockDims[k] for k in axisOrder)
+
     def setupOutputs(self):
         super().setupOutputs()
 
@@ -257,16 +291,13 @@ class OpFeatureSelection(OpFeatureSelectionNoCache):
             self.CachedOutputImage.meta.assignFrom(self.OutputImage.meta)
 
         else:
-            # Overestimate number of feature channels:
-            # Cache block dimensions will be clipped to the size of the actual feature image
-            blockDimsX = {"t": 1, "c": 1000, "z": 256, "y": 256, "x": 32}
-            blockDimsY = {"t": 1, "c": 1000, "z": 256, "y": 32, "x": 256}
-            blockDimsZ = {"t": 1, "c": 1000, "z": 32, "y": 256, "x": 256}
-
-            axisOrder = self.InputImage.meta.getAxisKeys()
-            blockShapeX = tuple(blockDimsX[k] for k in axisOrder)
-            blockShapeY = tuple(blockDimsY[k] for k in axisOrder)
-            blockShapeZ = tuple(blockDimsZ[k] for k in axisOrder)
+            blockShapeX = self._get_feature_cache_blockshape("x")
+            blockShapeY = self._get_feature_cache_blockshape("y")
+            blockShapeZ = self._get_feature_cache_blockshape("z")
+            logger.info(
+                f"Pixel feature cache block shapes for halo {self.opPixelFeatures.getHalo()}: "
+                f"{blockShapeX}, {blockShapeY}, {blockShapeZ}"
+            )
 
             # Configure the cache
             self.opPixelFeatureCache.BlockShape.setValue((blockShapeX, blockShapeY, blockShapeZ))
@@ -23,9 +23,9 @@ import os
 import numpy
 import numpy.lib.recfunctions as rfn
 import vigra
+import threading
 import time
 import warnings
-import itertools
 from collections import defaultdict, OrderedDict
 from functools import partial
 
@@ -43,6 +43,7 @@ from ilastik.utility.exportFile import objects_per_frame, ExportFile, ilastik_id
 from ilastik.utility.exportingOperator import ExportingOperator
 from ilastik.applets.objectExtraction.opObjectExtraction import default_features_key
 from ilastik.applets.objectExtraction.opObjectExtraction import OpObjectExtraction
+from ilastik.applets.objectExtraction.objectFeatureTable import OpObjectFeatureTable
 from ilastik.applets.dataExport.opDataExport import DataExportPathFormatter
 
 
@@ -283,6 +284,7 @@ class OpObjectClassification(Operator, MultiLaneOperatorABC):
         opkwargs = dict(parent=self)
         self.opTrain = OpObjectTrain(parent=self)
         self.opPredict = OpMultiLaneWrapper(OpObjectPredict, **opkwargs)
+        self.opFeatureTable = OpMultiLaneWrapper(OpObjectFeatureTable, **opkwargs)
         self.opLabelsToImage = OpMultiLaneWrapper(OpRelabelSegmentation, **opkwargs)
         self.opPredictionsToImage = OpMultiLaneWrapper(OpRelabelSegmentation, **opkwargs)
         self.opPredictionImageCache = OpMultiLaneWrapper(OpSlicedBlockedArrayCache, **opkwargs)
@@ -296,7 +298,10 @@ class OpObjectClassification(Operator, MultiLaneOperatorABC):
         self.classifier_cache.name = "OpObjectClassification.classifier_cache"
 
         # connect inputs
+        self.opFeatureTable.Features.connect(self.ObjectFeatures)
+
         self.opTrain.Features.connect(self.ObjectFeatures)
+        self.opTrain.FeatureTables.connect(self.opFeatureTable.Table)
         self.opTrain.Labels.connect(self.LabelInputs)
         self.opTrain.FixClassifier.setValue(False)
         self.opTrain.SelectedFeatures.connect(self.SelectedFeatures)
@@ -308,6 +313,7 @@ class OpObjectClassification(Operator, MultiLaneOperatorABC):
         self.opMaxLabel.Inputs.connect(self.LabelInputs)
 
         self.opPredict.Features.connect(self.ObjectFeatures)
+        self.opPredict.FeatureTable.connect(self.opFeatureTable.Table)
         self.opPredict.Classifier.connect(self.classifier_cache.Output)
         self.opPredict.SelectedFeatures.connect(self.SelectedFeatures)
 
@@ -675,7 +681,6 @@ class OpObjectClassification(Operator, MultiLaneOperatorABC):
         maxs_old = old_bboxes["Coord<Maximum>"]
         mins_new = new_bboxes["Coord<Minimum>"]
         maxs_new = new_bboxes["Coord<Maximum>"]
-        nobj_old = mins_old.shape[0]
         nobj_new = mins_new.shape[0]
         if axistags is None:
             axistags = "xyz"
@@ -683,90 +688,48 @@ class OpObjectClassification(Operator, MultiLaneOperatorABC):
         data2D = False
         if mins_old.shape[1] == 2:
             data2D = True
+        axes = [axistags.index(a) for a in ("xy" if data2D else "xyz")]
 
-        class bbox(object):
-            def __init__(self, minmaxs, axistags):
-                self.xmin = minmaxs[0][axistags.index("x")]
-                self.ymin = minmaxs[0][axistags.index("y")]
-                if not data2D:
-                    self.zmin = minmaxs[0][axistags.index("z")]
-                else:
-                    self.zmin = 0
-                self.xmax = minmaxs[1][axistags.index("x")]
-                self.ymax = minmaxs[1][axistags.index("y")]
-                if not data2D:
-                    self.zmax = minmaxs[1][axistags.index("z")]
-                else:
-                    self.zmax = 0
-                self.rad_x = 0.5 * (self.xmax - self.xmin)
-                self.cent_x = self.xmin + self.rad_x
-                self.rad_y = 0.5 * (self.ymax - self.ymin)
-                self.cent_y = self.ymin + self.rad_y
-                self.rad_z = 0.5 * (self.zmax - self.zmin)
-                self.cent_z = self.zmin + self.rad_z
-
-            @staticmethod
-            def overlap(bbox_tuple):
-                this = bbox_tuple[0]
-                that = bbox_tuple[1]
-                over_x = this.rad_x + that.rad_x - (abs(this.cent_x - that.cent_x))
-                over_y = this.rad_y + that.rad_y - (abs(this.cent_y - that.cent_y))
-                over_z = this.rad_z + that.rad_z - (abs(this.cent_z - that.cent_z))
-                if not data2D:
-                    if over_x > 0 and over_y > 0 and over_z > 0:
-                        return over_x * over_y * over_z
-                else:
-                    if over_x > 0 and over_y > 0:
-                        return over_x * over_y
-                return 0
+        def centers_and_radii(mins, maxs):
+            rads = 0.5 * (maxs[:, axes] - mins[:, axes])
+            return mins[:, axes] + rads, rads
 
-        nonzeros = numpy.nonzero(old_labels)[0]
-        bboxes_old = [bbox(x, axistags) for x in zip(mins_old[nonzeros], maxs_old[nonzeros])]
-        bboxes_new = [bbox(x, axistags) for x in zip(mins_new, maxs_new)]
+        def center(cents, iobj):
+            if data2D:
+                return tuple(cents[iobj]) + (0.0,)
+            return tuple(cents[iobj])
 
+        nonzeros = numpy.nonzero(old_labels)[0]
+        cents_old, rads_old = centers_and_radii(mins_old[nonzeros], maxs_old[nonzeros])
         # remove background
         # FIXME: assuming background is 0 again
-        bboxes_new = bboxes_new[1:]
-
-        double_for_loop = itertools.product(bboxes_old, bboxes_new)
-        overlaps = list(map(bbox.overlap, double_for_loop))
+        cents_new, rads_new = centers_and_radii(mins_new[1:], maxs_new[1:])
+        index = _BoundingBoxIndex(cents_new, rads_new)
 
-        overlaps = numpy.asarray(overlaps)
-        overlaps = overlaps.reshape((len(bboxes_old), len(bboxes_new)))
         new_labels = numpy.zeros((nobj_new,), dtype=numpy.uint32)
         old_labels_lost = dict()
         old_labels_lost["full"] = []
         old_labels_lost["partial"] = []
         new_labels_lost = dict()
         new_labels_lost["conflict"] = []
-        for iobj in range(overlaps.shape[0]):
+        matches = defaultdict(list)  # new object -> old objects, that overlap with it most
+        for iobj in range(len(nonzeros)):
             # take the object with maximum overlap
-            overlapsum = numpy.sum(overlaps[iobj, :])
-            if overlapsum == 0:
-                old_labels_lost["full"].append(
-                    (bboxes_old[iobj].cent_x, bboxes_old[iobj].cent_y, bboxes_old[iobj].cent_z)
-                )
+            candidates, overlaps = index.overlaps(cents_old[iobj], rads_old[iobj])
+            if len(candidates) == 0:
+                old_labels_lost["full"].append(center(cents_old, iobj))
                 continue
-            newindex = numpy.argmax(overlaps[iobj, :])
-            if overlapsum - overlaps[iobj, newindex] > 0:
+            if len(candidates) > 1:
                 # this object overlaps with more than one new object
-                old_labels_lost["partial"].append(
-                    (bboxes_old[iobj].cent_x, bboxes_old[iobj].cent_y, bboxes_old[iobj].cent_z)
-                )
-
-            overlaps[iobj, :] = 0
-            overlaps[iobj, newindex] = 1  # doesn't matter what number>0
+                old_labels_lost["partial"].append(center(cents_old, iobj))
+            matches[candidates[numpy.argmax(overlaps)]].append(iobj)
 
-        for iobj in range(overlaps.shape[1]):
-            labels = numpy.where(overlaps[:, iobj] > 0)[0]
-            if labels.shape[0] == 1:
-                new_labels[iobj + 1] = old_labels[nonzeros[labels[0]]]  # iobj+1 because of the background
-            elif labels.shape[0] > 1:
-                new_labels_lost["conflict"].append(
-                    (bboxes_new[iobj].cent_x, bboxes_new[iobj].cent_y, bboxes_new[iobj].cent_z)
-                )
+        for iobj in sorted(matches):
+            if len(matches[iobj]) == 1:
+                new_labels[iobj + 1] = old_labels[nonzeros[matches[iobj][0]]]  # iobj+1 because of the background
+            else:
+                new_labels_lost["conflict"].append(center(cents_new, iobj))
 
-        new_labels = new_labels
         new_labels[0] = 0  # FIXME: hardcoded background value again
         return new_labels, old_labels_lost, new_labels_lost
 
@@ -988,6 +951,29 @@ def make_feature_array(feats, selected, labels=None):
     return featMatrix, row_names, col_names
 
 
+def make_feature_array_from_table(table, times, selected, labels=None):
+    """Like make_feature_array, for the given time slices of an ObjectFeatureTable."""
+    times = sorted(times)
+    if labels is None:
+        featMatrix, col_names = table.feature_matrix(selected, times)
+        return featMatrix, [], col_names
+
+    rows = {}
+    row_names = []
+    labellist = []
+    for t in times:
+        lab = numpy.asarray(labels[t]).reshape(-1)
+        index = numpy.nonzero(lab)[0]
+        rows[t] = index
+        row_names.extend((t, obj) for obj in index)
+        labellist.append(lab[index])
+
+    featMatrix, col_names = table.feature_matrix(selected, times, rows)
+    labelsMatrix = _concatenate(labellist, axis=0)
+    assert labelsMatrix.shape[0] == featMatrix.shape[0]
+    return featMatrix, row_names, col_names, labelsMatrix
+
+
 def replace_missing(a):
     rows, cols = numpy.where(numpy.isnan(a) + numpy.isinf(a))
     idx = (rows, cols)
@@ -997,6 +983,46 @@ def replace_missing(a):
     return rows, cols
 
 
+class _BoundingBoxIndex(object):
+    """
+    Finds the bounding boxes that overlap with a given box, for OpObjectClassification.transferLabels.
+
+    Boxes are given by their centers and radii (half extents). They are grouped by their radius along
+    the first axis (powers of 2), and sorted by their center along the first axis within each group,
+    so that the candidates for an overlap are found with one binary search per group.
+    """
+
+    def __init__(self, cents, rads):
+        self._cents = cents
+        self._rads = rads
+        self._groups = []
+        if len(cents) == 0:
+            return
+        groups = numpy.ceil(numpy.log2(1 + numpy.maximum(rads[:, 0], 0)))
+        for group in numpy.unique(groups):
+            indices = numpy.nonzero(groups == group)[0]
+            indices = indices[numpy.argsort(cents[indices, 0], kind="stable")]
+            self._groups.append((indices, cents[indices, 0], rads[indices, 0].max()))
+
+    def overlaps(self, cent, rad):
+        """
+        :returns: the indices (in ascending order) of the boxes that overlap with the given box
+            along all axes, and the overlap volumes
+        """
+        candidates = []
+        for indices, sorted_cents, max_rad in self._groups:
+            # generous, the exact test is below
+            reach = rad[0] + max_rad + 1
+            start = numpy.searchsorted(sorted_cents, cent[0] - reach, side="left")
+            stop = numpy.searchsorted(sorted_cents, cent[0] + reach, side="right")
+            candidates.append(indices[start:stop])
+        candidates = numpy.sort(numpy.concatenate(candidates)) if candidates else numpy.zeros((0,), dtype=int)
+
+        over = rad + self._rads[candidates] - numpy.abs(cent - self._cents[candidates])
+        overlapping = numpy.all(over > 0, axis=1)
+        return candidates[overlapping], numpy.prod(over[overlapping], axis=1)
+
+
 class OpObjectTrain(Operator):
     """Trains a random forest on all labeled objects."""
 
@@ -1007,6 +1033,8 @@ class OpObjectTrain(Operator):
     Labels = InputSlot(level=1, stype=Opaque, rtype=List)
     LabelsCount = InputSlot(stype="int")
     Features = InputSlot(level=1, rtype=List, stype=Opaque)
+    # If given, the feature matrix is assembled from these (see OpObjectFeatureTable) instead of Features
+    FeatureTables = InputSlot(level=1, rtype=List, stype=Opaque, optional=True)
     SelectedFeatures = InputSlot(rtype=List, stype=Opaque)
     FixClassifier = InputSlot(stype="bool")
     ForestCount = InputSlot(stype="int", value=1)
@@ -1070,9 +1098,14 @@ class OpObjectTrain(Operator):
                 return
             # compute the features if there are nonzero labels in this image
             # and only for the time steps, which have labels
-            feats = self.Features[lane_index](nztimes).wait()
-
-            featstmp, row_names, col_names, labelstmp = make_feature_array(feats, selected, labels_image_filtered)
+            if len(self.FeatureTables) > lane_index and self.FeatureTables[lane_index].ready():
+                table = self.FeatureTables[lane_index](nztimes).wait()
+                featstmp, row_names, col_names, labelstmp = make_feature_array_from_table(
+                    table, nztimes, selected, labels_image_filtered
+                )
+            else:
+                feats = self.Features[lane_index](nztimes).wait()
+                featstmp, row_names, col_names, labelstmp = make_feature_array(feats, selected, labels_image_filtered)
             if labelstmp.size == 0 or featstmp.size == 0:
                 return
 
@@ -1154,6 +1187,8 @@ class OpObjectPredict(Operator):
     name = "OpObjectPredict"
 
     Features = InputSlot(rtype=List, stype=Opaque)
+    # If given, the feature matrices are assembled from this (see OpObjectFeatureTable) instead of Features
+    FeatureTable = InputSlot(rtype=List, stype=Opaque, optional=True)
     SelectedFeatures = InputSlot(rtype=List, stype=Opaque)
     Classifier = InputSlot()
     LabelsCount = InputSlot(stype="integer")
@@ -1166,6 +1201,10 @@ class OpObjectPredict(Operator):
     BadObjects = OutputSlot(stype=Opaque, rtype=List)
     UncertaintyEstimate = OutputSlot(stype=Opaque, rtype=List)
 
+    # Time slices are predicted in batches of up to this many objects
+    # (a time slice with more objects is a batch of its own)
+    PREDICTION_BATCH_ROWS = 2**16
+
     def setupOutputs(self):
         self.Predictions.meta.shape = self.Features.meta.shape
         self.Predictions.meta.dtype = object
@@ -1225,7 +1264,6 @@ class OpObjectPredict(Operator):
             # this happens if there was no data to train with
             return dict((t, numpy.array([])) for t in times)
 
-        feats = {}
         prob_predictions = {}
 
         selected = self.SelectedFeatures([]).wait()
@@ -1242,47 +1280,61 @@ class OpObjectPredict(Operator):
             times_not_cached = [t for t in times if t not in self.prob_cache]
 
         # Initialize with a single value for the 'background object '
+        table = None
         if times_not_cached:
-            tmpfeats = self.Features(times_not_cached).wait()
+            if self.FeatureTable.ready():
+                table = self.FeatureTable(times_not_cached).wait()
+            else:
+                tmpfeats = self.Features(times_not_cached).wait()
 
+        # the number of objects (including the background) of the time slices with objects to predict
+        num_rows = {}
         for t in times_not_cached:
             prob_predictions[t] = numpy.zeros((1, len(self.ProbabilityChannels)), dtype=numpy.float32)
-            num_objects = get_num_objects(tmpfeats[t])  # tmpfeats[t])
+            if table is not None:
+                num_objects = table.num_rows(t)
+            else:
+                num_objects = get_num_objects(tmpfeats[t])  # tmpfeats[t])
             # Apparently self.Features always returns a background object,
             #  so we expect at least 1 object in the list, even if there's nothing to predict.
             assert num_objects > 0
-            if num_objects == 1:
-                continue
+            if num_objects > 1:
+                num_rows[t] = num_objects
 
-            ftmatrix, _, col_names = make_feature_array({t: tmpfeats[t]}, selected)
+        def predict_batch(batch):
+            if table is not None:
+                ftmatrix, _, col_names = make_feature_array_from_table(table, batch, selected)
+            else:
+                ftmatrix, _, col_names = make_feature_array({t: tmpfeats[t] for t in batch}, selected)
             rows, cols = replace_missing(ftmatrix)
-            self.bad_objects[t] = numpy.zeros((ftmatrix.shape[0],))
-            self.bad_objects[t][rows] = 1
-            self.uncertainty_estimate[t] = numpy.zeros((ftmatrix.shape[0],))
-            self.uncertainty_estimate[t][rows] = 1
-            feats[t] = ftmatrix
-
-        # Are there any objects to predict?
-        if len(feats) > 0:
-
-            def predict_forest(_t):
-                # Note: We can't use RandomForest.predictLabels() here because we're training in parallel,
-                #        and we have to average the PROBABILITIES from all forests.
-                #       Averaging the label predictions from each forest is NOT equivalent.
-                #       For details please see wikipedia:
-                #       http://en.wikipedia.org/wiki/Electoral_College_%28United_States%29#Irrelevancy_of_national_popular_vote
-                #       (^-^)
-                prob_predictions[_t] = classifier.predict_probabilities(feats[_t].astype(numpy.float32))
-
-            # predict the data with all the forests in parallel
-            pool = RequestPool()
-            for t in times_not_cached:
-                logger.debug("Predicting object probabilities for time step: {}".format(t))
-                req = Request(partial(predict_forest, t))
-                pool.add(req)
-
-            pool.wait()
-            pool.clean()
+            bad_rows = numpy.zeros((ftmatrix.shape[0],))
+            bad_rows[rows] = 1
+
+            # Note: We can't use RandomForest.predictLabels() here because we're training in parallel,
+            #        and we have to average the PROBABILITIES from all forests.
+            #       Averaging the label predictions from each forest is NOT equivalent.
+            #       For details please see wikipedia:
+            #       http://en.wikipedia.org/wiki/Electoral_College_%28United_States%29#Irrelevancy_of_national_popular_vote
+            #       (^-^)
+            probabilities = classifier.predict_probabilities(ftmatrix.astype(numpy.float32))
+
+            # make_feature_array stacks the time slices in sorted order
+            start = 0
+            for t in batch:
+                stop = start + num_rows[t]
+                self.bad_objects[t] = bad_rows[start:stop]
+                self.uncertainty_estimate[t] = bad_rows[start:stop].copy()
+                prob_predictions[t] = probabilities[start:stop]
+                start = stop
+
+        # Small time slices are predicted together (with one call to the classifier),
+        # the batches (and the forests within a batch) in parallel
+        pool = RequestPool()
+        for batch in self._predictionBatches(num_rows, self.PREDICTION_BATCH_ROWS):
+            logger.debug("Predicting object probabilities for time steps: {}".format(batch))
+            pool.add(Request(partial(predict_batch, batch)))
+        pool.wait()
+        pool.clean()
 
         with self.lock:
             for t in times:
@@ -1342,6 +1394,28 @@ class OpObjectPredict(Operator):
             else:
                 assert False, "Unknown input slot"
 
+    @staticmethod
+    def _predictionBatches(num_rows, max_rows):
+        """
+        Group the time slices into batches of consecutive time slices with at most max_rows rows in total
+
+        >>> OpObjectPredict._predictionBatches({0: 2**15, 1: 2**15, 2: 2**17, 4: 10, 5: 2}, 2**16)
+        [[0, 1], [2], [4, 5]]
+        """
+        batches = []
+        batch = []
+        batch_rows = 0
+        for t in sorted(num_rows):
+            if batch and batch_rows + num_rows[t] > max_rows:
+                batches.append(batch)
+                batch = []
+                batch_rows = 0
+            batch.append(t)
+            batch_rows += num_rows[t]
+        if batch:
+            batches.append(batch)
+        return batches
+
     def propagateDirty(self, slot, subindex, roi):
         self.prob_cache = {}
         if slot is self.InputProbabilities:
@@ -1369,10 +1443,52 @@ class OpRelabelSegmentation(Operator):
     loggingName = __name__ + ".OpRelabelSegmentation"
     logger = logging.getLogger(loggingName)
 
+    def __init__(self, *args, **kwargs):
+        super(OpRelabelSegmentation, self).__init__(*args, **kwargs)
+        # Per time point: the lookup table from object ids to ObjectMap values.
+        # Reset when the ObjectMap or the Image become dirty.
+        self._luts = {}
+        self._luts_generation = 0
+        self._luts_lock = threading.Lock()
+
     def setupOutputs(self):
         self.Output.meta.assignFrom(self.Image.meta)
         self.Output.meta.dtype = self.ObjectMap.meta.mapping_dtype
 
+    def _getLut(self, t):
+        with self._luts_lock:
+            lut = self._luts.get(t)
+            generation = self._luts_generation
+        if lut is not None:
+            return lut, generation
+
+        lut = self.ObjectMap([t]).wait()[t]
+        # FIXME: necessary because predictions are returned
+        # enclosed in a list.
+        if isinstance(lut, list):
+            lut = lut[0]
+        lut = lut.squeeze()
+        if lut.ndim == 0:
+            # no objects, nothing to paint
+            lut = numpy.zeros((1,), dtype=lut.dtype)
+        self._storeLut(t, lut, generation)
+        return lut, generation
+
+    def _storeLut(self, t, lut, generation):
+        with self._luts_lock:
+            # Don't store a lookup table computed from inputs that became dirty in the meantime
+            if generation == self._luts_generation:
+                self._luts[t] = lut
+
+    def _forgetLuts(self, times=None):
+        with self._luts_lock:
+            if times is None:
+                self._luts.clear()
+            else:
+                for t in times:
+                    self._luts.pop(t, None)
+            self._luts_generation += 1
+
     def execute(self, slot, subindex, roi, result):
         tStart = time.perf_counter()
 
@@ -1380,47 +1496,36 @@ class OpRelabelSegmentation(Operator):
         img = self.Image(roi.start, roi.stop).wait()
         tIMG = 1000.0 * (time.perf_counter() - tIMG)
 
+        tLUT = 0.0
+        tWORK = 0.0
         for t in range(roi.start[0], roi.stop[0]):
+            tile = img[t - roi.start[0]]
 
-            tMAP = time.perf_counter()
-            map_ = self.ObjectMap([t]).wait()
-            tmap = map_[t]
-            # FIXME: necessary because predictions are returned
-            # enclosed in a list.
-            if isinstance(tmap, list):
-                tmap = tmap[0]
-            tmap = tmap.squeeze()
-            if tmap.ndim == 0:
-                # no objects, nothing to paint
-                result[t - roi.start[0]][:] = 0
-                return result
-
-            tMAP = 1000.0 * (time.perf_counter() - tMAP)
-            # FIXME: This should be cached (and reset when the input becomes dirty)")
-            tMAX = time.perf_counter()
-            idx = img.max()
-
-            if len(tmap) <= idx:
-                newTmap = numpy.zeros((idx + 1,))  # And maybe this should be cached, too?
-                newTmap[: len(tmap)] = tmap[:]
-                tmap = newTmap
-            tMAX = 1000.0 * (time.perf_counter() - tMAX)
+            tLUT_t = time.perf_counter()
+            lut, generation = self._getLut(t)
+            tLUT += 1000.0 * (time.perf_counter() - tLUT_t)
 
             # do the work thing
-            tWORK = time.perf_counter()
-            result[t - roi.start[0]] = tmap[img[t - roi.start[0]]]
-            tWORK = 1000.0 * (time.perf_counter() - tWORK)
+            tWORK_t = time.perf_counter()
+            try:
+                result[t - roi.start[0]] = lut[tile]
+            except IndexError:
+                # The ObjectMap has no values for the highest object ids (yet)
+                extendedLut = numpy.zeros((tile.max() + 1,), dtype=lut.dtype)
+                extendedLut[: len(lut)] = lut
+                self._storeLut(t, extendedLut, generation)
+                result[t - roi.start[0]] = extendedLut[tile]
+            tWORK += 1000.0 * (time.perf_counter() - tWORK_t)
 
         if self.logger.getEffectiveLevel() >= logging.DEBUG:
             tStart = 1000.0 * (time.perf_counter() - tStart)
-            self.logger.debug(
-                "took %f msec. (img: %f, wait ObjectMap: %f, do work: %f, max: %f)" % (tStart, tIMG, tMAP, tWORK, tMAX)
-            )
+            self.logger.debug("took %f msec. (img: %f, lookup table: %f, do work: %f)" % (tStart, tIMG, tLUT, tWORK))
 
         return result
 
     def propagateDirty(self, slot, subindex, roi):
         if slot is self.Image:
+            self._forgetLuts(range(roi.start[0], roi.stop[0]))
             self.Output.setDirty(roi)
 
         elif slot is self.ObjectMap or slot is self.Features:
@@ -1428,14 +1533,20 @@ class OpRelabelSegmentation(Operator):
             # setDirty with a (time, object) pair, while elsewhere we
             # call setDirty with ().
             if len(roi._l) == 0:
+                if slot is self.ObjectMap:
+                    self._forgetLuts()
                 self.Output.setDirty(slice(None))
             elif isinstance(roi._l[0], int):
+                if slot is self.ObjectMap:
+                    self._forgetLuts(roi._l)
                 for t in roi._l:
                     self.Output.setDirty(slice(t))
             else:
                 assert len(roi._l[0]) == 2
                 # for each dirty object, only set its bounding box dirty
                 ts = list(set(t for t, _ in roi._l))
+                if slot is self.ObjectMap:
+                    self._forgetLuts(ts)
                 feats = self.Features(ts).wait()
                 for t, obj in roi._l:
                     min_coords = feats[t][default_features_key]["Coord<Minimum>"][obj].astype(numpy.uint32)
@@ -0,0 +1,331 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2024, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+# 		   http://ilastik.org/license.html
+###############################################################################
+"""
+Columnar, memory-mapped storage of the object features of many time slices.
+
+The features of a time slice come as a nested dictionary (see OpRegionFeatures.Output):
+features[plugin name][feature name] = array with one row per object (and the background in row 0).
+An ObjectFeatureTable keeps one column per (plugin name, feature name), holding the rows of all time slices
+in a memory-mapped file (in the dtype of the feature), so that the feature matrices for training and
+prediction can be assembled from the selected columns only, without going through the dictionaries of
+every time slice. Note that the table is a copy of the features: it doesn't replace the dictionaries.
+"""
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy
+
+from lazyflow.graph import Operator, InputSlot, OutputSlot
+from lazyflow.request import RequestLock
+from lazyflow.rtype import List
+from lazyflow.stype import Opaque
+
+from ilastik.applets.objectExtraction.opObjectExtraction import default_features_key
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ObjectFeatureTable(object):
+    """
+    Time slices are appended at the end of all columns; appending a time slice again replaces it.
+    Rows are never overwritten, so the arrays returned by column() and time_slice() stay valid
+    (and unchanged) until the table is closed. When the columns are full, the rows of the current
+    time slices are copied to new, larger files.
+    """
+
+    MIN_CAPACITY = 1024
+
+    def __init__(self, directory=None):
+        """
+        :param directory: where to keep the memory-mapped files. By default, a new temporary directory,
+            which is removed by close().
+        """
+        self._owns_directory = directory is None
+        self._directory = tempfile.mkdtemp(prefix="ilastik_object_features_") if directory is None else directory
+        self._file_count = 0
+        self._capacity = 0
+        self._num_rows = 0  # rows in use, including those of replaced time slices
+        self._columns = {}  # (plugin name, feature name) -> array of shape (capacity, width)
+        self._slices = {}  # t -> (start, stop) row range
+        self._slice_columns = {}  # t -> the column keys that the time slice has values for
+        self._lock = threading.Lock()
+
+    def __contains__(self, t):
+        return t in self._slices
+
+    def times(self):
+        return sorted(self._slices)
+
+    def num_rows(self, t):
+        """The number of objects in time slice t, including the background"""
+        start, stop = self._slices[t]
+        return stop - start
+
+    def append(self, t, features):
+        """
+        Add (or replace) the features of time slice t.
+
+        :param features: dict[plugin name][feature name] = array with one row per object
+        """
+        values = {}
+        for plugin_name, plugin_features in features.items():
+            for feature_name, value in plugin_features.items():
+                value = numpy.asarray(value)
+                if value.dtype == object:
+                    value = value.astype(numpy.float32)  # turn Nones into numpy.NaNs
+                values[(plugin_name, feature_name)] = value.reshape((value.shape[0], -1))
+
+        row_counts = set(value.shape[0] for value in values.values())
+        if len(row_counts) > 1:
+            raise ValueError("Features of time slice {} have different numbers of rows: {}".format(t, row_counts))
+        num_rows = row_counts.pop() if row_counts else 0
+
+        with self._lock:
+            for key, value in values.items():
+                if key in self._columns and self._columns[key].shape[1] != value.shape[1]:
+                    raise ValueError(
+                        "Feature {} has {} columns in time slice {}, but {} before".format(
+                            key, value.shape[1], t, self._columns[key].shape[1]
+                        )
+                    )
+
+            self._slices.pop(t, None)
+            self._slice_columns.pop(t, None)
+            if self._num_rows + num_rows > self._capacity:
+                self._reallocate(num_rows)
+            for key, value in values.items():
+                if key not in self._columns:
+                    self._columns[key] = self._new_column(value.shape[1], self._capacity, value.dtype)
+                    _fill_missing(self._columns[key][: self._num_rows])
+                elif numpy.result_type(self._columns[key].dtype, value.dtype) != self._columns[key].dtype:
+                    # Promote the column, like numpy.concatenate of the time slices would
+                    column = self._columns[key]
+                    dtype = numpy.result_type(column.dtype, value.dtype)
+                    self._columns[key] = self._new_column(column.shape[1], self._capacity, dtype)
+                    self._columns[key][: self._num_rows] = column[: self._num_rows]
+
+            start, stop = self._num_rows, self._num_rows + num_rows
+            for key, column in self._columns.items():
+                if key in values:
+                    column[start:stop] = values[key]
+                else:
+                    _fill_missing(column[start:stop])
+            self._num_rows = stop
+            self._slices[t] = (start, stop)
+            self._slice_columns[t] = frozenset(values)
+
+    def remove(self, t):
+        with self._lock:
+            self._slices.pop(t, None)
+            self._slice_columns.pop(t, None)
+
+    def view(self, times):
+        """A read-only table with only the given time slices, which doesn't change when this table changes"""
+        view = ObjectFeatureTable.__new__(ObjectFeatureTable)
+        with self._lock:
+            view.__dict__.update(self.__dict__)
+            view._owns_directory = False
+            view._columns = dict(self._columns)
+            view._slices = {t: self._slices[t] for t in times}
+            view._slice_columns = {t: self._slice_columns[t] for t in times}
+            view._capacity = view._num_rows  # anything appended to the view goes to new files
+            view._lock = threading.Lock()
+        return view
+
+    def column(self, plugin_name, feature_name, times):
+        """
+        The rows of the given time slices (in this order) of a feature column.
+        This is a view of the memory-mapped file (no copy) if the time slices were appended in this order.
+        """
+        column = self._columns[(plugin_name, feature_name)]
+        ranges = [self._slices[t] for t in times]
+        if all(stop == next_start for (_, stop), (next_start, _) in zip(ranges, ranges[1:])):
+            start = ranges[0][0] if ranges else 0
+            stop = ranges[-1][1] if ranges else 0
+            return column[start:stop]
+        return numpy.concatenate([column[start:stop] for start, stop in ranges])
+
+    def time_slice(self, t):
+        """The features of time slice t, in the format they were appended in (values are read-only views)"""
+        start, stop = self._slices[t]
+        features = {}
+        for plugin_name, feature_name in self._slice_columns[t]:
+            value = self._columns[(plugin_name, feature_name)][start:stop]
+            features.setdefault(plugin_name, {})[feature_name] = value
+        return features
+
+    def feature_matrix(self, selected, times, rows=None):
+        """
+        Assemble the feature matrix of the given time slices, with the same column order as
+        opObjectClassification.make_feature_array.
+
+        :param selected: dict[plugin name][feature name], the features to use
+        :param times: time slices, the rows of which are stacked in this order
+        :param rows: optionally, dict[t] = indices of the objects (rows) to use for time slice t
+        :returns: (matrix, list of (plugin name, feature name), one per matrix column)
+        """
+        keys = []
+        for plugin_name in sorted(set(plugin_name for plugin_name, _ in self._columns)):
+            if plugin_name == default_features_key or plugin_name not in selected:
+                continue
+            for key in sorted(k for k in self._columns if k[0] == plugin_name):
+                if key[1] in selected[plugin_name]:
+                    keys.append(key)
+
+        for t in times:
+            if not self._slice_columns[t].issuperset(keys):
+                raise Exception("different time slices did not have same features.")
+
+        if rows is None:
+            num_rows = sum(self.num_rows(t) for t in times)
+        else:
+            num_rows = sum(len(rows[t]) for t in times)
+        width = sum(self._columns[key].shape[1] for key in keys)
+        dtype = numpy.result_type(*(self._columns[key].dtype for key in keys)) if keys else numpy.float32
+        matrix = numpy.empty((num_rows, width), dtype=dtype)
+
+        if rows is not None:
+            offsets = numpy.cumsum([0] + [self.num_rows(t) for t in times])
+            row_index = numpy.concatenate([[]] + [offsets[i] + numpy.asarray(rows[t]) for i, t in enumerate(times)])
+            row_index = row_index.astype(int)
+
+        col_names = []
+        col = 0
+        for key in keys:
+            column = self.column(key[0], key[1], times)
+            if rows is not None:
+                column = column[row_index]
+            matrix[:, col : col + column.shape[1]] = column
+            col += column.shape[1]
+            col_names.extend([key] * column.shape[1])
+        return matrix, col_names
+
+    def close(self):
+        with self._lock:
+            self._columns = {}
+            self._slices = {}
+            self._slice_columns = {}
+        if self._owns_directory:
+            shutil.rmtree(self._directory, ignore_errors=True)
+
+    def _new_column(self, width, capacity, dtype):
+        if width == 0:
+            return numpy.empty((capacity, 0), dtype=dtype)
+        path = os.path.join(self._directory, "column_{}.bin".format(self._file_count))
+        self._file_count += 1
+        column = numpy.memmap(path, dtype=dtype, mode="w+", shape=(capacity, width))
+        try:
+            # The mapping stays valid. This way, the file is freed as soon as no view of it is left
+            # (on Windows, open files can't be removed, they are removed by close()).
+            os.remove(path)
+        except OSError:
+            pass
+        return column
+
+    def _reallocate(self, num_new_rows):
+        """Copy the rows of the current time slices to new files, with room for at least num_new_rows more"""
+        live_rows = sum(stop - start for start, stop in self._slices.values())
+        capacity = max(self.MIN_CAPACITY, 2 * (live_rows + num_new_rows))
+        logger.debug("Reallocating object feature columns for {} rows".format(capacity))
+
+        # The old columns may still be in use by views
+        order = sorted(self._slices, key=lambda t: self._slices[t][0])
+        columns = {}
+        for key, column in self._columns.items():
+            columns[key] = self._new_column(column.shape[1], capacity, column.dtype)
+            row = 0
+            for t in order:
+                start, stop = self._slices[t]
+                columns[key][row : row + stop - start] = column[start:stop]
+                row += stop - start
+
+        slices = {}
+        row = 0
+        for t in order:
+            start, stop = self._slices[t]
+            slices[t] = (row, row + stop - start)
+            row += stop - start
+
+        self._columns = columns
+        self._slices = slices
+        self._num_rows = row
+        self._capacity = capacity
+
+
+def _fill_missing(rows):
+    """Rows of a time slice that doesn't have the feature"""
+    rows[...] = numpy.nan if rows.dtype.kind in "fc" else 0
+
+
+class OpObjectFeatureTable(Operator):
+    """
+    Keeps (a copy of) the object features of the requested time slices in an ObjectFeatureTable.
+
+    Requesting Table with a list of time slices (an empty list means all) returns a
+    read-only view of the table with these time slices (see ObjectFeatureTable.view).
+    """
+
+    # same format as OpObjectExtraction.RegionFeatures
+    Features = InputSlot(rtype=List, stype=Opaque)
+
+    Table = OutputSlot(rtype=List, stype=Opaque)
+
+    def __init__(self, *args, **kwargs):
+        super(OpObjectFeatureTable, self).__init__(*args, **kwargs)
+        self._table = None
+        self._lock = RequestLock()
+
+    def setupOutputs(self):
+        self.Table.meta.shape = self.Features.meta.shape
+        self.Table.meta.dtype = object
+        self.Table.meta.axistags = None
+
+    def execute(self, slot, subindex, roi, result):
+        times = roi._l
+        if len(times) == 0:
+            times = list(range(self.Features.meta.shape[0]))
+
+        with self._lock:
+            if self._table is None:
+                self._table = ObjectFeatureTable()
+            missing = [t for t in times if t not in self._table]
+            if missing:
+                features = self.Features(missing).wait()
+                for t in missing:
+                    self._table.append(t, features[t])
+            return self._table.view(times)
+
+    def propagateDirty(self, slot, subindex, roi):
+        if self._table is not None:
+            times = roi._l if isinstance(roi, List) and len(roi._l) > 0 else self._table.times()
+            for t in times:
+                self._table.remove(t)
+        self.Table.setDirty(())
+
+    def cleanUp(self):
+        if self._table is not None:
+            self._table.close()
+            self._table = None
+        super(OpObjectFeatureTable, self).cleanUp()
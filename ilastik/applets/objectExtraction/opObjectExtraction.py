@@ -22,7 +22,10 @@
 from copy import copy, deepcopy
 import collections
 from collections.abc import Iterable
+import concurrent.futures
 from functools import partial
+import multiprocessing
+from types import SimpleNamespace
 from typing import Dict
 
 # SciPy
@@ -31,12 +34,13 @@ import vigra.analysis
 
 # lazyflow
 from lazyflow.graph import Operator, InputSlot, OutputSlot
-from lazyflow.request import Request, RequestPool
+from lazyflow.request import Request, RequestPool, RequestLock
 from lazyflow.stype import Opaque
 from lazyflow.rtype import List, SubRegion
-from lazyflow.roi import roiToSlice
+from lazyflow.roi import roiToSlice, getIntersectingBlocks, getBlockBounds
 from lazyflow.operators import OpLabelVolume, OpCompressedCache, OpBlockedArrayCache
 from itertools import groupby, count
+import threading
 
 import logging
 
@@ -81,6 +85,136 @@ def max_margin(d, default=(0, 0, 0)):
     return margin
 
 
+def _make_axes(axistags):
+    """The indexes of the x, y, z and c axes of a 4D image with the given axistags"""
+    # a SimpleNamespace (rather than a local class), so that it can be passed to a worker process
+    return SimpleNamespace(x=axistags.index("x"), y=axistags.index("y"), z=axistags.index("z"), c=axistags.index("c"))
+
+
+class _TaggedArray(object):
+    """A VigraArray as a plain array and its axistags, to pass it to (and from) a worker process"""
+
+    def __init__(self, array):
+        self.array = numpy.asarray(array)
+        self.axistags = array.axistags.toJSON()
+
+    @classmethod
+    def pack(cls, value):
+        if isinstance(value, vigra.VigraArray):
+            return cls(value)
+        if isinstance(value, (list, tuple)):
+            return type(value)(cls.pack(v) for v in value)
+        if isinstance(value, dict):
+            return {k: cls.pack(v) for k, v in value.items()}
+        return value
+
+    @classmethod
+    def unpack(cls, value):
+        if isinstance(value, cls):
+            return vigra.taggedView(value.array, axistags=vigra.AxisTags.fromJSON(value.axistags))
+        if isinstance(value, (list, tuple)):
+            return type(value)(cls.unpack(v) for v in value)
+        if isinstance(value, dict):
+            return {k: cls.unpack(v) for k, v in value.items()}
+        return value
+
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+_plugin_locks = collections.defaultdict(RequestLock)
+_plugin_locks_lock = threading.Lock()
+
+
+def _get_process_pool():
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            # spawn: forking a process with running worker threads is not safe
+            _process_pool = concurrent.futures.ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn"))
+        return _process_pool
+
+
+def _compute_in_process(plugin_name, method_name, *args):
+    """Runs in the worker process"""
+    plugin = pluginManager.getPluginByName(plugin_name, "ObjectFeatures").plugin_object
+    result = getattr(plugin, method_name)(*_TaggedArray.unpack(args))
+    return _TaggedArray.pack(result)
+
+
+def _wait_for_future(future):
+    """Like future.result(), but lets the worker thread of the calling request do other work meanwhile"""
+    done = RequestLock()
+    done.acquire()
+    future.add_done_callback(lambda f: done.release())
+    done.acquire()
+    done.release()
+    return future.result()
+
+
+def compute_with_plugin(plugin_name, method_name, *args):
+    """
+    Call a compute method (e.g. compute_global or compute_local_batch) of the object features plugin
+    with the given name, in the way its concurrency attribute allows (see ObjectFeaturesPlugin).
+    """
+    plugin = pluginManager.getPluginByName(plugin_name, "ObjectFeatures").plugin_object
+    concurrency = getattr(plugin, "concurrency", "threads")
+    if concurrency == "process":
+        future = _get_process_pool().submit(_compute_in_process, plugin_name, method_name, *_TaggedArray.pack(args))
+        return _TaggedArray.unpack(_wait_for_future(future))
+    if concurrency == "serial":
+        with _plugin_locks_lock:
+            lock = _plugin_locks[plugin_name]
+        with lock:
+            return getattr(plugin, method_name)(*args)
+    if concurrency != "threads":
+        raise ValueError("Unknown concurrency of plugin {}: {}".format(plugin_name, concurrency))
+    return getattr(plugin, method_name)(*args)
+
+
+def batch_disjoint_extents(extents, tile_shape):
+    """Group extents (lists of slices) into batches of non-intersecting extents.
+
+    Extents are first grouped into tiles of the given shape (by their start),
+    then greedily assigned to the first batch of their tile they don't intersect.
+    Returns a list of lists of extent indexes.
+
+    >>> extents = [[slice(0, 5), slice(0, 5)], [slice(3, 8), slice(0, 5)], [slice(5, 9), slice(0, 5)]]
+    >>> batch_disjoint_extents(extents, (10, 10))
+    [[0, 2], [1]]
+
+    """
+    if not extents:
+        return []
+    starts = numpy.array([[s.start for s in extent] for extent in extents])
+    stops = numpy.array([[s.stop for s in extent] for extent in extents])
+
+    tiles = collections.defaultdict(list)
+    for i, tile in enumerate(map(tuple, starts // numpy.asarray(tile_shape)[: starts.shape[1]])):
+        tiles[tile].append(i)
+
+    batches = []
+    for tile in sorted(tiles):
+        indexes = tiles[tile]
+        tile_batches = []  # (members, starts of members, stops of members)
+        for i in indexes:
+            for members, batch_starts, batch_stops in tile_batches:
+                n = len(members)
+                intersecting = numpy.all((batch_starts[:n] < stops[i]) & (batch_stops[:n] > starts[i]), axis=1)
+                if not intersecting.any():
+                    batch_starts[n] = starts[i]
+                    batch_stops[n] = stops[i]
+                    members.append(i)
+                    break
+            else:
+                batch_starts = numpy.empty((len(indexes), starts.shape[1]), dtype=starts.dtype)
+                batch_stops = numpy.empty_like(batch_starts)
+                batch_starts[0] = starts[i]
+                batch_stops[0] = stops[i]
+                tile_batches.append(([i], batch_starts, batch_stops))
+        batches += [members for members, _, _ in tile_batches]
+    return batches
+
+
 def make_bboxes(binary_bbox, margin):
     """Return binary label arrays for an object with margin.
 
@@ -121,6 +255,9 @@ class OpCachedRegionFeatures(Operator):
     LabelImage = InputSlot()
     CacheInput = InputSlot(optional=True)
     Features = InputSlot(rtype=List, stype=Opaque)
+    BlockShape = InputSlot(optional=True)  # See OpRegionFeatures
+    SegmentationImage = InputSlot(optional=True)  # See OpRegionFeatures
+    KeepPreviousFeatures = InputSlot(value=False)  # See OpRegionFeatures
 
     Output = OutputSlot()
     CleanBlocks = OutputSlot()
@@ -142,6 +279,9 @@ class OpCachedRegionFeatures(Operator):
         self._opRegionFeatures.Atlas.connect(self.Atlas)
         self._opRegionFeatures.LabelVolume.connect(self.LabelImage)
         self._opRegionFeatures.Features.connect(self.Features)
+        self._opRegionFeatures.BlockShape.connect(self.BlockShape)
+        self._opRegionFeatures.SegmentationVolume.connect(self.SegmentationImage)
+        self._opRegionFeatures.KeepPreviousFeatures.connect(self.KeepPreviousFeatures)
 
         # Hook up the cache.
         self._opCache = OpBlockedArrayCache(parent=self)
@@ -181,6 +321,9 @@ class OpCachedRegionFeatures(Operator):
     def propagateDirty(self, slot, subindex, roi):
         pass  # Nothing to do...
 
+    def forget_previous_features(self):
+        self._opRegionFeatures.forget_previous_features()
+
 
 class OpAdaptTimeListRoi(Operator):
     """Adapts the t array output from OpRegionFeatures to an Output
@@ -326,6 +469,13 @@ class OpObjectExtraction(Operator):
     # for example {"Standard Object Features": {"Mean in neighborhood":{"margin": (5, 5, 2)}}}
     Features = InputSlot(rtype=List, stype=Opaque, value={})
 
+    # Compute the (global) features in blocks of this shape, if possible (see OpRegionFeatures)
+    FeatureBlockShape = InputSlot(optional=True)
+
+    # Keep the last computed features, to recompute only those of the objects near a change (see OpRegionFeatures).
+    # This holds on to a second copy of the features of each time slice.
+    KeepPreviousFeatures = InputSlot(value=False)
+
     LabelImage = OutputSlot()
     ObjectCenterImage = OutputSlot()
 
@@ -374,6 +524,9 @@ class OpObjectExtraction(Operator):
         self._opRegFeats.RawImage.connect(self.RawImage)
         self._opRegFeats.LabelImage.connect(self._opLabelVolume.CachedOutput)
         self._opRegFeats.Features.connect(self.Features)
+        self._opRegFeats.BlockShape.connect(self.FeatureBlockShape)
+        self._opRegFeats.SegmentationImage.connect(self.BinaryImage)
+        self._opRegFeats.KeepPreviousFeatures.connect(self.KeepPreviousFeatures)
         self._opRegFeats.Atlas.connect(self.Atlas)  # move into constructor?
         self.RegionFeaturesCleanBlocks.connect(self._opRegFeats.CleanBlocks)
 
@@ -433,7 +586,9 @@ class OpObjectExtraction(Operator):
         assert False, "Shouldn't get here."
 
     def propagateDirty(self, inputSlot, subindex, roi):
-        pass
+        if inputSlot is self.BackgroundLabels:
+            # The label image changes everywhere, without the BinaryImage being dirty
+            self._opRegFeats.forget_previous_features()
 
     def setInSlot(self, slot, subindex, roi, value):
         assert (
@@ -460,6 +615,25 @@ class OpRegionFeatures(Operator):
     * Features : a nested dictionary of features to compute.
       Features[plugin name][feature name][parameter name] = parameter value
 
+    * BlockShape (optional) : if given, the global features are computed block by block
+      (with the given block shape), if all selected plugins support that (see
+      ObjectFeaturesPlugin.supports_blocks) and no neighborhood features or atlas are needed.
+      Only one block per worker thread needs to be in memory at a time.
+
+    * SegmentationVolume (optional) : the segmentation the LabelVolume was computed from
+      by connected components labelling. Its dirty regions are used to recompute only the
+      features of the objects near them (see below).
+
+    * KeepPreviousFeatures (default False) : keep the last computed features of each time slice
+      (a second copy, in addition to any downstream cache), to recompute only some of them (see below).
+
+    If KeepPreviousFeatures is set and a time slice becomes dirty, the features of the objects that
+    are further than the margin from all changed regions (of the RawVolume, and of the SegmentationVolume,
+    or of the LabelVolume if no segmentation is given) are taken from the previous result for that time slice.
+    Since connected components labelling may renumber objects, these objects are matched by their
+    default features. This needs all selected plugins to support it (see
+    ObjectFeaturesPlugin.supports_incremental). Otherwise, all features of the time slice are recomputed.
+
     Outputs:
 
     * Output : a nested dictionary of features.
@@ -471,9 +645,26 @@ class OpRegionFeatures(Operator):
     Atlas = InputSlot(optional=True)
     LabelVolume = InputSlot()
     Features = InputSlot(rtype=List, stype=Opaque)
+    BlockShape = InputSlot(optional=True)
+    SegmentationVolume = InputSlot(optional=True)
+    KeepPreviousFeatures = InputSlot(value=False)
 
     Output = OutputSlot()
 
+    # Local (neighborhood) features are computed for batches of objects from tiles of this shape (xyz)
+    LOCAL_FEATURES_TILE_SHAPE = (128, 128, 128)
+
+    # Recompute all features of a time slice if more of its objects than this are affected by a change
+    INCREMENTAL_MAX_AFFECTED_FRACTION = 0.5
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Per time slice: the last computed features, and the (xyz start, stop) regions changed since then
+        self._previous_features = {}
+        self._changed_regions = collections.defaultdict(list)
+        self._previous_features_generation = 0
+        self._previous_features_lock = threading.Lock()
+
     def setupOutputs(self):
         if self.LabelVolume.meta.axistags != self.RawVolume.meta.axistags:
             raise Exception("raw and label axis tags do not match")
@@ -500,6 +691,25 @@ class OpRegionFeatures(Operator):
         assert t_ind < len(self.RawVolume.meta.shape)
 
         def compute_features_for_time_slice(res_t_ind, t):
+            with self._previous_features_lock:
+                previous = self._previous_features.get(t)
+                changed_regions = list(self._changed_regions.get(t, []))
+                generation = self._previous_features_generation
+
+            acc = None
+            if self.BlockShape.ready():
+                acc = self._extract_blockwise(t)
+            if acc is None:
+                acc = compute_from_volumes(t, previous, changed_regions)
+
+            with self._previous_features_lock:
+                if generation == self._previous_features_generation and self.KeepPreviousFeatures.value:
+                    self._previous_features[t] = acc
+                    del self._changed_regions[t][: len(changed_regions)]
+
+            result[res_t_ind] = acc
+
+        def compute_from_volumes(t, previous, changed_regions):
             axes4d = [k for k in self.RawVolume.meta.getTaggedShape().keys() if k in "xyzc"]
 
             # Process entire spatial volume
@@ -531,10 +741,11 @@ class OpRegionFeatures(Operator):
             # Convert to 4D (preserve axis order)
             rawVolume = rawVolume.withAxes(*axes4d)
             labelVolume = labelVolume.withAxes(*axes4d)
-            acc = self._extract(rawVolume, labelVolume, atlasVolume)
-
-            # Copy into the result
-            result[res_t_ind] = acc
+            if previous is not None:
+                acc = self._extract_incremental(rawVolume, labelVolume, atlasVolume, previous, changed_regions)
+                if acc is not None:
+                    return acc
+            return self._extract(rawVolume, labelVolume, atlasVolume)
 
         # loop over requested time slices
         pool = RequestPool()
@@ -635,14 +846,7 @@ class OpRegionFeatures(Operator):
                 "both images must be 4D. raw image shape: {} label image shape: {}".format(image.shape, labels.shape)
             )
 
-        # FIXME: maybe simplify? taggedShape should be easier here
-        class Axes(object):
-            x = image.axistags.index("x")
-            y = image.axistags.index("y")
-            z = image.axistags.index("z")
-            c = image.axistags.index("c")
-
-        axes = Axes()
+        axes = _make_axes(image.axistags)
 
         slc3d = [slice(None)] * 4  # FIXME: do not hardcode
         slc3d[axes.c] = 0
@@ -656,19 +860,241 @@ class OpRegionFeatures(Operator):
 
         # do global features
         logger.debug("Computing global and default features")
-        global_features = {}
+        results = {}
         pool = RequestPool()
 
         def compute_for_one_plugin(plugin_name, feature_dict):
-            plugin_inner = pluginManager.getPluginByName(plugin_name, "ObjectFeatures")
-            global_features[plugin_name] = plugin_inner.plugin_object.compute_global(image, labels, feature_dict, axes)
+            results[plugin_name] = compute_with_plugin(plugin_name, "compute_global", image, labels, feature_dict, axes)
 
         for plugin_name, feature_dict in feature_names.items():
             if plugin_name != default_features_key:
                 pool.add(Request(partial(compute_for_one_plugin, plugin_name, feature_dict)))
 
         pool.wait()
+        # in the order of the plugins, not in the order the computations finished in
+        global_features = {name: results[name] for name in feature_names if name in results}
+
+        return self._combine_features(global_features, feature_names, axes, image, labels, atlas)
+
+    def _extract_blockwise(self, t):
+        """
+        Like _extract, for time slice t, but computes the global features blockwise (see BlockShape),
+        requesting only one block of the raw and label image at a time.
+        Returns None if the selected features can't be computed that way.
+        """
+        if self.Atlas.ready():
+            return None
+
+        feature_names = deepcopy(self.Features([]).wait())
+        feature_names = self._augmentFeatureNames(feature_names)
+        if numpy.any(max_margin(feature_names)):
+            return None
+
+        plugins = {}
+        for plugin_name, feature_dict in feature_names.items():
+            if plugin_name == default_features_key:
+                continue
+            plugin = pluginManager.getPluginByName(plugin_name, "ObjectFeatures").plugin_object
+            if not plugin.supports_blocks(feature_dict):
+                return None
+            plugins[plugin_name] = plugin
+
+        tagged_shape = self.LabelVolume.meta.getTaggedShape()
+        axiskeys = list(tagged_shape.keys())
+        axes4d = [k for k in axiskeys if k in "xyzc"]
+        axes = _make_axes(vigra.defaultAxistags("".join(axes4d)))
+        ndim = 3 if tagged_shape.get("z", 1) > 1 else 2
+
+        slc3d = [slice(None)] * 4
+        slc3d[axes.c] = 0
+        slc3d = tuple(slc3d)
+
+        label_shape = numpy.array(self.LabelVolume.meta.shape)
+        block_shape = numpy.array(self.BlockShape.value)
+        block_shape = numpy.where([k == "t" for k in axiskeys], 1, block_shape)
+        block_shape = numpy.where([k == "c" for k in axiskeys], label_shape, block_shape)
+        time_slice_roi = (numpy.zeros_like(label_shape), label_shape.copy())
+        if "t" in tagged_shape:
+            time_slice_roi[0][axiskeys.index("t")] = t
+            time_slice_roi[1][axiskeys.index("t")] = t + 1
+        block_starts = getIntersectingBlocks(block_shape, time_slice_roi)
+
+        partials = {plugin_name: [None] * len(block_starts) for plugin_name in plugins}
+
+        def compute_block(block_index, block_start):
+            start, stop = getBlockBounds(label_shape, block_shape, block_start)
+            labelBlock = self.LabelVolume(start, stop).wait()
+            labelBlock = vigra.taggedView(labelBlock, axistags=self.LabelVolume.meta.axistags)
+            labelBlock = labelBlock.withAxes(*axes4d)[slc3d]
+            if not labelBlock.any():
+                for plugin_partials in partials.values():
+                    plugin_partials[block_index] = {"ids": numpy.zeros((0,), dtype=int)}
+                return
+
+            raw_start, raw_stop = list(start), list(stop)
+            raw_stop[axiskeys.index("c")] = self.RawVolume.meta.getTaggedShape()["c"]
+            rawBlock = self.RawVolume(raw_start, raw_stop).wait()
+            rawBlock = vigra.taggedView(rawBlock, axistags=self.RawVolume.meta.axistags)
+            rawBlock = rawBlock.withAxes(*axes4d)
+
+            tagged_start = dict(zip(axiskeys, start))
+            offset = [tagged_start.get(k, 0) for k in "xyz"]
+            for plugin_name in plugins:
+                partials[plugin_name][block_index] = compute_with_plugin(
+                    plugin_name, "compute_block", rawBlock, labelBlock, feature_names[plugin_name], axes, offset
+                )
+
+        pool = RequestPool()
+        for block_index, block_start in enumerate(block_starts):
+            pool.add(Request(partial(compute_block, block_index, block_start)))
+        pool.wait()
+
+        global_features = {}
+        for plugin_name, plugin in plugins.items():
+            global_features[plugin_name] = plugin.merge_blocks(
+                partials[plugin_name], feature_names[plugin_name], axes, ndim
+            )
+            if global_features[plugin_name] is None:
+                logger.debug("Falling back to whole-image feature computation for {}".format(plugin_name))
+                return None
+
+        return self._combine_features(global_features, feature_names, axes)
+
+    def _extract_incremental(self, image, labels, atlas, previous, changed_regions):
+        """
+        Like _extract, but takes the features of the objects that are not near any of the changed regions
+        from the previous features of the time slice (see class docs).
+        Returns None if the features of all objects need to be recomputed.
+        """
+        feature_names = deepcopy(self.Features([]).wait())
+        feature_names = self._augmentFeatureNames(feature_names)
+        for plugin_name, feature_dict in feature_names.items():
+            if plugin_name == default_features_key:
+                continue
+            plugin = pluginManager.getPluginByName(plugin_name, "ObjectFeatures").plugin_object
+            if not plugin.supports_incremental(feature_dict):
+                return None
+
+        axes = _make_axes(image.axistags)
+        slc3d = [slice(None)] * 4
+        slc3d[axes.c] = 0
+        slc3d = tuple(slc3d)
+
+        standard = pluginManager.getPluginByName("Standard Object Features", "ObjectFeatures").plugin_object
+        geometry = standard.compute_global(image, labels[slc3d], {name: {} for name in self._GEOMETRY_FEATURES}, axes)
+        # same layout as the previous features, with the background in row 0
+        geometry = {
+            name: numpy.vstack((numpy.zeros(value.shape[1]), value)).astype(numpy.float32)
+            for name, value in geometry.items()
+        }
+        previous_geometry = previous[default_features_key]
+        nobj = geometry["Count"].shape[0] - 1
+        if nobj == 0:
+            return None
+
+        # +1, because a change next to an object can merge it with another one
+        margin = numpy.array(max_margin(feature_names)) + 1
+        new_keys = self._object_keys(geometry)
+        new_unchanged = ~self._objects_near(geometry, changed_regions, margin)
+        new_unchanged[0] = False
+        old_keys = self._object_keys(previous_geometry)
+        old_unchanged = ~self._objects_near(previous_geometry, changed_regions, margin)
+        old_unchanged[0] = False
+
+        # The previous row of each object, or 0 if its features need to be recomputed.
+        # An object away from all changes is the same as a previous object away from all changes,
+        # which has the same id if the labels were given, or else the same (unique) key.
+        source = numpy.zeros(nobj + 1, dtype=int)
+        if not self.SegmentationVolume.ready():
+            for i in numpy.flatnonzero(new_unchanged[: len(old_keys)]):
+                if old_unchanged[i] and new_keys[i] == old_keys[i]:
+                    source[i] = i
+        else:
+            old_ids = {}
+            for i in numpy.flatnonzero(old_unchanged):
+                old_ids[old_keys[i]] = 0 if old_keys[i] in old_ids else i
+            new_key_counts = collections.Counter(new_keys[i] for i in numpy.flatnonzero(new_unchanged))
+            for i in numpy.flatnonzero(new_unchanged):
+                if new_key_counts[new_keys[i]] == 1:
+                    source[i] = old_ids.get(new_keys[i], 0)
+
+        affected = numpy.flatnonzero(source[1:] == 0) + 1
+        if len(affected) > self.INCREMENTAL_MAX_AFFECTED_FRACTION * nobj:
+            return None
+        logger.debug("recomputing the features of {} of {} objects".format(len(affected), nobj))
+
+        recomputed = None
+        if len(affected) > 0:
+            # only keep the affected objects, numbered consecutively
+            relabeling = numpy.zeros(nobj + 1, dtype=numpy.uint32)
+            relabeling[affected] = numpy.arange(1, len(affected) + 1, dtype=numpy.uint32)
+            affected_labels = vigra.taggedView(relabeling[numpy.asarray(labels)], axistags=labels.axistags)
+            recomputed = self._extract(image, affected_labels, atlas)
+            if {k: set(v) for k, v in recomputed.items()} != {k: set(v) for k, v in previous.items()}:
+                return None
+
+        reused = numpy.flatnonzero(source)
+        all_features = {}
+        for plugin_name, plugin_features in previous.items():
+            all_features[plugin_name] = {}
+            for feature_name, values in plugin_features.items():
+                merged = numpy.zeros((nobj + 1, values.shape[1]), dtype=numpy.float32)
+                merged[reused] = values[source[reused]]
+                if recomputed is not None:
+                    recomputed_values = recomputed[plugin_name][feature_name]
+                    if recomputed_values.shape != (len(affected) + 1, values.shape[1]):
+                        return None
+                    merged[affected] = recomputed_values[1:]
+                all_features[plugin_name][feature_name] = merged
+        return all_features
+
+    # Default features that identify an object (with a bounding box that is end exclusive)
+    _GEOMETRY_FEATURES = ("Count", "Coord<Minimum>", "Coord<Maximum>")
+
+    @classmethod
+    def _object_keys(cls, features):
+        """One hashable key per row of the features, from the geometry features"""
+        rows = numpy.hstack([features[name] for name in cls._GEOMETRY_FEATURES]).astype(numpy.float32)
+        return [row.tobytes() for row in rows]
 
+    @staticmethod
+    def _objects_near(features, regions, margin):
+        """Which rows of the features are objects closer than margin (xyz) to any of the regions (xyz start, stop)"""
+        mincoords = features["Coord<Minimum>"]
+        maxcoords = features["Coord<Maximum>"]
+        ndim = mincoords.shape[1]
+        near = numpy.zeros(mincoords.shape[0], dtype=bool)
+        for start, stop in regions:
+            near |= numpy.all(mincoords - margin[:ndim] < stop[:ndim], axis=1) & numpy.all(
+                maxcoords + margin[:ndim] > start[:ndim], axis=1
+            )
+        return near
+
+    def forget_previous_features(self):
+        """Recompute the features of all objects the next time"""
+        with self._previous_features_lock:
+            self._previous_features.clear()
+            self._changed_regions.clear()
+            self._previous_features_generation += 1
+
+    def _record_changed_region(self, slot, roi):
+        tagged_start = dict(zip(slot.meta.getAxisKeys(), roi.start))
+        tagged_stop = dict(zip(slot.meta.getAxisKeys(), roi.stop))
+        region = (
+            numpy.array([tagged_start.get(k, 0) for k in "xyz"]),
+            numpy.array([tagged_stop.get(k, 1) for k in "xyz"]),
+        )
+        with self._previous_features_lock:
+            if not self.KeepPreviousFeatures.value:
+                return
+            for t in range(tagged_start.get("t", 0), tagged_stop.get("t", 1)):
+                self._changed_regions[t].append(region)
+
+    def _combine_features(self, global_features, feature_names, axes, image=None, labels=None, atlas=None):
+        """
+        Adds the local (neighborhood) features to the computed global features (this needs the image and labels),
+        and separates the default features.
+        """
         extrafeats = {}
         for feat_key in default_features:
             try:
@@ -699,34 +1125,54 @@ class OpRegionFeatures(Operator):
         margin = max_margin(feature_names)
 
         if numpy.any(margin):
-            bboxes = {}
-            for plugin_name, feature_dict in feature_names.items():
-                if not any("margin" in features for features in feature_dict.values()):
-                    continue
-
-                plugin = pluginManager.getPluginByName(plugin_name, "ObjectFeatures")
-                tmp_dicts = [None] * nobj
-
-                def _calc_single(i, raw_bbox, binary_bbox):
-                    feats = plugin.plugin_object.compute_local(raw_bbox, binary_bbox, feature_dict, axes)
-                    tmp_dicts[i] = feats
-
-                with RequestPool() as pool:
-                    # starting from 0, we stripped 0th background object in global computation
-                    for i in range(nobj):
-                        logger.debug("processing object {}".format(i))
-                        if i not in bboxes:
-                            extent = self.compute_extent(i, image, mincoords, maxcoords, axes, margin)
-                            raw_bbox = self.compute_rawbbox(image, extent, axes)
-                            # it's i+1 here, because the background has label 0
-                            binary_bbox = labels[tuple(extent)] == i + 1
-                            bboxes[i] = (raw_bbox, binary_bbox)
-
-                        raw_bbox, binary_bbox = bboxes[i]
-                        pool.add(Request(partial(_calc_single, i, raw_bbox, binary_bbox)))
-
-                # merge the results
-                for feature_dict in tmp_dicts:
+            # starting from 0, we stripped 0th background object in global computation
+            extents = [self.compute_extent(i, image, mincoords, maxcoords, axes, margin) for i in range(nobj)]
+            batches = batch_disjoint_extents(extents, self.LOCAL_FEATURES_TILE_SHAPE)
+            logger.debug("computing local features of {} objects in {} batches".format(nobj, len(batches)))
+
+            local_plugins = [
+                plugin_name
+                for plugin_name, feature_dict in feature_names.items()
+                if any("margin" in features for features in feature_dict.values())
+            ]
+            tmp_dicts = {plugin_name: [None] * nobj for plugin_name in local_plugins}
+
+            def _calc_batch(plugin_name, object_indexes):
+                region = [
+                    slice(
+                        min(extents[i][d].start for i in object_indexes),
+                        max(extents[i][d].stop for i in object_indexes),
+                    )
+                    for d in range(3)
+                ]
+                raw_region = self.compute_rawbbox(image, region, axes)
+                # it's i+1 here, because the background has label 0
+                binary_bboxes = [labels[tuple(extents[i])] == i + 1 for i in object_indexes]
+                region_extents = [
+                    [slice(e.start - r.start, e.stop - r.start) for e, r in zip(extents[i], region)]
+                    for i in object_indexes
+                ]
+                feats = compute_with_plugin(
+                    plugin_name,
+                    "compute_local_batch",
+                    raw_region,
+                    binary_bboxes,
+                    region_extents,
+                    feature_names[plugin_name],
+                    axes,
+                )
+                for i, object_feats in zip(object_indexes, feats):
+                    tmp_dicts[plugin_name][i] = object_feats
+
+            # the batches of all plugins at once
+            with RequestPool() as pool:
+                for plugin_name in local_plugins:
+                    for object_indexes in batches:
+                        pool.add(Request(partial(_calc_batch, plugin_name, object_indexes)))
+
+            # merge the results
+            for plugin_name in local_plugins:
+                for feature_dict in tmp_dicts[plugin_name]:
                     for feature_name, features in feature_dict.items():
                         local_features[plugin_name][feature_name].append(features)
 
@@ -744,7 +1190,7 @@ class OpRegionFeatures(Operator):
         # merge the global and local features
         logger.debug("removed failed, merging")
         all_features = {}
-        plugin_names = set(global_features.keys()) | set(local_features.keys())
+        plugin_names = list(global_features) + [name for name in local_features if name not in global_features]
         for name in plugin_names:
             d1 = global_features.get(name, {})
             d2 = local_features.get(name, {})
@@ -774,8 +1220,23 @@ class OpRegionFeatures(Operator):
 
     def propagateDirty(self, slot, subindex, roi):
         if slot is self.Features:
+            self.forget_previous_features()
             self.Output.setDirty(slice(None))
+        elif slot is self.BlockShape:
+            # Only affects how the features are computed, not their values
+            pass
+        elif slot is self.KeepPreviousFeatures:
+            if not self.KeepPreviousFeatures.value:
+                self.forget_previous_features()
+        elif slot is self.SegmentationVolume:
+            # The LabelVolume computed from it is dirty, too (but for the whole time slice)
+            self._record_changed_region(slot, roi)
         else:
+            if slot is self.Atlas:
+                self.forget_previous_features()
+            elif slot is self.RawVolume or not self.SegmentationVolume.ready():
+                self._record_changed_region(slot, roi)
+
             axes = list(self.RawVolume.meta.getTaggedShape().keys())
             dirtyStart = collections.OrderedDict(list(zip(axes, roi.start)))
             dirtyStop = collections.OrderedDict(list(zip(axes, roi.stop)))
@@ -83,6 +83,10 @@ class OpPixelClassification(Operator):
     FreezePredictions = InputSlot(stype="bool")
     ClassifierFactory = InputSlot(value=ParallelVigraRfLazyflowClassifierFactory(100))
 
+    # Optional: If set, retraining only invalidates the cached predictions that change by more than this.
+    # See OpVectorwiseClassifierPredict.InvalidationTolerance
+    PredictionInvalidationTolerance = InputSlot(optional=True)
+
     PredictionsFromDisk = InputSlot(optional=True, level=1)
 
     PredictionProbabilities = OutputSlot(
@@ -180,6 +184,7 @@ class OpPixelClassification(Operator):
         self.opPredictionPipeline.FreezePredictions.connect(self.FreezePredictions)
         self.opPredictionPipeline.PredictionsFromDisk.connect(self.PredictionsFromDisk)
         self.opPredictionPipeline.PredictionMask.connect(self.PredictionMasks)
+        self.opPredictionPipeline.InvalidationTolerance.connect(self.PredictionInvalidationTolerance)
 
         # Feature Selection Stuff
         self.opFeatureMatrixCaches = OpMultiLaneWrapper(OpFeatureMatrixCache, parent=self)
@@ -554,6 +559,7 @@ class OpPredictionPipeline(OpPredictionPipelineNoCache):
     InputImage = InputSlot()
     FreezePredictions = InputSlot()
     CachedFeatureImages = InputSlot()
+    InvalidationTolerance = InputSlot(optional=True)
 
     PredictionProbabilities = OutputSlot()
     CachedPredictionProbabilities = OutputSlot()
@@ -574,6 +580,7 @@ class OpPredictionPipeline(OpPredictionPipelineNoCache):
         self.predict.Image.connect(self.CachedFeatureImages)
         self.predict.PredictionMask.connect(self.PredictionMask)
         self.predict.LabelsCount.connect(self.NumClasses)
+        self.predict.InvalidationTolerance.connect(self.InvalidationTolerance)
         self.PredictionProbabilities.connect(self.predict.PMaps)
 
         # Prepare operator for Autocontext
@@ -31,6 +31,13 @@ class ObjectFeaturesPlugin(IPlugin):
 
     name = "Base object features plugin"
 
+    # How OpRegionFeatures may call the compute methods (compute_global, compute_local_batch, compute_block):
+    #   "threads": in worker threads, concurrently with other plugins and with itself
+    #   "serial": in worker threads, but only one call of this plugin at a time (for code that isn't thread-safe)
+    #   "process": in a worker process, for Python code that holds the GIL. The arguments and results
+    #              are pickled, and the plugin must be found by the plugin manager of the worker process.
+    concurrency = "threads"
+
     # TODO for now, only one margin will be set in the dialog. however, it
     # should be repeated for each feature, because in the future it
     # might be different, or each feature might take other parameters.
@@ -80,6 +87,79 @@ class ObjectFeaturesPlugin(IPlugin):
         """
         return dict()
 
+    def compute_local_batch(self, image, binary_bboxes, extents, features, axes):
+        """Calculate features on several objects at once.
+
+        The default implementation calls compute_local for each object.
+        Plugins can override this with a vectorized version.
+
+        :param image: np.ndarray - image[region containing all extents]
+        :param binary_bboxes: list of binarize(labels[expanded bounding box]), one per object
+        :param extents: list of the objects' expanded bounding boxes (as slicings
+            of image without the channel axis). They don't intersect.
+        :param features: which features to compute
+        :param axes: axis tags
+
+        :returns: a list of the dictionaries compute_local returns, one per object
+
+        """
+        results = []
+        for binary_bbox, extent in zip(binary_bboxes, extents):
+            key = list(extent)
+            key.insert(axes.c, slice(None))
+            results.append(self.compute_local(image[tuple(key)], binary_bbox, features, axes))
+        return results
+
+    def supports_blocks(self, features):
+        """Whether compute_global can be replaced by compute_block and merge_blocks
+        for the given features.
+
+        :param features: which features to compute
+        :returns: bool
+
+        """
+        return False
+
+    def compute_block(self, image, labels, features, axes, offset):
+        """Calculate partial results of the global features on one spatial block
+        of the image (see merge_blocks).
+
+        :param image: np.ndarray - image[block]
+        :param labels: np.ndarray - labels[block], with the global object ids
+        :param features: which features to compute
+        :param axes: axis tags
+        :param offset: the block's start coordinates (xyz order)
+
+        :returns: an object that can be passed to merge_blocks
+
+        """
+        raise NotImplementedError
+
+    def merge_blocks(self, partials, features, axes, ndim):
+        """Merge the partial results of all blocks of an image.
+
+        :param partials: list of results of compute_block, in block order
+        :param features: which features to compute
+        :param axes: axis tags
+        :param ndim: 2 or 3, the dimensionality of the whole image
+
+        :returns: the same dictionary compute_global would return for
+            the whole image, or None if that is not possible.
+
+        """
+        raise NotImplementedError
+
+    def supports_incremental(self, features):
+        """Whether the given features of an object only depend on the image and labels
+        inside its bounding box (expanded by the margin), so that they can be recomputed
+        for some of the objects only (with the other objects' labels set to 0).
+
+        :param features: which features to compute
+        :returns: bool
+
+        """
+        return False
+
     def fill_properties(self, feature_dict):
         """
         For every feature in the feature dictionary, fill in its properties,
@@ -67,6 +67,12 @@ class VigraObjFeats(ObjectFeaturesPlugin):
     local_suffix = " in neighborhood"  # note the space in front, it's important
     local_out_suffixes = [local_suffix, " in object and neighborhood"]
 
+    # features that can be computed blockwise, from mergeable per-block accumulators.
+    blockwise_features = set(
+        ["Count", "Sum", "Mean", "Variance", "Minimum", "Maximum", "Coord<Minimum>", "Coord<Maximum>", "RegionCenter"]
+    )
+    coordinate_features = set(["Coord<Minimum>", "Coord<Maximum>", "RegionCenter"])
+
     ndim = None
 
     def availableFeatures(self, image, labels):
@@ -277,6 +283,94 @@ class VigraObjFeats(ObjectFeaturesPlugin):
 
         return self._do_4d(image, labels, features, axes)
 
+    def supports_incremental(self, features):
+        # Histogram and Quantiles use the intensity range of all objects
+        return not any("Global<" in f or f in ("Histogram", "Quantiles") for f in features)
+
+    def supports_blocks(self, features):
+        return set(features.keys()) <= self.blockwise_features
+
+    def _blockwise_names(self, features):
+        names = set(features) | {"Count"}
+        if "Variance" in names:
+            names.add("Mean")
+        return sorted(names)
+
+    def compute_block(self, image, labels, features, axes, offset):
+        """Per-object accumulators of the block, in rows for the object ids found in it"""
+        names = self._blockwise_names(features)
+        result = vigra.analysis.extractRegionFeatures(
+            image.astype(np.float32), labels.astype(np.uint32), names, ignoreLabel=0
+        )
+        result = dict((cleanup_key(k), result[k]) for k in result.keys())
+
+        counts = np.asarray(result["Count"]).reshape(-1)
+        ids = np.flatnonzero(counts)
+        ids = ids[ids > 0]
+
+        partial = {"ids": ids}
+        for name in names:
+            value = np.asarray(result[name], dtype=np.float64)
+            value = value.reshape(value.shape[0], -1)[ids]
+            if name in self.coordinate_features:
+                value = value + np.asarray(offset, dtype=np.float64)[: value.shape[1]]
+            partial[name] = value
+        return partial
+
+    def merge_blocks(self, partials, features, axes, ndim):
+        names = self._blockwise_names(features)
+        partials = [p for p in partials if len(p["ids"]) > 0]
+        if not partials:
+            return None
+
+        nobj = max(p["ids"][-1] for p in partials) + 1
+        merged = {}
+        for name in names:
+            fill = {"Minimum": np.inf, "Coord<Minimum>": np.inf, "Maximum": -np.inf, "Coord<Maximum>": -np.inf}
+            merged[name] = np.full((nobj, partials[0][name].shape[1]), fill.get(name, 0.0))
+
+        for partial in partials:
+            ids = partial["ids"]
+            count_a = merged["Count"][ids]
+            count_b = partial["Count"]
+            count = count_a + count_b
+
+            updated = {}
+            for name in names:
+                a = merged[name][ids]
+                b = partial[name]
+                if name in ("Minimum", "Coord<Minimum>"):
+                    updated[name] = np.minimum(a, b)
+                elif name in ("Maximum", "Coord<Maximum>"):
+                    updated[name] = np.maximum(a, b)
+                elif name in ("Count", "Sum"):
+                    updated[name] = a + b
+                elif name in ("Mean", "RegionCenter"):
+                    updated[name] = (a * count_a + b * count_b) / count
+                elif name == "Variance":
+                    # Chan et al.: combine the sums of squared deviations of both parts
+                    delta = partial["Mean"] - merged["Mean"][ids]
+                    updated[name] = (a * count_a + b * count_b + delta**2 * count_a * count_b / count) / count
+            for name, value in updated.items():
+                merged[name][ids] = value
+
+        if np.any(merged["Count"][1:] == 0):
+            # Object ids aren't consecutive: the whole-image results for missing ids are vigra's business
+            return None
+
+        result = {}
+        for name in features:
+            value = merged[name]
+            if name in self.coordinate_features and ndim == 2:
+                value = value[:, :2]
+            result[name] = value
+
+        cleaned = cleanup(result, nobj, features)
+        if "Coord<Maximum>" in cleaned:
+            # see _do_4d
+            cleaned["Coord<Maximum>"] += 1
+        return cleaned
+
     def compute_local(self, image, binary_bbox, feature_dict, axes):
         """helper that deals with individual objects"""
 
@@ -295,3 +389,38 @@ class VigraObjFeats(ObjectFeaturesPlugin):
             result = self._do_4d(image, label, featurenames, axes)
             results.append(self.update_keys(result, suffix=suffix))
         return self.combine_dicts(results)
+
+    def compute_local_batch(self, image, binary_bboxes, extents, feature_dict, axes):
+        """Same as compute_local for each object, but with a single vigra call for all of them.
+        The object neighborhoods are drawn into one label image (they don't intersect)."""
+        featurenames = list(feature_dict.keys())
+        local = [x + self.local_suffix for x in self.local_features]
+        featurenames = list(set(featurenames) & set(local))
+        featurenames = [x.split(" ")[0] for x in featurenames]
+        if "Histogram" in featurenames:
+            # The histogram range is taken from the image passed to vigra, i.e. it depends on the region
+            return super().compute_local_batch(image, binary_bboxes, extents, feature_dict, axes)
+
+        margin = ilastik.applets.objectExtraction.opObjectExtraction.max_margin({"": feature_dict})
+        shape3d = tuple(n for i, n in enumerate(image.shape) if i != axes.c)
+        excl_labels = np.zeros(shape3d, dtype=np.uint32)
+        passed_labels = np.zeros(shape3d, dtype=np.uint32)
+        nonempty = []
+        for object_index, (binary_bbox, extent) in enumerate(zip(binary_bboxes, extents), start=1):
+            passed, excl = ilastik.applets.objectExtraction.opObjectExtraction.make_bboxes(binary_bbox, margin)
+            excl_labels[tuple(extent)][excl] = object_index
+            passed_labels[tuple(extent)][passed] = object_index
+            nonempty.append((excl.any(), passed.any()))
+
+        results = [[] for _ in binary_bboxes]
+        for i, (labels, suffix) in enumerate(zip([excl_labels, passed_labels], self.local_out_suffixes)):
+            result = self._do_4d(image, labels, featurenames, axes)
+            for object_index in range(len(binary_bboxes)):
+                if nonempty[object_index][i]:
+                    rows = slice(object_index, object_index + 1)
+                else:
+                    # compute_local gets no rows for an empty region
+                    rows = slice(0, 0)
+                object_result = dict((k, v[rows]) for k, v in result.items())
+                results[object_index].append(self.update_keys(object_result, suffix=suffix))
+        return [self.combine_dicts(object_results) for object_results in results]
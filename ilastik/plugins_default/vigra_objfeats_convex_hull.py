@@ -108,3 +108,6 @@ class VigraConvexHullObjFeats(ObjectFeaturesPlugin):
     def compute_global(self, image, labels, features, axes):
 
         return self._do_4d(image, labels, list(features.keys()), axes)
+
+    def supports_incremental(self, features):
+        return True
@@ -128,3 +128,6 @@ class VigraSkeletonObjFeats(ObjectFeaturesPlugin):
     def compute_global(self, image, labels, features, axes):
 
         return self._do_4d(image, labels, list(features.keys()), axes)
+
+    def supports_incremental(self, features):
+        return True
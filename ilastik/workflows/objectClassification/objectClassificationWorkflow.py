@@ -299,6 +299,9 @@ class ObjectClassificationWorkflow(Workflow):
         opObjExtraction.RawImage.connect(rawslot)
         opObjExtraction.BinaryImage.connect(binaryslot)
         opObjExtraction.Atlas.connect(atlas_slot)
+        if not self._headless:
+            # Interactive changes of the segmentation usually only affect a few objects
+            opObjExtraction.KeepPreviousFeatures.setValue(True)
 
         opObjClassification.RawImages.connect(rawslot)
         opObjClassification.BinaryImages.connect(binaryslot)
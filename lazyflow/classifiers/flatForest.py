@@ -0,0 +1,357 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2024, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+#          http://ilastik.org/license/
+###############################################################################
+"""
+Array-backed inference for (lists of) trained vigra random forests.
+
+The trees of all forests are flattened into contiguous node arrays, so that
+all trees can be evaluated for a chunk of pixels in a single pass.
+The results reproduce vigra's RandomForest.predictProbabilities():
+per forest, leaf distributions are accumulated in float32 and normalized by
+the (double) total weight, and the forests are combined weighted by their tree counts,
+like ParallelVigraRfLazyflowClassifier does.
+"""
+import io
+from functools import partial
+
+import h5py
+import numpy
+
+from lazyflow.request import Request, RequestPool
+from . import vigraRfHdf5
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numba
+
+    WITH_NUMBA = True
+except ImportError:
+    WITH_NUMBA = False
+
+# Node tags, see vigra/random_forest/rf_nodeproxy.hxx
+_LEAF_NODE_TAG = 0x40000000
+_THRESHOLD_NODE = 0
+_CONST_PROB_NODE = 0 | _LEAF_NODE_TAG
+
+# The root node follows the two header entries of a tree's topology array
+_ROOT_INDEX = 2
+
+
+class FlatForest(object):
+    """
+    The trees of one or more vigra RandomForests, compiled into flat arrays.
+
+    Node arrays (one entry per node of all trees):
+        feature:    Feature index of an internal node, -1 for leaves
+        threshold:  Split threshold; samples with feature < threshold go to the left child
+        children:   (N, 2) child node indices of internal nodes; for leaves, children[:, 0] is the leaf index
+    Leaf array:
+        leaf_values: (L, C) class distributions of the leaves
+    Tree arrays:
+        roots:          Root node index of each tree
+        forest_bounds:  Tree index range [forest_bounds[i], forest_bounds[i+1]) of each forest
+    """
+
+    # Rows per child request in predict_probabilities()
+    CHUNK_ROWS = 16384
+
+    def __init__(self, feature, threshold, children, leaf_values, roots, forest_bounds):
+        self.feature = feature
+        self.threshold = threshold
+        self.children = children
+        self.leaf_values = leaf_values
+        self.roots = roots
+        self.forest_bounds = forest_bounds
+
+    @property
+    def class_count(self):
+        return self.leaf_values.shape[1]
+
+    @classmethod
+    def from_vigra_forests(cls, forests):
+        """
+        Compile the given vigra RandomForests.
+        Raises NotImplementedError if a forest uses node types other than threshold splits and constant leaves.
+        """
+        class_counts = set(forest.labelCount() for forest in forests)
+        assert len(class_counts) == 1, "All forests must have the same classes"
+        class_count = class_counts.pop()
+
+        forest_names = ["Forest{:04d}".format(i) for i in range(len(forests))]
+        trees_per_forest = []
+        with h5py.File(io.BytesIO(), "w") as f:
+            vigraRfHdf5.write_forests(forests, f, forest_names)
+            for forest, forest_name in zip(forests, forest_names):
+                trees = [
+                    (tree_group["topology"][:], tree_group["parameters"][:])
+                    for name, tree_group in sorted(f[forest_name].items())
+                    if isinstance(tree_group, h5py.Group) and "topology" in tree_group
+                ]
+                assert len(trees) == forest.treeCount()
+                trees_per_forest.append(trees)
+
+        return cls._from_trees(trees_per_forest, class_count)
+
+    @classmethod
+    def _from_trees(cls, trees_per_forest, class_count):
+        feature = []
+        threshold = []
+        children = []
+        leaf_values = []
+        roots = []
+        forest_bounds = [0]
+
+        for trees in trees_per_forest:
+            for topology, parameters in trees:
+                roots.append(len(feature))
+
+                # Assign node ids in depth-first order, children are patched once all ids are known.
+                node_ids = {}
+                pending_children = []
+                stack = [_ROOT_INDEX]
+                while stack:
+                    index = stack.pop()
+                    node_ids[index] = len(feature)
+                    tag = topology[index]
+                    param_addr = topology[index + 1]
+                    if tag == _THRESHOLD_NODE:
+                        feature.append(topology[index + 4])
+                        threshold.append(parameters[param_addr + 1])
+                        left, right = topology[index + 2], topology[index + 3]
+                        children.append([left, right])
+                        pending_children.append(len(children) - 1)
+                        stack += [right, left]
+                    elif tag == _CONST_PROB_NODE:
+                        feature.append(-1)
+                        threshold.append(0.0)
+                        children.append([len(leaf_values), -1])
+                        leaf_values.append(parameters[param_addr + 1 : param_addr + 1 + class_count])
+                    else:
+                        raise NotImplementedError("Unsupported random forest node type: {:#x}".format(tag))
+
+                for child_row in pending_children:
+                    children[child_row] = [node_ids[c] for c in children[child_row]]
+            forest_bounds.append(len(roots))
+
+        return cls(
+            numpy.asarray(feature, dtype=numpy.int32),
+            numpy.asarray(threshold, dtype=numpy.float64),
+            numpy.asarray(children, dtype=numpy.int32).reshape(-1, 2),
+            numpy.asarray(leaf_values, dtype=numpy.float64).reshape(-1, class_count),
+            numpy.asarray(roots, dtype=numpy.int32),
+            numpy.asarray(forest_bounds, dtype=numpy.int32),
+        )
+
+    def predict_probabilities(self, X):
+        """
+        Predict class probabilities for the rows of X.
+        Large inputs are split into chunks of rows, which are processed in parallel requests.
+        """
+        X = numpy.ascontiguousarray(X, dtype=numpy.float32)
+        assert X.ndim == 2
+        out = numpy.zeros((len(X), self.class_count), dtype=numpy.float32)
+        self._process_in_chunks(self._predict_rows, X, out)
+        return out
+
+    def predict_probabilities_early_exit(self, X, margin, tree_batch_size=8):
+        """
+        Predict class probabilities for the rows of X, evaluating the trees in batches of tree_batch_size.
+        A row is not evaluated by any further trees once the difference between its two most probable
+        classes (averaged over all trees evaluated so far) is at least margin.
+
+        Returns the probabilities and the number of trees that were evaluated for each row.
+        """
+        X = numpy.ascontiguousarray(X, dtype=numpy.float32)
+        assert X.ndim == 2
+        assert tree_batch_size > 0
+        out = numpy.zeros((len(X), self.class_count), dtype=numpy.float32)
+        trees_used = numpy.zeros(len(X), dtype=numpy.int32)
+        self._process_in_chunks(partial(self._predict_rows_early_exit, margin, tree_batch_size), X, out, trees_used)
+        return out, trees_used
+
+    def _process_in_chunks(self, func, X, *outputs):
+        chunk_starts = range(0, len(X), self.CHUNK_ROWS)
+        if len(chunk_starts) <= 1 or Request.global_thread_pool.num_workers == 0:
+            func(X, *outputs)
+            return
+
+        pool = RequestPool()
+        for start in chunk_starts:
+            chunk = slice(start, start + self.CHUNK_ROWS)
+            pool.add(Request(partial(func, X[chunk], *(output[chunk] for output in outputs))))
+        pool.wait()
+
+    def _predict_rows(self, X, out):
+        args = (self.feature, self.threshold, self.children, self.leaf_values, self.roots, self.forest_bounds, X, out)
+        if WITH_NUMBA:
+            _predict_rows_numba(*args)
+        else:
+            _predict_rows_numpy(*args)
+
+    def _predict_rows_early_exit(self, margin, tree_batch_size, X, out, trees_used):
+        args = (self.feature, self.threshold, self.children, self.leaf_values, self.roots)
+        args += (float(margin), int(tree_batch_size), X, out, trees_used)
+        if WITH_NUMBA:
+            _predict_rows_early_exit_numba(*args)
+        else:
+            _predict_rows_early_exit_numpy(*args)
+
+
+def _leaves_numpy(feature, threshold, children, root, X):
+    """
+    Return the leaf index each row of X ends up in, for the tree starting at node root.
+    """
+    rows = numpy.arange(len(X))
+    nodes = numpy.full(len(X), root, dtype=numpy.int32)
+    active = feature[nodes] >= 0
+    while active.any():
+        active_nodes = nodes[active]
+        # (not "x >= threshold", so that NaNs go right as in vigra)
+        go_right = ~(X[rows[active], feature[active_nodes]] < threshold[active_nodes])
+        nodes[active] = children[active_nodes, go_right.astype(numpy.intp)]
+        active = feature[nodes] >= 0
+    return children[nodes, 0]
+
+
+def _predict_rows_numpy(feature, threshold, children, leaf_values, roots, forest_bounds, X, out):
+    num_trees_total = numpy.float32(forest_bounds[-1])
+
+    for forest_index in range(len(forest_bounds) - 1):
+        tree_begin, tree_end = forest_bounds[forest_index], forest_bounds[forest_index + 1]
+        forest_prob = numpy.zeros(out.shape, dtype=numpy.float32)
+        total_weight = numpy.zeros(len(X), dtype=numpy.float64)
+
+        for tree in range(tree_begin, tree_end):
+            weights = leaf_values[_leaves_numpy(feature, threshold, children, roots[tree], X)]
+            # Same accumulation order as vigra
+            for label in range(out.shape[1]):
+                forest_prob[:, label] += weights[:, label].astype(numpy.float32)
+                total_weight += weights[:, label]
+
+        forest_prob /= total_weight.astype(numpy.float32)[:, None]
+        forest_prob *= numpy.float32(tree_end - tree_begin)
+        out += forest_prob
+
+    out /= num_trees_total
+
+
+def _predict_rows_early_exit_numpy(
+    feature, threshold, children, leaf_values, roots, margin, tree_batch_size, X, out, trees_used
+):
+    num_trees = len(roots)
+    votes = numpy.zeros(out.shape, dtype=numpy.float64)
+    active = numpy.arange(len(X))
+
+    for batch_start in range(0, num_trees, tree_batch_size):
+        batch_stop = min(batch_start + tree_batch_size, num_trees)
+        X_active = X[active]
+        for tree in range(batch_start, batch_stop):
+            votes[active] += leaf_values[_leaves_numpy(feature, threshold, children, roots[tree], X_active)]
+        trees_used[active] = batch_stop
+
+        posterior = votes[active] / votes[active].sum(axis=1, keepdims=True)
+        if posterior.shape[1] < 2:
+            break
+        top_two = numpy.partition(posterior, -2, axis=1)[:, -2:]
+        active = active[top_two[:, 1] - top_two[:, 0] < margin]
+        if len(active) == 0:
+            break
+
+    out[:] = votes / votes.sum(axis=1, keepdims=True)
+
+
+if WITH_NUMBA:
+
+    @numba.njit(nogil=True, cache=True)
+    def _predict_rows_numba(feature, threshold, children, leaf_values, roots, forest_bounds, X, out):
+        num_classes = out.shape[1]
+        num_trees_total = numpy.float32(forest_bounds[-1])
+        forest_prob = numpy.empty(num_classes, dtype=numpy.float32)
+
+        for row in range(X.shape[0]):
+            for forest_index in range(len(forest_bounds) - 1):
+                tree_begin = forest_bounds[forest_index]
+                tree_end = forest_bounds[forest_index + 1]
+                forest_prob[:] = 0
+                total_weight = 0.0
+                for tree in range(tree_begin, tree_end):
+                    node = roots[tree]
+                    while feature[node] >= 0:
+                        if X[row, feature[node]] < threshold[node]:
+                            node = children[node, 0]
+                        else:
+                            node = children[node, 1]
+                    leaf = children[node, 0]
+                    for label in range(num_classes):
+                        forest_prob[label] += numpy.float32(leaf_values[leaf, label])
+                        total_weight += leaf_values[leaf, label]
+
+                tree_count = numpy.float32(tree_end - tree_begin)
+                for label in range(num_classes):
+                    out[row, label] += (forest_prob[label] / numpy.float32(total_weight)) * tree_count
+
+            for label in range(num_classes):
+                out[row, label] /= num_trees_total
+
+    @numba.njit(nogil=True, cache=True)
+    def _predict_rows_early_exit_numba(
+        feature, threshold, children, leaf_values, roots, margin, tree_batch_size, X, out, trees_used
+    ):
+        num_classes = out.shape[1]
+        num_trees = len(roots)
+        votes = numpy.empty(num_classes, dtype=numpy.float64)
+
+        for row in range(X.shape[0]):
+            votes[:] = 0
+            tree = 0
+            while tree < num_trees:
+                batch_stop = min(tree + tree_batch_size, num_trees)
+                while tree < batch_stop:
+                    node = roots[tree]
+                    while feature[node] >= 0:
+                        if X[row, feature[node]] < threshold[node]:
+                            node = children[node, 0]
+                        else:
+                            node = children[node, 1]
+                    leaf = children[node, 0]
+                    for label in range(num_classes):
+                        votes[label] += leaf_values[leaf, label]
+                    tree += 1
+
+                # Difference between the two most probable classes
+                first = 0.0
+                second = 0.0
+                for label in range(num_classes):
+                    if votes[label] > first:
+                        second = first
+                        first = votes[label]
+                    elif votes[label] > second:
+                        second = votes[label]
+                if num_classes < 2 or first - second >= margin * votes.sum():
+                    break
+
+            trees_used[row] = tree
+            total = votes.sum()
+            for label in range(num_classes):
+                out[row, label] = votes[label] / total
@@ -34,19 +34,19 @@ if sys.version_info.major >= 3:
     unicode = str
 
 import os
-import tempfile
 from functools import partial
 import pickle as pickle
 import collections
 
 import numpy
 import vigra
-import h5py
 import random
 
 from lazyflow.utility import Timer
 from lazyflow.request import Request, RequestPool, RequestLock
 from .lazyflowClassifier import LazyflowVectorwiseClassifierABC, LazyflowVectorwiseClassifierFactoryABC
+from .flatForest import FlatForest, WITH_NUMBA
+from . import vigraRfHdf5
 
 import logging
 
@@ -61,6 +61,9 @@ class ParallelVigraRfLazyflowClassifierFactory(LazyflowVectorwiseClassifierFacto
     VERSION = 2  # This is used to determine compatibility of pickled classifier factories.
     # You must bump this if any instance members are added/removed/renamed.
 
+    # Fraction of the trees that update_and_train() replaces by default
+    INCREMENTAL_TREE_FRACTION = 0.1
+
     def __init__(
         self,
         num_trees_total=100,
@@ -111,12 +114,7 @@ class ParallelVigraRfLazyflowClassifierFactory(LazyflowVectorwiseClassifierFacto
     def create_and_train(self, X, y, feature_names=None):
         logger.debug("Training parallel vigra RF")
 
-        # Distribute trees as evenly as possible
-        tree_counts = numpy.array([self._num_trees // self._num_forests] * self._num_forests)
-        tree_counts[: self._num_trees % self._num_forests] += 1
-        assert tree_counts.sum() == self._num_trees
-        tree_counts = list(map(int, tree_counts))
-        tree_counts[:] = (tree_count for tree_count in tree_counts if tree_count != 0)
+        tree_counts = self._distribute_trees(self._num_trees)
 
         # Save for future reference
         known_labels = numpy.unique(y)
@@ -129,17 +127,10 @@ class ParallelVigraRfLazyflowClassifierFactory(LazyflowVectorwiseClassifierFacto
         assert X.ndim == 2
         assert len(X) == len(y)
 
-        # Sample X and y
-        if self._label_proportion:
-            proportion = self._label_proportion
-            row_num = int(proportion * X.shape[0])
-            idx = random.sample(list(range(X.shape[0])), row_num)
-            X = X[idx, :]
-            y = y[idx]
-            assert (numpy.unique(y) == known_labels).all(), (
-                "Sampled labels are not representative of the complete set: some label values are missing!\n"
-                "Sampled labels include {}, but complete set has {}".format(numpy.unique(y), known_labels)
-            )
+        # Remember the training samples, so that later updates can tell whether samples were only added.
+        training_hashes = _training_sample_hashes(X, y)
+
+        X, y = self._sample(X, y, known_labels)
 
         # Create N forests to train
         # (treecount of each might differ)
@@ -166,7 +157,116 @@ class ParallelVigraRfLazyflowClassifierFactory(LazyflowVectorwiseClassifierFacto
             oobs = self._train_forests(forests, X, y)
 
         logger.info("Training complete. Average OOB: {}".format(numpy.average(oobs)))
-        return ParallelVigraRfLazyflowClassifier(forests, oobs, known_labels, feature_names, named_importances)
+        return ParallelVigraRfLazyflowClassifier(
+            forests, oobs, known_labels, feature_names, named_importances, training_hashes
+        )
+
+    def update_and_train(self, previous_classifier, X, y, feature_names=None, num_trees_to_replace=None):
+        """
+        Like create_and_train(), but re-use the trees of a classifier that was previously
+        produced by this factory, if the training data only grew since then.
+
+        Only the oldest forests that hold at least num_trees_to_replace trees are dropped, and
+        forests with the same tree counts are trained on the complete (current) training data,
+        so the number of forests and trees stays the same.  Repeated updates thus replace the
+        forests in a rolling fashion, and the latency of each update scales with
+        num_trees_to_replace instead of the total number of trees.
+
+        Falls back to a full retrain if there is no usable previous classifier, if training
+        samples were removed, or if the set of classes or features changed.
+
+        num_trees_to_replace: Defaults to INCREMENTAL_TREE_FRACTION of the total number of trees.
+        """
+        X = numpy.asarray(X, numpy.float32)
+        y = numpy.asarray(y, numpy.uint32).reshape(len(X))
+
+        if not self._can_update(previous_classifier, X, y, feature_names):
+            return self.create_and_train(X, y, feature_names)
+
+        training_hashes = _training_sample_hashes(X, y)
+        previous_hashes = previous_classifier._training_hashes
+        if not numpy.isin(previous_hashes, training_hashes).all():
+            logger.debug("Training samples were removed: retraining the complete forest.")
+            return self.create_and_train(X, y, feature_names)
+
+        if (
+            len(training_hashes) == len(previous_hashes)
+            and (numpy.sort(training_hashes) == numpy.sort(previous_hashes)).all()
+        ):
+            # Nothing changed.
+            return previous_classifier
+
+        if num_trees_to_replace is None:
+            num_trees_to_replace = int(round(self._num_trees * self.INCREMENTAL_TREE_FRACTION))
+        num_trees_to_replace = min(max(1, num_trees_to_replace), self._num_trees)
+
+        # Drop the oldest forests until enough trees are dropped, and replace them by forests of the same sizes.
+        # (Forests are stored oldest first.)
+        forests = list(previous_classifier._forests)
+        oobs = list(previous_classifier.oobs)
+        dropped_tree_counts = []
+        while forests and sum(dropped_tree_counts) < num_trees_to_replace:
+            dropped_tree_counts.append(forests.pop(0).treeCount())
+            oobs.pop(0)
+
+        new_forests = [vigra.learning.RandomForest(tree_count, **self._kwargs) for tree_count in dropped_tree_counts]
+
+        X_train, y_train = self._sample(X, y[:, numpy.newaxis], previous_classifier.known_classes)
+        new_oobs = self._train_forests(new_forests, X_train, y_train)
+
+        logger.info(
+            "Replaced {} of {} trees. Average OOB of the new trees: {}".format(
+                sum(dropped_tree_counts), self._num_trees, numpy.average(new_oobs)
+            )
+        )
+        return ParallelVigraRfLazyflowClassifier(
+            forests + new_forests,
+            oobs + new_oobs,
+            previous_classifier.known_classes,
+            feature_names,
+            None,
+            training_hashes,
+        )
+
+    def _can_update(self, previous_classifier, X, y, feature_names):
+        if not isinstance(previous_classifier, ParallelVigraRfLazyflowClassifier):
+            return False
+        if previous_classifier._training_hashes is None or self._variable_importance_enabled:
+            return False
+        if previous_classifier._num_trees != self._num_trees:
+            return False
+        if X.ndim != 2 or X.shape[1] != previous_classifier.feature_count:
+            return False
+        if feature_names is not None and previous_classifier.feature_names is not None:
+            if list(feature_names) != list(previous_classifier.feature_names):
+                return False
+        return numpy.array_equal(numpy.unique(y), numpy.asarray(previous_classifier.known_classes))
+
+    def _distribute_trees(self, num_trees):
+        """
+        Distribute trees as evenly as possible among (at most) num_forests forests.
+        """
+        tree_counts = numpy.array([num_trees // self._num_forests] * self._num_forests)
+        tree_counts[: num_trees % self._num_forests] += 1
+        assert tree_counts.sum() == num_trees
+        return [int(tree_count) for tree_count in tree_counts if tree_count != 0]
+
+    def _sample(self, X, y, known_labels):
+        """
+        Sample X and y according to the label proportion (if any).
+        """
+        if not self._label_proportion:
+            return X, y
+
+        row_num = int(self._label_proportion * X.shape[0])
+        idx = random.sample(list(range(X.shape[0])), row_num)
+        X = X[idx, :]
+        y = y[idx]
+        assert (numpy.unique(y) == known_labels).all(), (
+            "Sampled labels are not representative of the complete set: some label values are missing!\n"
+            "Sampled labels include {}, but complete set has {}".format(numpy.unique(y), known_labels)
+        )
+        return X, y
 
     @staticmethod
     def _train_forests(forests, X, y):
@@ -254,6 +354,22 @@ class ParallelVigraRfLazyflowClassifierFactory(LazyflowVectorwiseClassifierFacto
 assert issubclass(ParallelVigraRfLazyflowClassifierFactory, LazyflowVectorwiseClassifierFactoryABC)
 
 
+def _training_sample_hashes(X, y):
+    """
+    Return a 64 bit hash for each (features, label) row of the training data.
+    Used to detect whether training samples were removed between two trainings.
+    """
+    X = numpy.ascontiguousarray(X, dtype=numpy.float32)
+    y = numpy.asarray(y, dtype=numpy.uint32).reshape(len(X), -1)
+    rows = numpy.concatenate((X.view(numpy.uint32), y), axis=1).astype(numpy.uint64)
+
+    # Fixed odd multipliers, so that hashes are comparable across calls.
+    # (uint64 arithmetic wraps around, which is what we want here.)
+    rng = numpy.random.RandomState(0)
+    multipliers = rng.randint(1, 2**62, size=rows.shape[1], dtype=numpy.uint64) * numpy.uint64(2) + numpy.uint64(1)
+    return (rows * multipliers).sum(axis=1, dtype=numpy.uint64)
+
+
 def generate_importance_table(named_importances_dict, sort=None, export_path=None):
     """
     Return a string of the given importances dict, in csv format,
@@ -315,7 +431,11 @@ class ParallelVigraRfLazyflowClassifier(LazyflowVectorwiseClassifierABC):
     Adapt the vigra RandomForest class to the interface lazyflow expects.
     """
 
-    def __init__(self, forests, oobs, known_labels, feature_names=None, named_importances=None):
+    # If True, prediction evaluates all forests at once with a FlatForest instead of calling vigra for each forest.
+    # The flat engine only pays off if it is compiled with numba.
+    USE_FLAT_FOREST = WITH_NUMBA
+
+    def __init__(self, forests, oobs, known_labels, feature_names=None, named_importances=None, training_hashes=None):
         self._known_labels = known_labels
         self._forests = forests
         self._feature_names = feature_names
@@ -328,6 +448,26 @@ class ParallelVigraRfLazyflowClassifier(LazyflowVectorwiseClassifierABC):
         # Named importances for the variable importance table
         self._named_importances = named_importances
 
+        # Hashes of the training samples (see ParallelVigraRfLazyflowClassifierFactory.update_and_train)
+        # Not serialized: classifiers loaded from a project file are always fully retrained.
+        self._training_hashes = training_hashes
+
+        # Compiled lazily, on first prediction (see USE_FLAT_FOREST)
+        self._flat_forest = None
+        self._flat_forest_lock = RequestLock()
+
+        # See set_early_exit()
+        self._early_exit_margin = None
+        self._early_exit_tree_batch_size = 8
+
+    def set_early_exit(self, margin, tree_batch_size=8):
+        """
+        Make predict_probabilities() stop evaluating trees for pixels whose class posterior is clear,
+        see predict_probabilities_early_exit(). Pass margin=None to evaluate all trees again.
+        """
+        self._early_exit_margin = margin
+        self._early_exit_tree_batch_size = tree_batch_size
+
     def predict_probabilities(self, X):
         logger.debug("Predicting with parallel vigra RF")
         X = numpy.asarray(X, dtype=numpy.float32)
@@ -341,6 +481,21 @@ class ParallelVigraRfLazyflowClassifier(LazyflowVectorwiseClassifierABC):
                 X.shape[1], len(self._feature_names), self._feature_names
             )
 
+        use_flat_forest = self.USE_FLAT_FOREST or self._early_exit_margin is not None
+        flat_forest = self._get_flat_forest() if use_flat_forest else None
+        if flat_forest is not None:
+            if self._early_exit_margin is not None:
+                probabilities, trees_used = flat_forest.predict_probabilities_early_exit(
+                    X, self._early_exit_margin, self._early_exit_tree_batch_size
+                )
+                logger.debug(
+                    "Early exit prediction used {:.1f} of {} trees on average".format(
+                        trees_used.mean(), self._num_trees
+                    )
+                )
+                return probabilities
+            return flat_forest.predict_probabilities(X)
+
         # As each forest completes, aggregate results in a shared array.
         # (Must put in a list so we can update it in this closure.)
         total_predictions = [None]
@@ -366,6 +521,38 @@ class ParallelVigraRfLazyflowClassifier(LazyflowVectorwiseClassifierABC):
         total_predictions[0] /= self._num_trees
         return total_predictions[0]
 
+    def predict_probabilities_early_exit(self, X, margin, tree_batch_size=8):
+        """
+        Anytime prediction: trees are evaluated in batches of tree_batch_size, and pixels for which the
+        difference between the two most probable classes reaches margin are not evaluated any further.
+        (margin=0 evaluates a single batch, margin>1 evaluates all trees.)
+
+        Returns the probabilities and the average number of trees evaluated per pixel.
+        """
+        X = numpy.asarray(X, dtype=numpy.float32)
+        assert X.ndim == 2
+
+        flat_forest = self._get_flat_forest()
+        if flat_forest is None:
+            return self.predict_probabilities(X), float(self._num_trees)
+
+        probabilities, trees_used = flat_forest.predict_probabilities_early_exit(X, margin, tree_batch_size)
+        average_trees = float(trees_used.mean()) if len(trees_used) else 0.0
+        return probabilities, average_trees
+
+    def _get_flat_forest(self):
+        """
+        Return the FlatForest for our forests, or None if they can't be compiled.
+        """
+        with self._flat_forest_lock:
+            if self._flat_forest is None:
+                try:
+                    self._flat_forest = FlatForest.from_vigra_forests(self._forests)
+                except NotImplementedError as ex:
+                    logger.debug("Falling back to vigra prediction: {}".format(ex))
+                    self._flat_forest = False
+        return self._flat_forest or None
+
     @property
     def oobs(self):
         return self._oobs
@@ -391,23 +578,9 @@ class ParallelVigraRfLazyflowClassifier(LazyflowVectorwiseClassifierABC):
             if forest is None:
                 return
 
-        name = h5py_group.name.split("/")[-1]
-        # Due to non-shared hdf5 dlls, vigra can't write directly to
-        # our open hdf5 group. Instead, we'll use vigra to write the
-        # classifier to a temporary file.
-        tmpDir = tempfile.mkdtemp()
-        cachePath = os.path.join(tmpDir, "tmp_classifier_cache.h5").replace("\\", "/")
-        for i, forest in enumerate(self._forests):
-            targetname = "{0}/{1}".format(name, "Forest{:04d}".format(i))
-            forest.writeHDF5(cachePath, targetname)
-
-        parent_group = h5py_group.parent
-        del parent_group[name]
-        # Open the temp file and copy to our project group
-        with h5py.File(cachePath, "r") as cacheFile:
-            parent_group.copy(cacheFile[name], name)
-
-        h5py_group = parent_group[name]
+        forest_names = ["Forest{:04d}".format(i) for i in range(len(self._forests))]
+        vigraRfHdf5.write_forests(self._forests, h5py_group, forest_names)
+
         h5py_group["known_labels"] = self._known_labels
         if self._feature_names is not None:
             feature_names = [name.encode("utf-8") for name in self._feature_names]
@@ -420,25 +593,10 @@ class ParallelVigraRfLazyflowClassifier(LazyflowVectorwiseClassifierABC):
             h5py_group.create_dataset("named_importances_keys", data=list(self._named_importances.keys()))
             h5py_group.create_dataset("named_importances_values", data=list(self._named_importances.values()))
 
-        os.remove(cachePath)
-        os.rmdir(tmpDir)
-
     @classmethod
     def deserialize_hdf5(cls, h5py_group):
-        name = h5py_group.name.split("/")[-1]
-        # Due to non-shared hdf5 dlls, vigra can't read directly
-        # from our open hdf5 group. Instead, we'll copy the
-        # classfier data to a temporary file and give it to vigra.
-        tmpDir = tempfile.mkdtemp()
-        cachePath = os.path.join(tmpDir, "tmp_classifier_cache.h5").replace("\\", "/")
-        with h5py.File(cachePath, "w") as cacheFile:
-            cacheFile.copy(h5py_group, name)
-
-        forests = []
-        for dset_name, forestGroup in sorted(h5py_group.items()):
-            if dset_name.startswith("Forest"):
-                targetname = "{0}/{1}".format(name, dset_name)
-                forests.append(vigra.learning.RandomForest(cachePath, targetname))
+        forest_names = sorted(name for name in h5py_group.keys() if name.startswith("Forest"))
+        forests = vigraRfHdf5.read_forests(h5py_group, forest_names)
 
         try:
             known_labels = list(h5py_group["known_labels"][:])
@@ -467,9 +625,6 @@ class ParallelVigraRfLazyflowClassifier(LazyflowVectorwiseClassifierABC):
         except KeyError:
             named_importances = None
 
-        os.remove(cachePath)
-        os.rmdir(tmpDir)
-
         return ParallelVigraRfLazyflowClassifier(forests, oobs, known_labels, feature_names, named_importances)
 
 
@@ -2,9 +2,15 @@ from __future__ import absolute_import
 from future import standard_library
 
 standard_library.install_aliases()
+import copy
 import pickle as pickle
+from functools import partial
+
 import numpy
 import vigra
+
+from lazyflow.request import Request, RequestPool
+from lazyflow.utility import Memory
 from .lazyflowClassifier import LazyflowVectorwiseClassifierABC, LazyflowVectorwiseClassifierFactoryABC
 
 import logging
@@ -52,6 +58,10 @@ class SklearnLazyflowClassifierFactory(LazyflowVectorwiseClassifierFactoryABC):
     def description(self):
         return self._classifier_type.__name__
 
+    def estimated_ram_usage_per_requested_predictionchannel(self):
+        # predict_proba() results are float64, and typically need one temporary of the same size
+        return 2 * 8
+
     def __eq__(self, other):
         return (
             isinstance(other, type(self))
@@ -82,9 +92,63 @@ class SklearnLazyflowClassifier(LazyflowVectorwiseClassifierABC):
 
         self.VERSION = SklearnLazyflowClassifier.VERSION
 
+    # Large inputs are split into row chunks that are predicted in parallel requests,
+    # but chunks are never smaller than this.
+    MIN_CHUNK_ROWS = 10000
+
     def predict_probabilities(self, X):
         logger.debug("Predicting with sklearn classifier: {}".format(type(self._sklearn_classifier).__name__))
-        return self._sklearn_classifier.predict_proba(numpy.asarray(X, dtype=numpy.float32))
+        X = numpy.asarray(X, dtype=numpy.float32)
+        classifier = self._get_prediction_classifier()
+
+        chunk_rows = self._get_chunk_rows(X)
+        if chunk_rows >= len(X):
+            return classifier.predict_proba(X)
+
+        chunk_starts = range(0, len(X), chunk_rows)
+        chunk_results = [None] * len(chunk_starts)
+
+        def predict_chunk(i, start):
+            chunk_results[i] = classifier.predict_proba(X[start : start + chunk_rows])
+
+        pool = RequestPool()
+        for i, start in enumerate(chunk_starts):
+            pool.add(Request(partial(predict_chunk, i, start)))
+        pool.wait()
+        return numpy.concatenate(chunk_results, axis=0)
+
+    def _get_prediction_classifier(self):
+        """
+        Lazyflow already predicts several blocks (and chunks) in parallel, so an estimator's own
+        n_jobs would only oversubscribe the cores. Returns a (shallow) copy restricted to one job, if necessary.
+        """
+        if Request.global_thread_pool.num_workers == 0:
+            return self._sklearn_classifier
+
+        try:
+            n_jobs = self._sklearn_classifier.get_params(deep=False).get("n_jobs", 1)
+        except AttributeError:
+            return self._sklearn_classifier
+        if n_jobs in (None, 1):
+            return self._sklearn_classifier
+
+        classifier = copy.copy(self._sklearn_classifier)
+        classifier.set_params(n_jobs=1)
+        return classifier
+
+    def _get_chunk_rows(self, X):
+        """
+        Rows per chunk: enough chunks to keep all workers busy, but no more than
+        the available RAM allows (for all workers at the same time).
+        """
+        num_workers = Request.global_thread_pool.num_workers
+        if num_workers <= 1 or len(X) < 2 * self.MIN_CHUNK_ROWS:
+            return len(X)
+
+        bytes_per_row = X.itemsize * X.shape[1] + 2 * 8 * len(self._known_classes)
+        max_rows_in_ram = Memory.getAvailableRamComputation() // (num_workers * bytes_per_row)
+        chunk_rows = -(-len(X) // num_workers)
+        return int(max(self.MIN_CHUNK_ROWS, min(chunk_rows, max_rows_in_ram)))
 
     @property
     def known_classes(self):
@@ -0,0 +1,79 @@
+###############################################################################
+#   lazyflow: data flow based lazy parallel computation framework
+#
+#       Copyright (C) 2011-2024, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the Lesser GNU General Public License
+# as published by the Free Software Foundation; either version 2.1
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# See the files LICENSE.lgpl2 and LICENSE.lgpl3 for full text of the
+# GNU Lesser General Public License version 2.1 and 3 respectively.
+# This information is also available on the ilastik web site at:
+#          http://ilastik.org/license/
+###############################################################################
+"""
+Copy vigra RandomForests to/from h5py groups.
+
+Due to non-shared hdf5 dlls, vigra can't write to (or read from) our open h5py files,
+only to files it opens itself by name. All forests of a classifier therefore go through
+a single scratch file, which lives in shared memory (/dev/shm) if possible, so that
+nothing touches the disk (or the -- possibly networked or read-only -- temp directory).
+"""
+import contextlib
+import os
+import shutil
+import tempfile
+
+import h5py
+import vigra
+
+_SHARED_MEMORY_DIR = "/dev/shm"
+
+
+def write_forests(forests, h5py_group, names):
+    """
+    Write each of the given vigra forests to a subgroup of h5py_group with the corresponding name.
+    """
+    assert len(forests) == len(names)
+    with _scratch_path() as path:
+        for forest, name in zip(forests, names):
+            forest.writeHDF5(path, name)
+
+        with h5py.File(path, "r") as scratch_file:
+            for name in names:
+                h5py_group.copy(scratch_file[name], name)
+
+
+def read_forests(h5py_group, names):
+    """
+    Read the vigra forests stored in the given subgroups of h5py_group.
+    """
+    with _scratch_path() as path:
+        with h5py.File(path, "w") as scratch_file:
+            for name in names:
+                scratch_file.copy(h5py_group[name], name)
+
+        return [vigra.learning.RandomForest(path, name) for name in names]
+
+
+def _scratch_dir():
+    if os.path.isdir(_SHARED_MEMORY_DIR) and os.access(_SHARED_MEMORY_DIR, os.W_OK):
+        return _SHARED_MEMORY_DIR
+    return None  # tempfile's default
+
+
+@contextlib.contextmanager
+def _scratch_path():
+    tmp_dir = tempfile.mkdtemp(prefix="vigra_rf_", dir=_scratch_dir())
+    try:
+        yield os.path.join(tmp_dir, "forests.h5").replace("\\", "/")
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
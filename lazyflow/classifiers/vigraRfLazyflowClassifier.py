@@ -5,16 +5,14 @@ standard_library.install_aliases()
 from builtins import map
 from builtins import zip
 from builtins import range
-import os
-import tempfile
 import pickle as pickle
 import collections
 
 import numpy
 import vigra
-import h5py
 
 from .lazyflowClassifier import LazyflowVectorwiseClassifierABC, LazyflowVectorwiseClassifierFactoryABC
+from . import vigraRfHdf5
 
 import logging
 
@@ -149,17 +147,7 @@ class VigraRfLazyflowClassifier(LazyflowVectorwiseClassifierABC):
         return self._feature_names
 
     def serialize_hdf5(self, h5py_group):
-        # Due to non-shared hdf5 dlls, vigra can't write directly to
-        # our open hdf5 group. Instead, we'll use vigra to write the
-        # classifier to a temporary file.
-        tmpDir = tempfile.mkdtemp()
-        cachePath = os.path.join(tmpDir, "tmp_classifier_cache.h5").replace("\\", "/")
-        self._vigra_rf.writeHDF5(cachePath, "forest")
-
-        # Open the temp file and copy to our project group
-        with h5py.File(cachePath, "r") as cacheFile:
-            h5py_group.copy(cacheFile["forest"], "forest")
-
+        vigraRfHdf5.write_forests([self._vigra_rf], h5py_group, ["forest"])
         h5py_group["known_labels"] = self._known_labels
         h5py_group["feature_names"] = [name.encode("utf-8") for name in self._feature_names]
 
@@ -168,21 +156,10 @@ class VigraRfLazyflowClassifier(LazyflowVectorwiseClassifierABC):
 
     @classmethod
     def deserialize_hdf5(cls, h5py_group):
-        # Due to non-shared hdf5 dlls, vigra can't read directly
-        # from our open hdf5 group. Instead, we'll copy the
-        # classfier data to a temporary file and give it to vigra.
-        tmpDir = tempfile.mkdtemp()
-        cachePath = os.path.join(tmpDir, "tmp_classifier_cache.h5").replace("\\", "/")
-        with h5py.File(cachePath, "w") as cacheFile:
-            cacheFile.copy(h5py_group["forest"], "forest")
-
-        forest = vigra.learning.RandomForest(cachePath, "forest")
+        (forest,) = vigraRfHdf5.read_forests(h5py_group, ["forest"])
         known_labels = list(h5py_group["known_labels"][:])
         feature_names = list(map(unicode, h5py_group["feature_names"][:]))
 
-        os.remove(cachePath)
-        os.rmdir(tmpDir)
-
         return VigraRfLazyflowClassifier(forest, known_labels, feature_names, None, None)
 
 
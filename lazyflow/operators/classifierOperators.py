@@ -23,8 +23,12 @@ from __future__ import absolute_import
 ###############################################################################
 # Python
 from abc import abstractmethod
+import collections
+import contextlib
 import copy
+import hashlib
 import logging
+import pickle
 
 # SciPy
 import numpy
@@ -32,6 +36,7 @@ import numpy
 # lazyflow
 from lazyflow.graph import Operator, InputSlot, OutputSlot, OrderedSignal, OperatorWrapper
 from lazyflow.roi import sliceToRoi, roiToSlice, getIntersection, roiFromShape, nonzero_bounding_box, enlargeRoiForHalo
+from lazyflow.request import Request, RequestLock
 from lazyflow.utility import Timer
 from lazyflow.classifiers import (
     LazyflowVectorwiseClassifierABC,
@@ -60,6 +65,10 @@ class OpTrainClassifierBlocked(Operator):
     nonzeroLabelBlocks = InputSlot(level=1)  # Used only in the pixelwise case.
     MaxLabel = InputSlot()
 
+    # Used only in the vectorwise case: Train with a class-balanced subset of the labels (see OpFeatureMatrixCache)
+    MaxSamplesPerClass = InputSlot(optional=True)
+    SamplingSeed = InputSlot(optional=True)
+
     Classifier = OutputSlot()
 
     def __init__(self, *args, **kwargs):
@@ -73,6 +82,8 @@ class OpTrainClassifierBlocked(Operator):
         self._opVectorwiseTrain.Labels.connect(self.Labels)
         self._opVectorwiseTrain.ClassifierFactory.connect(self.ClassifierFactory)
         self._opVectorwiseTrain.MaxLabel.connect(self.MaxLabel)
+        self._opVectorwiseTrain.MaxSamplesPerClass.connect(self.MaxSamplesPerClass)
+        self._opVectorwiseTrain.SamplingSeed.connect(self.SamplingSeed)
         self._opVectorwiseTrain.progressSignal.subscribe(self.progressSignal)
 
         # Fully connect the pixelwise training operator
@@ -246,6 +257,8 @@ class OpTrainVectorwiseClassifierBlocked(Operator):
     Labels = InputSlot(level=1)
     ClassifierFactory = InputSlot()
     MaxLabel = InputSlot()
+    MaxSamplesPerClass = InputSlot(optional=True)
+    SamplingSeed = InputSlot(optional=True)
 
     Classifier = OutputSlot()
 
@@ -257,9 +270,13 @@ class OpTrainVectorwiseClassifierBlocked(Operator):
         super(OpTrainVectorwiseClassifierBlocked, self).__init__(*args, **kwargs)
         self.progressSignal = OrderedSignal()
 
-        self._opFeatureMatrixCaches = OperatorWrapper(OpFeatureMatrixCache, parent=self)
+        self._opFeatureMatrixCaches = OperatorWrapper(
+            OpFeatureMatrixCache, parent=self, broadcastingSlotNames=["MaxSamplesPerClass", "SamplingSeed"]
+        )
         self._opFeatureMatrixCaches.LabelImage.connect(self.Labels)
         self._opFeatureMatrixCaches.FeatureImage.connect(self.Images)
+        self._opFeatureMatrixCaches.MaxSamplesPerClass.connect(self.MaxSamplesPerClass)
+        self._opFeatureMatrixCaches.SamplingSeed.connect(self.SamplingSeed)
 
         self._opConcatenateFeatureMatrices = OpConcatenateFeatureMatrices(parent=self)
         self._opConcatenateFeatureMatrices.FeatureMatrices.connect(self._opFeatureMatrixCaches.LabelAndFeatureMatrix)
@@ -302,6 +319,203 @@ class OpTrainVectorwiseClassifierBlocked(Operator):
         pass
 
 
+def training_data_hash(classifier_factory, labels_and_features, channel_names=None):
+    """
+    Returns a hex digest identifying a training run: the label&feature matrix,
+    the feature names and the (pickled) classifier factory settings.
+    Returns None if the factory can't be pickled.
+    """
+    try:
+        factory_bytes = pickle.dumps(classifier_factory, protocol=4)
+    except Exception:
+        return None
+
+    labels_and_features = numpy.ascontiguousarray(labels_and_features)
+    h = hashlib.blake2b(digest_size=20)
+    h.update(factory_bytes)
+    h.update(repr(channel_names).encode("utf-8"))
+    h.update(repr((labels_and_features.shape, labels_and_features.dtype.str)).encode("utf-8"))
+    h.update(labels_and_features.data)
+    return h.hexdigest()
+
+
+class TrainedClassifierCache(object):
+    """
+    A small LRU cache of trained classifiers, keyed by training_data_hash().
+    Lets us skip training entirely if a classifier for the exact same training data already exists,
+    e.g. after toggling features back and forth, or after loading a project file.
+    """
+
+    def __init__(self, max_entries=4):
+        self.max_entries = max_entries
+        self._classifiers = collections.OrderedDict()
+        self._lock = RequestLock()
+
+    def get(self, key):
+        with self._lock:
+            classifier = self._classifiers.get(key)
+            if classifier is not None:
+                self._classifiers.move_to_end(key)
+            return classifier
+
+    def put(self, key, classifier):
+        if key is None or classifier is None:
+            return
+        with self._lock:
+            self._classifiers[key] = classifier
+            self._classifiers.move_to_end(key)
+            while len(self._classifiers) > self.max_entries:
+                self._classifiers.popitem(last=False)
+
+    def key_of(self, classifier):
+        """Returns the key of the given classifier, if it is in the cache."""
+        with self._lock:
+            for key, cached in self._classifiers.items():
+                if cached is classifier:
+                    return key
+        return None
+
+    def clear(self):
+        with self._lock:
+            self._classifiers.clear()
+
+
+# Shared by all training operators, so that classifiers can be re-used across lanes, applets and project loads.
+trained_classifier_cache = TrainedClassifierCache()
+
+
+class _PredictionBatch(object):
+    """Feature matrices to be predicted together with one classifier call."""
+
+    def __init__(self, classifier):
+        self.classifier = classifier
+        self.features = []
+        self.num_rows = 0
+        self.probabilities = None
+        # Released when the batch may be predicted (if it has to wait for a free slot), and when it is done
+        self.ready = RequestLock()
+        self.ready.acquire()
+        self.done = RequestLock()
+        self.done.acquire()
+
+    def add(self, features):
+        """Returns the offset of the given features in the batch"""
+        offset = self.num_rows
+        self.features.append(features)
+        self.num_rows += len(features)
+        return offset
+
+
+class PredictionBatcher(object):
+    """
+    Coalesces concurrent predict_probabilities() calls for the same classifier into a single call.
+
+    While batching is active (see batching()), at most max_concurrent_batches batches are predicted at a time
+    (by default, one per worker thread). A call that finds a free slot predicts right away. Otherwise, its
+    feature matrix joins the open batch of its classifier (up to max_rows rows), which is predicted as soon as
+    another batch finishes, and each caller gets its slice of the result.
+    Callers only wait for their own batch, so a slow batch doesn't hold up the others.
+    This way many small blocks (e.g. from many small images being exported at once) share the per-call overhead
+    of the classifier, and the classifier gets large enough inputs to make use of all its threads.
+
+    If a batched prediction fails, the affected callers simply predict their own matrices.
+    """
+
+    def __init__(self, max_rows=2**20, max_concurrent_batches=None):
+        self.max_rows = max_rows
+        self.max_concurrent_batches = max_concurrent_batches
+        self._active = 0
+        self._queue_lock = RequestLock()
+        self._num_predicting = 0
+        self._waiting = []  # batches waiting for a free slot, oldest first
+        self._open_batches = {}  # id(classifier) -> the waiting batch that new matrices are added to
+
+    @property
+    def active(self):
+        return self._active > 0
+
+    @contextlib.contextmanager
+    def batching(self):
+        """Context manager that enables batching for its duration. Can be nested."""
+        with self._queue_lock:
+            self._active += 1
+        try:
+            yield self
+        finally:
+            with self._queue_lock:
+                self._active -= 1
+
+    def predict_probabilities(self, classifier, features):
+        if not self.active or len(features) >= self.max_rows:
+            return classifier.predict_probabilities(features)
+
+        max_concurrent_batches = self.max_concurrent_batches or max(1, Request.global_thread_pool.num_workers)
+        with self._queue_lock:
+            batch = self._open_batches.get(id(classifier))
+            is_leader = batch is None or batch.num_rows + len(features) > self.max_rows
+            if is_leader:
+                batch = _PredictionBatch(classifier)
+                if self._num_predicting < max_concurrent_batches:
+                    self._num_predicting += 1
+                    batch.ready.release()
+                else:
+                    self._waiting.append(batch)
+                    self._open_batches[id(classifier)] = batch
+            offset = batch.add(features)
+
+        if is_leader:
+            # Wait for a free slot, then predict the batch (including all matrices added in the meantime)
+            with batch.ready:
+                try:
+                    self._predict_batch(batch)
+                finally:
+                    batch.done.release()
+                    self._start_next_batch()
+        else:
+            with batch.done:
+                pass
+
+        if batch.probabilities is None:
+            # The batched prediction failed
+            return classifier.predict_probabilities(features)
+        return batch.probabilities[offset : offset + len(features)]
+
+    def _start_next_batch(self):
+        """Pass the slot of a finished batch on to the oldest waiting batch."""
+        with self._queue_lock:
+            if not self._waiting:
+                self._num_predicting -= 1
+                return
+            batch = self._waiting.pop(0)
+            if self._open_batches.get(id(batch.classifier)) is batch:
+                # No more matrices can be added to it
+                del self._open_batches[id(batch.classifier)]
+        batch.ready.release()
+
+    def _predict_batch(self, batch):
+        if len(batch.features) == 1:
+            batch.probabilities = batch.classifier.predict_probabilities(batch.features[0])
+            return
+
+        try:
+            with Timer() as prediction_timer:
+                features = numpy.concatenate(batch.features)
+                probabilities = batch.classifier.predict_probabilities(features)
+        except Exception:
+            logger.warning("Batched prediction failed, predicting the blocks separately", exc_info=True)
+            return
+
+        logger.debug(
+            f"Batched prediction of {len(batch.features)} blocks ({len(features)} rows) took "
+            f"{prediction_timer.seconds()}s"
+        )
+        batch.probabilities = probabilities
+
+
+# Shared by all vectorwise prediction operators, so that blocks from different lanes can be predicted together.
+prediction_batcher = PredictionBatcher()
+
+
 class OpTrainClassifierFromFeatureVectors(Operator):
     ClassifierFactory = InputSlot()
     LabelAndFeatureMatrix = InputSlot()
@@ -313,6 +527,9 @@ class OpTrainClassifierFromFeatureVectors(Operator):
         super(OpTrainClassifierFromFeatureVectors, self).__init__(*args, **kwargs)
         self.trainingCompleteSignal = OrderedSignal()
 
+        # The most recently trained classifier, for factories that support incremental updates
+        self._previous_classifier = None
+
         # TODO: Progress...
         # self.progressSignal = OrderedSignal()
 
@@ -343,8 +560,25 @@ class OpTrainClassifierFromFeatureVectors(Operator):
             "".format(type(classifier_factory))
         )
 
-        logger.debug("Training new classifier: {}".format(classifier_factory.description))
-        classifier = classifier_factory.create_and_train(featMatrix, labelsMatrix[:, 0], channel_names)
+        cache_key = training_data_hash(classifier_factory, labels_and_features, channel_names)
+        classifier = trained_classifier_cache.get(cache_key)
+        if classifier is not None:
+            logger.debug("Re-using a classifier that was trained on the same data.")
+            self._previous_classifier = classifier
+            result[0] = classifier
+            self.trainingCompleteSignal()
+            return result
+
+        if self._previous_classifier is not None and hasattr(classifier_factory, "update_and_train"):
+            logger.debug("Updating classifier: {}".format(classifier_factory.description))
+            classifier = classifier_factory.update_and_train(
+                self._previous_classifier, featMatrix, labelsMatrix[:, 0], channel_names
+            )
+        else:
+            logger.debug("Training new classifier: {}".format(classifier_factory.description))
+            classifier = classifier_factory.create_and_train(featMatrix, labelsMatrix[:, 0], channel_names)
+        self._previous_classifier = classifier
+        trained_classifier_cache.put(cache_key, classifier)
         result[0] = classifier
         if classifier is not None:
             assert issubclass(type(classifier), LazyflowVectorwiseClassifierABC), (
@@ -356,6 +590,9 @@ class OpTrainClassifierFromFeatureVectors(Operator):
         return result
 
     def propagateDirty(self, slot, subindex, roi):
+        if slot is self.ClassifierFactory:
+            # Trees trained with different settings can't be re-used.
+            self._previous_classifier = None
         self.Classifier.setDirty()
 
 
@@ -365,9 +602,13 @@ class OpClassifierPredict(Operator):
     Classifier = InputSlot()
 
     # An entire prediction request is skipped if the mask is all zeros for the requested roi.
-    # Otherwise, the request is serviced as usual and the mask is ignored.
+    # Otherwise, masked pixels are zero in the output, and in the vectorwise case they are not predicted at all
+    # (see OpBaseClassifierPredict).
     PredictionMask = InputSlot(optional=True)
 
+    # Used only in the vectorwise case (see OpVectorwiseClassifierPredict)
+    InvalidationTolerance = InputSlot(optional=True)
+
     PMaps = OutputSlot()
 
     def __init__(self, *args, **kwargs):
@@ -402,6 +643,7 @@ class OpClassifierPredict(Operator):
 
         if self._mode == "vectorwise":
             self._prediction_op = OpVectorwiseClassifierPredict(parent=self)
+            self._prediction_op.InvalidationTolerance.connect(self.InvalidationTolerance)
         elif self._mode == "pixelwise":
             self._prediction_op = OpPixelwiseClassifierPredict(parent=self)
 
@@ -415,8 +657,9 @@ class OpClassifierPredict(Operator):
         assert False, "Shouldn't get here..."
 
     def propagateDirty(self, slot, subindex, roi):
-        if slot == self.Classifier:
-            self.PMaps.setDirty()
+        # Dirtiness is propagated by the inner prediction operator
+        # (which may only dirty parts of the output, see OpVectorwiseClassifierPredict.InvalidationTolerance)
+        pass
 
 
 class OpBaseClassifierPredict(Operator):
@@ -424,8 +667,8 @@ class OpBaseClassifierPredict(Operator):
     LabelsCount = InputSlot()
     Classifier = InputSlot()
 
-    # An entire prediction request is skipped if the mask is all zeros for the requested roi.
-    # Otherwise, the request is serviced as usual and the mask is ignored.
+    # An entire prediction request is skipped (without requesting any features) if the mask is all zeros
+    # for the requested roi. Otherwise, masked pixels are zero in the output.
     PredictionMask = InputSlot(optional=True)
 
     PMaps = OutputSlot()
@@ -480,7 +723,7 @@ class OpBaseClassifierPredict(Operator):
                 result[:] = 0.0
                 return result
 
-        probabilities = self._calculate_probabilities(roi)
+        probabilities = self._calculate_probabilities(roi, mask)
 
         # We're expecting a channel for each label class.
         # If we didn't provide at least one sample for each label,
@@ -506,8 +749,11 @@ class OpBaseClassifierPredict(Operator):
         return result
 
     @abstractmethod
-    def _calculate_probabilities(roi):
-        """Returns the channel-wise probability maps calculated on roi"""
+    def _calculate_probabilities(self, roi, mask=None):
+        """
+        Returns the channel-wise probability maps calculated on roi.
+        If a (single-channel, boolean) mask is given, pixels outside the mask may be skipped.
+        """
         pass
 
     def propagateDirty(self, slot, subindex, roi):
@@ -521,7 +767,8 @@ class OpBaseClassifierPredict(Operator):
 
 
 class OpPixelwiseClassifierPredict(OpBaseClassifierPredict):
-    def _calculate_probabilities(self, roi):
+    def _calculate_probabilities(self, roi, mask=None):
+        # Pixelwise classifiers need the neighborhood of each pixel, so the mask is only applied afterwards.
         classifier = self.Classifier.value
 
         assert isinstance(
@@ -557,6 +804,41 @@ class OpPixelwiseClassifierPredict(OpBaseClassifierPredict):
 
 
 class OpVectorwiseClassifierPredict(OpBaseClassifierPredict):
+    """
+    Predicts each pixel from its feature vector.
+
+    By default, a new classifier makes the entire output dirty. If InvalidationTolerance is set, a small sample
+    of the feature vectors of each predicted block is kept (along with its predictions). When the classifier
+    changes, the blocks that are being predicted are marked dirty right away. The new classifier is evaluated on
+    the samples of the other blocks later (in a background request, or by the next execute, whichever comes first,
+    so that the classifier isn't trained in the thread that sent the dirty notification), and only those blocks
+    are marked dirty whose predictions change by more than the tolerance (in any channel). The fraction of
+    blocks that were kept is available as kept_block_fraction after each such comparison.
+    """
+
+    # Optional: Largest change of predicted probabilities that does not invalidate a block.
+    InvalidationTolerance = InputSlot(optional=True)
+
+    SAMPLES_PER_BLOCK = 32
+    MAX_SAMPLED_BLOCKS = 10000
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # (start, stop) of the spatial roi -> (sample features, known classes, sample probabilities, generation)
+        self._block_samples = {}
+        # False if some block was predicted without keeping a sample, i.e. we can't tell what to invalidate
+        self._all_blocks_sampled = True
+        self._block_samples_lock = RequestLock()
+        # Incremented when the classifier changes (or the samples are forgotten).
+        # Samples of older generations still have to be compared with the current classifier.
+        self._generation = 0
+        self._compared_generation = 0
+        self._comparison_lock = RequestLock()
+        self._blocks_in_flight = collections.Counter()
+        self.kept_block_fraction = None
+
+        self.PredictionMask.notifyUnready(lambda s: self._forget_block_samples())
+
     def setupOutputs(self):
         super().setupOutputs()
         nlabels = max(self.LabelsCount.value, 1)
@@ -580,7 +862,20 @@ class OpVectorwiseClassifierPredict(OpBaseClassifierPredict):
         feature_ram_per_pixel = max(self.Image.meta.dtype().nbytes, 4) * input_channels
         self.PMaps.meta.ram_usage_per_requested_pixel = classifier_ram_per_pixel + feature_ram_per_pixel
 
-    def _calculate_probabilities(self, roi):
+    def _calculate_probabilities(self, roi, mask=None):
+        block_key = (tuple(roi.start[:-1]), tuple(roi.stop[:-1]))
+        with self._block_samples_lock:
+            generation = self._generation
+            self._blocks_in_flight[block_key] += 1
+        try:
+            return self._predict_block(roi, mask, block_key, generation)
+        finally:
+            with self._block_samples_lock:
+                self._blocks_in_flight[block_key] -= 1
+                if self._blocks_in_flight[block_key] == 0:
+                    del self._blocks_in_flight[block_key]
+
+    def _predict_block(self, roi, mask, block_key, generation):
         classifier = self.Classifier.value
 
         assert isinstance(
@@ -599,13 +894,150 @@ class OpVectorwiseClassifierPredict(OpBaseClassifierPredict):
         prod = bigintprod(shape[:-1])
         features = input_data.reshape((prod, shape[-1]))
 
+        # Only predict the pixels inside the mask
+        masked_rows = None
+        if mask is not None and not mask.all():
+            masked_rows = mask.reshape((prod,))
+            features = features[masked_rows]
+
         with Timer() as prediction_timer:
-            probabilities = classifier.predict_probabilities(features)
+            probabilities = prediction_batcher.predict_probabilities(classifier, features)
 
         logger.debug(
             f"Features took {features_timer.seconds()} seconds."
-            f" Prediction took {prediction_timer.seconds()} seconds. {roi}"
+            f" Prediction took {prediction_timer.seconds()} seconds"
+            f" for {len(features)} of {prod} pixels. {roi}"
         )
 
+        self._keep_block_sample(block_key, classifier, features, probabilities, generation)
+
+        if masked_rows is not None:
+            masked_probabilities = probabilities
+            probabilities = numpy.zeros((prod, masked_probabilities.shape[-1]), dtype=numpy.float32)
+            probabilities[masked_rows] = masked_probabilities
+
         probabilities.shape = shape[:-1] + (probabilities.shape[-1],)
         return probabilities
+
+    def execute(self, slot, subindex, roi, result):
+        if self.InvalidationTolerance.ready():
+            if self._compared_generation != self._generation:
+                # Compare the samples with the new classifier before predicting with it
+                self._invalidate_changed_blocks()
+            if self.Classifier.value is None:
+                # The (zero) result for this block is not sampled, so it can't be selectively invalidated later
+                self._all_blocks_sampled = False
+        return super().execute(slot, subindex, roi, result)
+
+    def propagateDirty(self, slot, subindex, roi):
+        if slot == self.InvalidationTolerance:
+            # Doesn't change the output, only which parts of it will be invalidated in the future.
+            return
+        if slot == self.Classifier and self.InvalidationTolerance.ready():
+            with self._block_samples_lock:
+                all_blocks_sampled = self._all_blocks_sampled
+                if all_blocks_sampled:
+                    self._generation += 1
+                    blocks_in_flight = list(self._blocks_in_flight)
+            if all_blocks_sampled:
+                # These blocks may be predicted with the previous classifier
+                num_channels = self.PMaps.meta.shape[-1]
+                for start, stop in blocks_in_flight:
+                    self.PMaps.setDirty(start + (0,), stop + (num_channels,))
+                # Getting the new classifier may mean training it, which shouldn't block the notifying thread.
+                Request(self._invalidate_changed_blocks).submit()
+                return
+        self._forget_block_samples()
+        super().propagateDirty(slot, subindex, roi)
+
+    def _keep_block_sample(self, block_key, classifier, features, probabilities, generation):
+        if not self.InvalidationTolerance.ready():
+            self._all_blocks_sampled = False
+            return
+
+        step = max(1, len(features) // self.SAMPLES_PER_BLOCK)
+        rows = slice(0, step * self.SAMPLES_PER_BLOCK, step)
+        sample = (features[rows].copy(), tuple(classifier.known_classes), probabilities[rows].copy(), generation)
+
+        with self._block_samples_lock:
+            if generation != self._generation:
+                # The classifier changed while predicting, and the block was marked dirty
+                return
+            if block_key not in self._block_samples and len(self._block_samples) >= self.MAX_SAMPLED_BLOCKS:
+                self._all_blocks_sampled = False
+            else:
+                self._block_samples[block_key] = sample
+
+    def _forget_block_samples(self):
+        with self._block_samples_lock:
+            self._block_samples = {}
+            self._all_blocks_sampled = True
+            self._generation += 1
+            self._compared_generation = self._generation
+
+    def _invalidate_changed_blocks(self):
+        """
+        Marks the blocks dirty whose (sampled) predictions are changed by the current classifier,
+        if it changed since the samples were taken or last compared.
+        If that isn't possible, the entire output is marked dirty instead.
+        """
+        with self._comparison_lock:
+            with self._block_samples_lock:
+                generation = self._generation
+                if generation == self._compared_generation:
+                    return
+                all_blocks_sampled = self._all_blocks_sampled
+                block_samples = {key: sample for key, sample in self._block_samples.items() if sample[3] < generation}
+
+            if not self.Classifier.ready():
+                # Compared once it's ready again
+                return
+            classifier = self.Classifier.value
+            if not all_blocks_sampled or classifier is None:
+                self._forget_block_samples()
+                self.PMaps.setDirty()
+                return
+
+            tolerance = self.InvalidationTolerance.value
+            known_classes = tuple(classifier.known_classes)
+            comparable_keys = [key for key, sample in block_samples.items() if sample[1] == known_classes]
+            changed_keys = set(block_samples.keys()) - set(comparable_keys)
+
+            if comparable_keys:
+                with Timer() as prediction_timer:
+                    features = numpy.concatenate([block_samples[key][0] for key in comparable_keys])
+                    probabilities = classifier.predict_probabilities(features)
+                self.logger.debug(
+                    f"Predicting {len(features)} sampled pixels took {prediction_timer.seconds()} seconds."
+                )
+
+                offset = 0
+                for key in comparable_keys:
+                    old_probabilities = block_samples[key][2]
+                    new_probabilities = probabilities[offset : offset + len(old_probabilities)]
+                    offset += len(old_probabilities)
+                    if numpy.abs(new_probabilities - old_probabilities).max() > tolerance:
+                        changed_keys.add(key)
+
+            with self._block_samples_lock:
+                for key, sample in block_samples.items():
+                    if self._block_samples.get(key) is not sample:
+                        # Recomputed (or forgotten) in the meantime
+                        continue
+                    if key in changed_keys:
+                        del self._block_samples[key]
+                    else:
+                        # The cached predictions are still the old ones, so keep comparing against those
+                        self._block_samples[key] = sample[:3] + (generation,)
+                self._compared_generation = max(self._compared_generation, generation)
+
+            num_blocks = len(block_samples)
+            self.kept_block_fraction = (num_blocks - len(changed_keys)) / num_blocks if num_blocks else 1.0
+            self.logger.info(
+                f"Classifier changed: kept predictions for {num_blocks - len(changed_keys)} of {num_blocks} blocks."
+            )
+
+            # Still holding the comparison lock, so that the blocks are dirty once the comparison is done
+            num_channels = self.PMaps.meta.shape[-1]
+            for start, stop in changed_keys:
+                self.PMaps.setDirty(start + (0,), stop + (num_channels,))
@@ -27,6 +27,7 @@ import vigra
 from lazyflow import roi
 from lazyflow.graph import Operator, InputSlot, OutputSlot
 from lazyflow.roi import roiToSlice
+from lazyflow.utility.helpers import bigintprod
 
 logger = logging.getLogger(__name__)
 
@@ -386,6 +387,87 @@ def coherenceOrientationOfStructureTensor(image, sigma0, sigma1, window_size, ou
     return res
 
 
+# Estimated cost (in ns) of a single filter tap per pixel in separable spatial filtering, and of the FFT per
+# element and log2(number of elements). Used to choose between spatial and FFT-based Gaussian smoothing.
+SPATIAL_FILTER_COST_PER_TAP = 0.25 if WITH_FAST_FILTERS else 0.5
+FFT_COST_PER_ELEMENT_LOG2 = 2.5
+# Below this scale, spatial filtering is always used.
+FFT_MIN_SIGMA = 3.0
+
+
+def _fftPadWidth(shape, radius, axes, roi):
+    """Mirror padding needed to have at least radius pixels of context around roi along all axes."""
+    pad_width = [(0, 0)] * len(shape)
+    for a in axes:
+        pad_width[a] = (max(0, radius - roi[0][a]), max(0, radius - (shape[a] - roi[1][a])))
+    return pad_width
+
+
+def useFftGaussianSmoothing(shape, sigma, window_size, axes, roi=None):
+    """
+    Cost model for Gaussian smoothing of an image of the given shape along the given axes,
+    if only the result within roi (start, stop) is needed.
+
+    Separable spatial filtering scales linearly with sigma (the kernel has 2 * window_size * sigma + 1 taps per
+    axis), whereas the cost of FFT-based filtering only depends on the (mirror padded) image size.
+    Returns True if fftGaussianSmoothing is expected to be faster than spatial filtering.
+    """
+    if sigma < FFT_MIN_SIGMA:
+        return False
+
+    if roi is None:
+        roi = ((0,) * len(shape), tuple(shape))
+    radius = int(numpy.ceil(window_size * sigma))
+    axes = [a for a in axes if shape[a] > 1]
+
+    # Every pass of the separable filter crops the filtered axis to roi (plus its halo on the remaining axes)
+    region_shape = [stop - start for start, stop in zip(*roi)]
+    for a in axes:
+        region_shape[a] = min(roi[1][a] + radius, shape[a]) - max(0, roi[0][a] - radius)
+    spatial_cost = 0
+    for a in axes:
+        region_shape[a] = roi[1][a] - roi[0][a]
+        spatial_cost += bigintprod(region_shape) * (2 * radius + 1) * SPATIAL_FILTER_COST_PER_TAP
+
+    padded_shape = [s + before + after for s, (before, after) in zip(shape, _fftPadWidth(shape, radius, axes, roi))]
+    padded_size = bigintprod(padded_shape)
+    fft_cost = padded_size * numpy.log2(padded_size) * FFT_COST_PER_ELEMENT_LOG2
+
+    return fft_cost < spatial_cost
+
+
+def fftGaussianSmoothing(image, sigma, window_size, axes, roi=None):
+    """
+    Gaussian smoothing of image along the given axes via multiplication in the Fourier domain.
+    Returns the smoothed image within roi (start, stop), or the whole image if roi is None.
+
+    Where roi is closer than window_size * sigma to the image border, the image is mirror padded (like the
+    reflective border treatment of vigra and fastfilters), so that the result matches spatial filtering up to
+    the truncation of the spatial kernel.
+    """
+    if roi is None:
+        roi = ((0,) * image.ndim, tuple(image.shape))
+    radius = int(numpy.ceil(window_size * sigma))
+    axes = [a for a in axes if image.shape[a] > 1]
+
+    pad_width = _fftPadWidth(image.shape, radius, axes, roi)
+    padded = numpy.pad(numpy.asarray(image, dtype=numpy.float32), pad_width, mode="reflect")
+
+    spectrum = numpy.fft.rfftn(padded, axes=axes)
+    for i, a in enumerate(axes):
+        if i == len(axes) - 1:
+            freq = numpy.fft.rfftfreq(padded.shape[a])
+        else:
+            freq = numpy.fft.fftfreq(padded.shape[a])
+        transfer_shape = [1] * image.ndim
+        transfer_shape[a] = len(freq)
+        spectrum *= numpy.exp(-2 * (numpy.pi * sigma * freq) ** 2).reshape(transfer_shape)
+    smoothed = numpy.fft.irfftn(spectrum, s=[padded.shape[a] for a in axes], axes=axes)
+
+    result_slice = tuple(slice(before + start, before + stop) for (before, _), start, stop in zip(pad_width, *roi))
+    return smoothed[result_slice].astype(numpy.float32)
+
+
 class OpGaussianSmoothing(OpBaseFilter):
     sigma = InputSlot()
     minimum_scale = 0.3
@@ -41,6 +41,14 @@ class OpFeatureMatrixCache(Operator):
     - Cache the feature matrix for each block separately
     - Output the concatenation of all feature matrices
 
+    If MaxSamplesPerClass is given, at most that many samples of each label class are output (and stored).
+    The kept samples are a uniform random subset (per class), chosen via deterministic pseudo-random
+    keys of the sample positions: the samples with the smallest keys are kept.
+    Each updated block first keeps its own MaxSamplesPerClass smallest-key samples of each class, then the
+    samples of all blocks are pruned to the MaxSamplesPerClass smallest keys of each class.
+    Pruned samples are only needed again if kept samples are removed (e.g. labels are erased). In that case,
+    the blocks they came from are recomputed, so the result does not depend on the order of the updates.
+
     Note: This operator does not currently have "NonZeroLabelBlocks" input slot.
           Instead, it only requests labels for blocks that have been
           marked dirty via dirty notifications from the LabelImage slot.
@@ -53,6 +61,10 @@ class OpFeatureMatrixCache(Operator):
     FeatureImage = InputSlot()
     LabelImage = InputSlot()
 
+    # Optional class-balanced subsampling of the labeled pixels (see above).
+    MaxSamplesPerClass = InputSlot(optional=True)
+    SamplingSeed = InputSlot(optional=True)  # Defaults to 0
+
     # Output is a single 'value', which is a 2D ndarray.
     # The first row is labels, the rest are the features.
     # (As a consequence of this, labels are converted to float)
@@ -72,6 +84,9 @@ class OpFeatureMatrixCache(Operator):
         self._blockshape = None
         self._dirty_blocks = set()
         self._blockwise_feature_matrices = {}
+        self._blockwise_sample_keys = {}  # Only used with MaxSamplesPerClass
+        # label -> (largest kept key, blocks that have pruned samples of that label, all with larger keys)
+        self._pruned_samples = {}
         self._block_locks = {}  # One lock per stored block
 
         self._init_blocks(None, None)
@@ -140,6 +155,45 @@ class OpFeatureMatrixCache(Operator):
         assert slot == self.LabelAndFeatureMatrix
         self.progressSignal(0.0)
 
+        max_samples_per_class = self._max_samples_per_class()
+        updated_blocks = self._update_dirty_blocks()
+        while max_samples_per_class:
+            with self._lock:
+                refetched_blocks = self._prune_samples(updated_blocks, max_samples_per_class)
+            if not refetched_blocks:
+                break
+            logger.debug("Recomputing {} blocks with previously pruned samples".format(len(refetched_blocks)))
+            updated_blocks = self._update_dirty_blocks()
+
+        with self._lock:
+            block_starts = list(self._blockwise_feature_matrices.keys())
+
+        # Concatenate the all blockwise results
+        if block_starts:
+            total_feature_matrix = numpy.concatenate(
+                [self._blockwise_feature_matrices[block_start] for block_start in block_starts], axis=0
+            )
+            if max_samples_per_class:
+                sample_keys = numpy.concatenate(
+                    [self._blockwise_sample_keys[block_start] for block_start in block_starts]
+                )
+                kept = _smallest_keys_per_class(total_feature_matrix[:, 0], sample_keys, max_samples_per_class)
+                total_feature_matrix = total_feature_matrix[kept]
+                logger.debug("Sampled {} of the labeled pixels.".format(len(kept)))
+        else:
+            # No label points at all.
+            # Return an empty label&feature matrix (of the correct shape)
+            num_feature_channels = self.FeatureImage.meta.shape[-1]
+            total_feature_matrix = numpy.ndarray(shape=(0, 1 + num_feature_channels), dtype=numpy.float32)
+
+        self.progressSignal(100.0)
+        logger.debug("After update, there are {} clean blocks".format(len(self._blockwise_feature_matrices)))
+        result[0] = total_feature_matrix
+
+    def _update_dirty_blocks(self):
+        """
+        Recomputes the feature matrices of all dirty blocks, and returns the set of updated blocks.
+        """
         # Technically, this could result in strange progress reporting if execute()
         #  is called by multiple threads in parallel.
         # This could be fixed with some fancier progress state, but
@@ -177,40 +231,99 @@ class OpFeatureMatrixCache(Operator):
         # Now store the results we got.
         # It's better to store the blocks here -- rather than within each request -- to
         #  avoid contention over self._lock from within every block's request.
+        updated_blocks = set()
         with self._lock:
             for block_start, req in list(reqs.items()):
                 if req.result is None:
                     # 'None' means the block wasn't dirty. No need to update.
                     continue
-                labels_and_features_matrix = req.result
+                labels_and_features_matrix, sample_keys = req.result
                 self._dirty_blocks.remove(block_start)
+                updated_blocks.add(block_start)
 
                 if labels_and_features_matrix.shape[0] > 0:
                     # Update the block entry with the new matrix.
                     self._blockwise_feature_matrices[block_start] = labels_and_features_matrix
+                    self._blockwise_sample_keys[block_start] = sample_keys
                 else:
                     # All labels were removed from the block,
                     # So the new feature matrix is empty.
                     # Just delete its entry from our list.
-                    try:
-                        del self._blockwise_feature_matrices[block_start]
-                    except KeyError:
-                        pass
+                    self._blockwise_feature_matrices.pop(block_start, None)
+                    self._blockwise_sample_keys.pop(block_start, None)
+        return updated_blocks
 
-        # Concatenate the all blockwise results
-        if self._blockwise_feature_matrices:
-            total_feature_matrix = numpy.concatenate(list(self._blockwise_feature_matrices.values()), axis=0)
-        else:
-            # No label points at all.
-            # Return an empty label&feature matrix (of the correct shape)
-            num_feature_channels = self.FeatureImage.meta.shape[-1]
-            total_feature_matrix = numpy.ndarray(shape=(0, 1 + num_feature_channels), dtype=numpy.float32)
+    def _prune_samples(self, updated_blocks, max_samples_per_class):
+        """
+        Prunes the stored samples of all blocks to the max_samples_per_class smallest keys of each class.
 
-        self.progressSignal(100.0)
-        logger.debug("After update, there are {} clean blocks".format(len(self._blockwise_feature_matrices)))
-        result[0] = total_feature_matrix
+        If previously pruned samples might be among them now (because fewer samples with smaller keys are left),
+        nothing is pruned. Instead, the blocks these samples came from are marked dirty and returned.
+        Caller must hold self._lock.
+        """
+        block_starts = list(self._blockwise_feature_matrices.keys())
+        if not block_starts:
+            self._pruned_samples = {}
+            return set()
+        offsets = numpy.cumsum([0] + [len(self._blockwise_sample_keys[block_start]) for block_start in block_starts])
+        labels = numpy.concatenate(
+            [self._blockwise_feature_matrices[block_start][:, 0] for block_start in block_starts]
+        )
+        keys = numpy.concatenate([self._blockwise_sample_keys[block_start] for block_start in block_starts])
+
+        refetched_blocks = set()
+        for label, (largest_kept_key, pruned_blocks) in self._pruned_samples.items():
+            # Updated blocks have all of their (own smallest-key) samples again
+            pruned_blocks -= updated_blocks
+            num_smaller = numpy.count_nonzero((labels == label) & (keys <= largest_kept_key))
+            if pruned_blocks and num_smaller < max_samples_per_class:
+                refetched_blocks |= pruned_blocks
+        if refetched_blocks:
+            self._dirty_blocks.update(refetched_blocks)
+            return refetched_blocks
+
+        kept = numpy.zeros(len(keys), dtype=bool)
+        kept[_smallest_keys_per_class(labels, keys, max_samples_per_class)] = True
+
+        pruned_samples = {}
+        for label in numpy.unique(labels):
+            pruned_blocks = set(self._pruned_samples.get(label, (None, set()))[1])
+            is_pruned = ~kept & (labels == label)
+            for i, block_start in enumerate(block_starts):
+                if is_pruned[offsets[i] : offsets[i + 1]].any():
+                    pruned_blocks.add(block_start)
+            if pruned_blocks:
+                pruned_samples[label] = (keys[kept & (labels == label)].max(), pruned_blocks)
+        self._pruned_samples = pruned_samples
+
+        for i, block_start in enumerate(block_starts):
+            block_kept = kept[offsets[i] : offsets[i + 1]]
+            if not block_kept.all():
+                # (A block without samples is kept, so that it is still recomputed if the features change.)
+                self._blockwise_feature_matrices[block_start] = self._blockwise_feature_matrices[block_start][
+                    block_kept
+                ]
+                self._blockwise_sample_keys[block_start] = self._blockwise_sample_keys[block_start][block_kept]
+        return set()
+
+    def _max_samples_per_class(self):
+        if self.MaxSamplesPerClass.ready():
+            return self.MaxSamplesPerClass.value
+        return None
+
+    def _sampling_seed(self):
+        if self.SamplingSeed.ready():
+            return self.SamplingSeed.value
+        return 0
 
     def propagateDirty(self, slot, subindex, roi):
+        if slot == self.MaxSamplesPerClass or slot == self.SamplingSeed:
+            # The samples each block keeps depend on these settings.
+            with self._lock:
+                self._dirty_blocks.update(self._blockwise_feature_matrices.keys())
+            self.LabelAndFeatureMatrix.setDirty()
+            return
+
         assert slot == self.FeatureImage or slot == self.LabelImage
 
         # Our blocks are tracked by label roi (1 channel)
@@ -253,10 +366,13 @@ class OpFeatureMatrixCache(Operator):
             block_roi = getBlockBounds(self.LabelImage.meta.shape, self._blockshape, block_start)
             # TODO: Shrink the requested roi using the nonzero blocks slot...
             #       ...or just get rid of the nonzero blocks slot...
-            labels_and_features_matrix = self._extract_feature_matrix(block_roi)
-            return labels_and_features_matrix
+            return self._extract_feature_matrix(block_roi)
 
     def _extract_feature_matrix(self, label_block_roi):
+        """
+        Returns the label&feature matrix of the given block,
+        and the sample keys of its rows (None, unless MaxSamplesPerClass is set).
+        """
         num_feature_channels = self.FeatureImage.meta.shape[-1]
         labels = self.LabelImage(label_block_roi[0], label_block_roi[1]).wait()
         label_block_positions = numpy.nonzero(labels[..., 0].view(numpy.ndarray))
@@ -267,7 +383,21 @@ class OpFeatureMatrixCache(Operator):
         if len(label_block_positions) == 0 or len(label_block_positions[0]) == 0:
             # No label points in this roi.
             # Return an empty label&feature matrix (of the correct shape)
-            return numpy.ndarray(shape=(0, 1 + num_feature_channels), dtype=numpy.float32)
+            return numpy.ndarray(shape=(0, 1 + num_feature_channels), dtype=numpy.float32), None
+
+        sample_keys = None
+        max_samples_per_class = self._max_samples_per_class()
+        if max_samples_per_class:
+            # Only keep the samples that could make it into the final sample of each class.
+            global_positions = tuple(
+                positions + start for positions, start in zip(label_block_positions, label_block_roi[0])
+            )
+            pixel_indices = numpy.ravel_multi_index(global_positions, self.LabelImage.meta.shape[:-1])
+            sample_keys = _sample_keys(pixel_indices, self._sampling_seed())
+            kept = _smallest_keys_per_class(labels_matrix[:, 0], sample_keys, max_samples_per_class)
+            label_block_positions = tuple(positions[kept] for positions in label_block_positions)
+            labels_matrix = labels_matrix[kept]
+            sample_keys = sample_keys[kept]
 
         # Shrink the roi to the bounding box of nonzero labels
         block_bounding_box_start = numpy.min(label_block_positions, axis=1)
@@ -291,4 +421,32 @@ class OpFeatureMatrixCache(Operator):
 
         # Cast as plain ndarray (not VigraArray), since we don't need/want axistags
         features_matrix = features[bounding_box_positions].view(numpy.ndarray)
-        return numpy.concatenate((labels_matrix, features_matrix), axis=1)
+        return numpy.concatenate((labels_matrix, features_matrix), axis=1), sample_keys
+
+
+def _sample_keys(pixel_indices, seed):
+    """
+    Deterministic pseudo-random 64 bit keys for the given (linear) pixel indices (splitmix64).
+    """
+    keys = numpy.asarray(pixel_indices, dtype=numpy.uint64)
+    # (uint64 array arithmetic wraps around, as intended)
+    keys += numpy.uint64((seed * 0x9E3779B97F4A7C15 + 0x9E3779B97F4A7C15) % 2**64)
+    keys = (keys ^ (keys >> numpy.uint64(30))) * numpy.uint64(0xBF58476D1CE4E5B9)
+    keys = (keys ^ (keys >> numpy.uint64(27))) * numpy.uint64(0x94D049BB133111EB)
+    return keys ^ (keys >> numpy.uint64(31))
+
+
+def _smallest_keys_per_class(labels, keys, max_per_class):
+    """
+    Returns the indices of the (at most) max_per_class samples of each label class with the smallest keys,
+    ordered by key.
+    """
+    selected = []
+    for label in numpy.unique(labels):
+        class_indices = numpy.flatnonzero(labels == label)
+        if len(class_indices) > max_per_class:
+            smallest = numpy.argpartition(keys[class_indices], max_per_class - 1)[:max_per_class]
+            class_indices = class_indices[smallest]
+        selected.append(class_indices)
+    selected = numpy.concatenate(selected)
+    return selected[numpy.argsort(keys[selected], kind="stable")]
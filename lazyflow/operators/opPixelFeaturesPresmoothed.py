@@ -29,9 +29,10 @@ from functools import partial
 
 from lazyflow import roi
 from lazyflow.graph import Operator, InputSlot, OutputSlot
-from lazyflow.request import RequestPool
+from lazyflow.request import Request, RequestPool
 from lazyflow.roi import sliceToRoi, roiToSlice
 from lazyflow.rtype import SubRegion
+from lazyflow.utility import Memory
 
 from .operators import OpArrayPiper
 from .filterOperators import (
@@ -42,6 +43,8 @@ from .filterOperators import (
     OpGaussianGradientMagnitude,
     OpLaplacianOfGaussian,
     WITH_FAST_FILTERS,
+    fftGaussianSmoothing,
+    useFftGaussianSmoothing,
 )
 
 if WITH_FAST_FILTERS:
@@ -75,6 +78,8 @@ class OpPixelFeaturesPresmoothed(Operator):
     Features = OutputSlot(level=1)  # Each feature image listed separately, with feature name provided in metadata
 
     WINDOW_SIZE = 3.5
+    # Memory for the pre-smoothed data of a single tile of a request, see _getTiles
+    PRESMOOTHING_TILE_BYTES = 32 * 1024**2
 
     def __init__(self, *args, **kwargs):
         Operator.__init__(self, *args, **kwargs)
@@ -240,6 +245,17 @@ class OpPixelFeaturesPresmoothed(Operator):
         #        but vigra functions may use internal RAM as well.
         self.Output.meta.ram_usage_per_requested_pixel = 4.0 * self.Output.meta.shape[1]
 
+    def getHalo(self):
+        """
+        Halo (in tczyx) that has to be read around a requested output roi.
+        It consists of the halo for pre-smoothing with the largest selected scale and the halo of the feature
+        filters that work on the pre-smoothed data (see execute).
+        """
+        assert self.Output.ready()
+        halo = int(numpy.ceil(self.max_sigma * self.WINDOW_SIZE) + numpy.ceil(0.7 * self.WINDOW_SIZE))
+        z_halo = 0 if all(self.ComputeIn2d.value) else halo
+        return (0, 0, z_halo, halo, halo)
+
     def _get_ideal_blockshape(self):
         assert self.Output.meta.getAxisKeys() == list("tczyx")
 
@@ -344,34 +360,12 @@ class OpPixelFeaturesPresmoothed(Operator):
             target = target.view(vigra.VigraArray)
             target.axistags = copy.copy(axistags)
 
-            # filter roi in input frame
-            # sigma = 0.7, because the features receive a pre-smoothed array and don't need much of a neighborhood
-            input_filter_start, input_filter_stop = roi.enlargeRoiForHalo(
-                output_start, output_stop, output_shape, 0.7, self.WINDOW_SIZE, enlarge_axes=axes2enlarge
-            )
-
-            # smooth roi in input frame
-            input_smooth_start, input_smooth_stop = roi.enlargeRoiForHalo(
-                input_filter_start,
-                input_filter_stop,
-                output_shape,
-                self.max_sigma,
-                self.WINDOW_SIZE,
-                enlarge_axes=axes2enlarge,
-            )
-
-            # target roi in filter frame
-            filter_target_start = roi.TinyVector(output_start - input_filter_start)
-            filter_target_stop = roi.TinyVector(output_stop - input_filter_start)
-
-            # filter roi in smooth frame
-            smooth_filter_start = roi.TinyVector(input_filter_start - input_smooth_start)
-            smooth_filter_stop = roi.TinyVector(input_filter_stop - input_smooth_start)
-
-            filter_target_slice = roi.roiToSlice(filter_target_start, filter_target_stop)
+            input_smooth_start, input_smooth_stop = self._enlargeForPresmoothing(
+                output_start, output_stop, output_shape, axes2enlarge
+            )[2:]
             input_smooth_slice = roi.roiToSlice(input_smooth_start, input_smooth_stop)
 
-            # pre-smooth for all requested time slices and all channels
+            # read the source for all requested time slices and all channels at once
             full_input_smooth_slice = (full_output_slice[0], slice(None), *input_smooth_slice)
             req = self.Input[full_input_smooth_slice]
             source = req.wait()
@@ -389,42 +383,134 @@ class OpPixelFeaturesPresmoothed(Operator):
             sourceV = source.view(vigra.VigraArray)
             sourceV.axistags = copy.copy(self.Input.meta.axistags)
 
-            dimCol = len(self.scales)
-            dimRow = self.matrix.shape[0]
+            # Pre-smoothing and feature computation run tile by tile, so only the pre-smoothed data of a single
+            # tile (instead of the whole request) has to be held in memory.
+            for tile_start, tile_stop in self._getTiles(full_output_start, full_output_stop):
+                tile_target = target[
+                    (slice(None), slice(None)) + roi.roiToSlice(tile_start - output_start, tile_stop - output_start)
+                ]
+                self._computeTile(
+                    sourceV,
+                    input_smooth_start,
+                    roi.TinyVector((*full_output_start[:2], *tile_start)),
+                    roi.TinyVector((*full_output_stop[:2], *tile_stop)),
+                    axes2enlarge,
+                    tile_target,
+                )
 
-            presmoothed_source = [None] * dimCol
-
-            source_smooth_shape = tuple(smooth_filter_stop - smooth_filter_start)
-            full_source_smooth_shape = (
-                full_output_stop[0] - full_output_start[0],
-                self.Input.meta.shape[1],
-            ) + source_smooth_shape
+            del sourceV
             try:
-                for j in range(dimCol):
-                    for i in range(dimRow):
-                        if self.matrix[i, j]:
-                            # There is at least one filter op with this scale
-                            break
-                    else:
-                        # There is no filter op at this scale
-                        continue
+                source.resize((1,), refcheck=False)
+            except ValueError:
+                # Sometimes this fails, but that's okay.
+                logger.debug("Failed to free array memory.")
+            del source
 
-                    if self.scales[j] > 1.0:
-                        tempSigma = math.sqrt(self.scales[j] ** 2 - 1.0)
-                    else:
-                        tempSigma = self.scales[j]
+    def _enlargeForPresmoothing(self, output_start, output_stop, output_shape, axes2enlarge):
+        """
+        Returns the filter roi and the smooth roi (in input frame) for the given target roi (zyx)
+        """
+        # filter roi in input frame
+        # sigma = 0.7, because the features receive a pre-smoothed array and don't need much of a neighborhood
+        input_filter_start, input_filter_stop = roi.enlargeRoiForHalo(
+            output_start, output_stop, output_shape, 0.7, self.WINDOW_SIZE, enlarge_axes=axes2enlarge
+        )
+
+        # smooth roi in input frame
+        input_smooth_start, input_smooth_stop = roi.enlargeRoiForHalo(
+            input_filter_start,
+            input_filter_stop,
+            output_shape,
+            self.max_sigma,
+            self.WINDOW_SIZE,
+            enlarge_axes=axes2enlarge,
+        )
+        return input_filter_start, input_filter_stop, input_smooth_start, input_smooth_stop
+
+    def _getTiles(self, full_output_start, full_output_stop):
+        """
+        Split the spatial part of the requested roi into tiles along one axis, such that the pre-smoothed data
+        of a tile (for all scales) takes about PRESMOOTHING_TILE_BYTES.
+        Tiles are at least 4 halos thick along the tiling axis to keep the redundant computation in the halos low.
 
-                    presmoothed_source[j] = numpy.ndarray(full_source_smooth_shape, numpy.float32)
+        Returns a list of (start, stop) tuples in zyx.
+        """
+        output_start = full_output_start[2:]
+        output_stop = full_output_stop[2:]
+        output_extent = output_stop - output_start
+
+        # Prefer tiling along z: In 2D, there is no halo in z.
+        tile_axis = 0 if output_extent[0] > 1 else 1
+        halo = self.getHalo()[2:]
+
+        num_smoothed_scales = int(self.matrix.any(axis=0).sum())
+        num_t = full_output_stop[0] - full_output_start[0]
+        cross_section = numpy.prod(
+            [e + 2 * h for a, (e, h) in enumerate(zip(output_extent, halo)) if a != tile_axis], dtype=numpy.int64
+        )
+        bytes_per_layer = 4 * num_t * self.Input.meta.shape[1] * max(1, num_smoothed_scales) * cross_section
+
+        thickness = max(4 * halo[tile_axis], 1, int(self.PRESMOOTHING_TILE_BYTES // bytes_per_layer))
+        if thickness >= output_extent[tile_axis]:
+            return [(output_start, output_stop)]
+
+        tiles = []
+        for tile_axis_start in range(output_start[tile_axis], output_stop[tile_axis], thickness):
+            tile_start = roi.TinyVector(output_start)
+            tile_stop = roi.TinyVector(output_stop)
+            tile_start[tile_axis] = tile_axis_start
+            tile_stop[tile_axis] = min(tile_axis_start + thickness, output_stop[tile_axis])
+            tiles.append((tile_start, tile_stop))
+        return tiles
+
+    def _computeTile(self, sourceV, source_start, full_output_start, full_output_stop, axes2enlarge, target):
+        """
+        Pre-smooth and compute all requested features for the given roi (tczyx) and write them into target.
 
-                    droi = (
-                        (0, *tuple(smooth_filter_start._asint())),
-                        (sourceV.shape[1], *tuple(smooth_filter_stop._asint())),
-                    )
-                    for i, vsa in enumerate(sourceV.timeIter()):
-                        presmoothed_source[j][i, ...] = self._computeGaussianSmoothing(
-                            vsa, tempSigma, droi, in2d=self.ComputeIn2d.value[j]
-                        )
+        sourceV: float32 source (tczyx) for all requested time slices and all channels, starting at
+                 source_start (zyx) in input frame. Has to include the halo needed for the given roi.
+        """
+        output_shape = self.Output.meta.shape[2:]
+        output_start = full_output_start[2:]
+        output_stop = full_output_stop[2:]
+
+        input_filter_start, input_filter_stop, input_smooth_start, input_smooth_stop = self._enlargeForPresmoothing(
+            output_start, output_stop, output_shape, axes2enlarge
+        )
+
+        # target roi in filter frame
+        filter_target_start = roi.TinyVector(output_start - input_filter_start)
+        filter_target_stop = roi.TinyVector(output_stop - input_filter_start)
 
+        # filter roi in smooth frame
+        smooth_filter_start = roi.TinyVector(input_filter_start - input_smooth_start)
+        smooth_filter_stop = roi.TinyVector(input_filter_stop - input_smooth_start)
+
+        filter_target_slice = roi.roiToSlice(filter_target_start, filter_target_stop)
+
+        # smooth roi in frame of sourceV
+        source_smooth_slice = roi.roiToSlice(input_smooth_start - source_start, input_smooth_stop - source_start)
+        sourceV = sourceV[(slice(None), slice(None)) + source_smooth_slice]
+
+        dimCol = len(self.scales)
+        dimRow = self.matrix.shape[0]
+
+        presmoothed_source = [None] * dimCol
+
+        source_smooth_shape = tuple(smooth_filter_stop - smooth_filter_start)
+        full_source_smooth_shape = (
+            full_output_stop[0] - full_output_start[0],
+            self.Input.meta.shape[1],
+        ) + source_smooth_shape
+
+        droi = ((0, *tuple(smooth_filter_start._asint())), (1, *tuple(smooth_filter_stop._asint())))
+
+        def presmooth(j, tstep, channel, sigma):
+            vsa = sourceV[tstep, channel : channel + 1]
+            try:
+                presmoothed_source[j][tstep, channel : channel + 1] = self._computeGaussianSmoothing(
+                    vsa, sigma, droi, in2d=self.ComputeIn2d.value[j]
+                )
             except RuntimeError as e:
                 if "kernel longer than line" in str(e):
                     raise RuntimeError(
@@ -434,71 +520,132 @@ class OpPixelFeaturesPresmoothed(Operator):
                 else:
                     raise e
 
-            del sourceV
-            try:
-                source.resize((1,), refcheck=False)
-            except ValueError:
-                # Sometimes this fails, but that's okay.
-                logger.debug("Failed to free array memory.")
-            del source
+        # Every (scale, time, channel) combination is smoothed independently into its own slice of the
+        # shared presmoothed array.
+        # Working set of a single smoothing task: the float32 input channel plus the (unclipped) result.
+        smooth_task_bytes = 2 * 4 * numpy.prod(sourceV.shape[2:], dtype=numpy.int64)
+        pool = RequestPool(max_active=self._max_parallel_requests(smooth_task_bytes))
+        for j in range(dimCol):
+            if not self.matrix[:, j].any():
+                # There is no filter op at this scale
+                continue
+
+            if self.scales[j] > 1.0:
+                tempSigma = math.sqrt(self.scales[j] ** 2 - 1.0)
+            else:
+                tempSigma = self.scales[j]
+
+            presmoothed_source[j] = numpy.ndarray(full_source_smooth_shape, numpy.float32)
+            for tstep in range(sourceV.shape[0]):
+                for channel in range(sourceV.shape[1]):
+                    pool.request(partial(presmooth, j, tstep, channel, tempSigma))
+        pool.wait()
+        pool.clean()
+
+        del sourceV
+
+        num_input_channels = self.Input.meta.shape[1]
+        filter_target_shape = filter_target_stop - filter_target_start
+        filter_shape = input_filter_stop - input_filter_start
+
+        cnt = 0
+        written = 0
+        closures = []
+        max_channels_per_closure = 1
+        # connect individual operators
+        for i in range(dimRow):
+            for j in range(dimCol):
+                if self.matrix[i, j]:
+                    oslot = self.featureOps[i][j].Output
+                    slices = oslot.meta.shape[1]
+                    if (
+                        cnt + slices >= full_output_start[1]
+                        and full_output_start[1] - cnt < slices
+                        and full_output_start[1] + written < full_output_stop[1]
+                    ):
+                        begin = 0
+                        if cnt < full_output_start[1]:
+                            begin = full_output_start[1] - cnt
+                        end = slices
+                        if cnt + end > full_output_stop[1]:
+                            end = full_output_stop[1] - cnt
+
+                        # Split the feature into independent (time step, input channel) requests.
+                        # Each input channel yields a contiguous run of resulting channels.
+                        channels_per_input = slices // num_input_channels
+                        max_channels_per_closure = max(max_channels_per_closure, channels_per_input)
+                        for tstep in range(full_output_stop[0] - full_output_start[0]):
+                            t = full_output_start[0] + tstep
+                            c_start = begin
+                            while c_start < end:
+                                c_stop = min(end, (c_start // channels_per_input + 1) * channels_per_input)
+
+                                # feature slice in output frame
+                                feature_slice = (
+                                    slice(tstep, tstep + 1),
+                                    slice(written + c_start - begin, written + c_stop - begin),
+                                ) + (slice(None),) * 3
+
+                                subtarget = target[feature_slice]
+                                # readjust the roi for the new source array
+                                full_filter_target_slice = [slice(t, t + 1), slice(c_start, c_stop)]
+                                full_filter_target_slice += filter_target_slice
+                                filter_target_roi = SubRegion(oslot, pslice=full_filter_target_slice)
+
+                                closure = partial(
+                                    oslot.operator.call_execute,
+                                    oslot,
+                                    (),
+                                    filter_target_roi,
+                                    subtarget,
+                                    sourceArray=presmoothed_source[j][tstep : tstep + 1],
+                                )
+                                closures.append(closure)
+                                c_start = c_stop
+
+                        written += end - begin
+                    cnt += slices
+
+        # Working set of a single feature task: the filtered frame for all resulting channels of one input
+        # channel, plus the cropped result.
+        filter_task_bytes = (
+            4
+            * max_channels_per_closure
+            * (numpy.prod(filter_shape, dtype=numpy.int64) + numpy.prod(filter_target_shape, dtype=numpy.int64))
+        )
+        pool = RequestPool(max_active=self._max_parallel_requests(filter_task_bytes))
+        for c in closures:
+            pool.request(c)
+        pool.wait()
+        pool.clean()
+        del closures
+
+        for i in range(len(presmoothed_source)):
+            if presmoothed_source[i] is not None:
+                try:
+                    presmoothed_source[i].resize((1,))
+                except Exception:
+                    presmoothed_source[i] = None
+
+    @staticmethod
+    def _max_parallel_requests(bytes_per_request):
+        """
+        Number of child requests that may run at the same time without exceeding the RAM available for
+        computations, given the estimated working set of a single request.
+        """
+        num_workers = Request.global_thread_pool.num_workers
+        if num_workers == 0 or bytes_per_request <= 0:
+            return None
 
-            cnt = 0
-            written = 0
-            closures = []
-            # connect individual operators
-            for i in range(dimRow):
-                for j in range(dimCol):
-                    if self.matrix[i, j]:
-                        oslot = self.featureOps[i][j].Output
-                        req = None
-                        slices = oslot.meta.shape[1]
-                        if (
-                            cnt + slices >= slot_roi.start[1]
-                            and slot_roi.start[1] - cnt < slices
-                            and slot_roi.start[1] + written < slot_roi.stop[1]
-                        ):
-                            begin = 0
-                            if cnt < slot_roi.start[1]:
-                                begin = slot_roi.start[1] - cnt
-                            end = slices
-                            if cnt + end > slot_roi.stop[1]:
-                                end = slot_roi.stop[1] - cnt
-
-                            # feature slice in output frame
-                            feature_slice = (slice(None), slice(written, written + end - begin)) + (slice(None),) * 3
-
-                            subtarget = target[feature_slice]
-                            # readjust the roi for the new source array
-                            full_filter_target_slice = [full_output_slice[0], slice(begin, end), *filter_target_slice]
-                            filter_target_roi = SubRegion(oslot, pslice=full_filter_target_slice)
-
-                            closure = partial(
-                                oslot.operator.call_execute,
-                                oslot,
-                                (),
-                                filter_target_roi,
-                                subtarget,
-                                sourceArray=presmoothed_source[j],
-                            )
-                            closures.append(closure)
-
-                            written += end - begin
-                        cnt += slices
-            pool = RequestPool()
-            for c in closures:
-                pool.request(c)
-            pool.wait()
-            pool.clean()
-
-            for i in range(len(presmoothed_source)):
-                if presmoothed_source[i] is not None:
-                    try:
-                        presmoothed_source[i].resize((1,))
-                    except Exception:
-                        presmoothed_source[i] = None
+        affordable = int(Memory.getAvailableRamComputation() // bytes_per_request)
+        return max(1, min(num_workers, affordable))
 
     def _computeGaussianSmoothing(self, vol, sigma, roi, in2d):
-        if WITH_FAST_FILTERS:
+        axes = (2, 3) if in2d else (1, 2, 3)
+        if useFftGaussianSmoothing(vol.shape, sigma, self.WINDOW_SIZE, axes, roi):
+            # For large sigmas, smoothing in the Fourier domain is faster than spatial filtering
+            return fftGaussianSmoothing(vol.view(numpy.ndarray), sigma, self.WINDOW_SIZE, axes, roi)
+        elif WITH_FAST_FILTERS:
             # Use fast filters (if available)
             result = numpy.zeros(vol.shape).astype(vol.dtype)
             assert vol.channelIndex == 0
@@ -23,7 +23,7 @@
 from collections.abc import Iterable
 import numbers
 from functools import partial
-from itertools import combinations
+from itertools import combinations, product
 from math import ceil, floor, log10, pow
 from typing import Sequence, Tuple, Union
 
@@ -803,6 +803,85 @@ def determine_optimal_request_blockshape(
     return tuple(blockshape)
 
 
+def determine_halo_aware_blockshape(
+    data_shape,
+    halo,
+    ram_usage_per_requested_pixel,
+    num_threads,
+    available_ram,
+    max_blockshape=None,
+    fixed_blockshape=None,
+    min_block_side=16,
+    tolerance=0.25,
+):
+    """
+    Choose a blockshape for requests (or cache blocks) of a filter that needs a halo around every block.
+
+    Computing a block of shape ``b`` costs ``prod(min(b + 2 * halo, data_shape))`` pixels, so the expected
+    computation per useful pixel is ``prod(min(b + 2 * halo, data_shape)) / prod(b)``.
+    Candidate sides are powers of two (starting at min_block_side) and the full extent of each axis,
+    not exceeding max_blockshape.
+    Only candidates whose halo-padded block fits into available_ram when num_threads blocks are computed in
+    parallel are considered. Of those, the one with the smallest padded volume is chosen, that comes within
+    ``tolerance`` of the smallest attainable cost per useful pixel. (Larger blocks would just waste RAM.)
+
+    If any dimensions in fixed_blockshape are non-zero, the blockshape is fixed to that value (clipped to
+    data_shape) in that dimension.
+
+    >>> determine_halo_aware_blockshape( (1000,1000,1000), (0,0,0), 4, 1, 1e9 )
+    (16, 16, 16)
+
+    >>> determine_halo_aware_blockshape( (1000,1000,1000), (35,35,35), 4, 8, 4e9 )
+    (256, 256, 512)
+
+    >>> determine_halo_aware_blockshape( (1000,1000,1000), (35,35,35), 4, 8, 4e9, (256,)*3, (0,256,256) )
+    (128, 256, 256)
+
+    >>> determine_halo_aware_blockshape( (1,1000,1000), (0,4,4), 4, 1, 1e9, tolerance=0 )
+    (1, 1000, 1000)
+    """
+    data_shape = numpy.asarray(data_shape, dtype=numpy.int64)
+    halo = numpy.asarray(halo, dtype=numpy.int64)
+    assert len(data_shape) == len(halo)
+    if max_blockshape is None:
+        max_blockshape = data_shape
+    max_blockshape = numpy.minimum(data_shape, max_blockshape)
+    if fixed_blockshape is None:
+        fixed_blockshape = numpy.zeros_like(data_shape)
+    fixed_blockshape = numpy.asarray(fixed_blockshape, dtype=numpy.int64)
+    assert len(data_shape) == len(max_blockshape) == len(fixed_blockshape)
+
+    axis_candidates = []
+    for size, fixed in zip(max_blockshape, fixed_blockshape):
+        if fixed > 0:
+            axis_candidates.append([int(min(fixed, size))])
+            continue
+        candidates = {int(size)}
+        side = min_block_side
+        while side < size:
+            candidates.add(side)
+            side *= 2
+        axis_candidates.append(sorted(candidates))
+
+    target_block_volume_bytes = available_ram / num_threads
+
+    fitting = []
+    for blockshape in product(*axis_candidates):
+        padded_volume = bigintprod(numpy.minimum(numpy.asarray(blockshape) + 2 * halo, data_shape))
+        if padded_volume * ram_usage_per_requested_pixel > target_block_volume_bytes:
+            continue
+        cost = padded_volume / bigintprod(blockshape)
+        fitting.append((padded_volume, cost, blockshape))
+
+    if not fitting:
+        # Not even the smallest block fits, so at least keep the memory footprint low
+        return tuple(candidates[0] for candidates in axis_candidates)
+
+    best_cost = min(cost for _, cost, _ in fitting)
+    padded_volume, cost, blockshape = min(f for f in fitting if f[1] <= best_cost * (1 + tolerance))
+    return blockshape
+
+
 def slicing_to_string(slicing, max_shape=None):
     """
     Returns a string representation of the given slicing, which has been
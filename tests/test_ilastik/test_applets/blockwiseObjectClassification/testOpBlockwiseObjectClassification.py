@@ -33,9 +33,13 @@ from lazyflow.graph import Graph
 from lazyflow.operators.opReorderAxes import OpReorderAxes
 
 from ilastik.applets import objectExtraction
-from ilastik.applets.objectExtraction.opObjectExtraction import OpObjectExtraction
+from ilastik.applets.objectExtraction.opObjectExtraction import OpObjectExtraction, default_features_key
 from ilastik.applets.objectClassification.opObjectClassification import OpObjectClassification
 from ilastik.applets.blockwiseObjectClassification import OpBlockwiseObjectClassification
+from ilastik.applets.blockwiseObjectClassification.opBlockwiseObjectClassification import (
+    BlockObjectRegistry,
+    OpBlockObjectPredict,
+)
 
 import logging
 
@@ -111,6 +115,41 @@ class TestOpBlockwiseObjectClassification(unittest.TestCase):
                 "as the non-blockwise prediction operator!"
             )
 
+    def testPipelineReuse(self):
+        # A single block pipeline, which is pointed to each of the 27 blocks in turn
+        self.op.MAX_NUM_PIPELINES = 1
+        self.op.BlockShape3dDict.setValue({"x": 40, "y": 40, "z": 40})
+        self.op.HaloPadding3dDict.setValue({"x": 10, "y": 10, "z": 10})
+
+        # Pointing the pipeline to another block is not a change of the output
+        dirty_rois = []
+        self.op.PredictionImage.notifyDirty(lambda slot, roi: dirty_rois.append(roi))
+
+        for _ in range(2):
+            pred = self.op.PredictionImage[:].wait()
+            assert len(self.op._blockPipelines) == 1
+            assert dirty_rois == []
+            if not (pred == self.prediction_volume).all():
+                self.logImage(pred, "reused_pipeline_failed_prediction_")
+                assert False, (
+                    "Blockwise prediction operator did not produce the same prediction image"
+                    "as the non-blockwise prediction operator, when reusing the block pipeline!"
+                )
+
+    def testSharedHaloObjects(self):
+        # The cubes that cross block boundaries are predicted by the block that contains their center,
+        # the other blocks use that result
+        self.op.BlockShape3dDict.setValue({"x": 42, "y": 42, "z": 42})
+        self.op.HaloPadding3dDict.setValue({"x": 35, "y": 35, "z": 30})
+
+        pred = self.op.PredictionImage[:].wait()
+        assert len(self.op._objectRegistry) > 0
+        assert (pred == self.prediction_volume).all()
+
+        # Results of a previous classifier are not used
+        self.op.Classifier.setDirty(slice(None))
+        assert len(self.op._objectRegistry) == 0
+
     def testZeroHalo(self):
         # If we shrink the halo down to zero, then we get different predictions...
         # This block shape/halo combination will slice through some of the big blocks, causing mis-classification.
@@ -308,6 +347,116 @@ class TestOpBlockwiseObjectClassification(unittest.TestCase):
             logger.debug("Wrote an image to {}".format(name))
 
 
+class TestBlockObjectRegistry(unittest.TestCase):
+    def testOwnerTakesPrecedence(self):
+        registry = BlockObjectRegistry()
+        generation = registry.generation
+        keys = [(0, 1.0, 2.0), (0, 5.0, 9.0)]
+
+        # Another block was first
+        registry.publish(keys, [[0.1, 0.9], [0.2, 0.8]], [False, False], generation)
+        results = registry.lookup(keys, [True, False])
+        assert results[0] is None, "The owner must compute its own result"
+        assert results[1] == [0.2, 0.8]
+
+        registry.publish(keys[:1], [[0.3, 0.7]], [True], generation)
+        registry.publish(keys[:1], [[0.4, 0.6]], [False], generation)
+        assert registry.lookup(keys, [False, False]) == [[0.3, 0.7], [0.2, 0.8]]
+
+    def testClear(self):
+        registry = BlockObjectRegistry()
+        generation = registry.generation
+        registry.clear()
+
+        # Computed before clear()
+        registry.publish([(0, 1.0, 2.0)], [[0.1, 0.9]], [True], generation)
+        assert len(registry) == 0
+        assert registry.lookup([(0, 1.0, 2.0)], [False]) == [None]
+
+
+class RowRecordingClassifier(object):
+    """Predicts class 1 with the value of the (only) feature, and records the values it saw"""
+
+    def __init__(self):
+        self.predicted = []
+
+    def predict_probabilities(self, X):
+        self.predicted.extend(X[:, 0].tolist())
+        return numpy.stack([X[:, 0], 1 - X[:, 0]], axis=-1)
+
+
+class TestBlockObjectPredict(unittest.TestCase):
+    # Two blocks along x, [0, 10) and [10, 20), with a halo of 4.
+    # Objects: (value, x min, x max), where the maximum is inclusive (like Coord<Maximum>)
+    OBJECTS = [
+        (0.125, 8, 11),  # crosses the border, owned by the first block
+        (0.25, 7, 10),  # reaches just into the second block, owned by the first
+        (0.375, 7, 9),  # only in the first block, but in the halo of the second
+        (0.5, 1, 2),  # only seen by the first block
+        (0.625, 15, 16),  # only seen by the second block
+        (0.75, 9, 12),  # crosses the border, owned by the second block
+    ]
+    BLOCKS = [((0, 0, 0), (10, 20, 20)), ((10, 0, 0), (20, 20, 20))]
+    HALO_STARTS = [(0, 0, 0), (6, 0, 0)]
+    HALO_STOPS = [(14, 20, 20), (20, 20, 20)]
+    SELECTED = {"Test Features": {"Value": {}}}
+
+    def setUp(self):
+        g = Graph()
+        self.registry = BlockObjectRegistry()
+        self.classifier = RowRecordingClassifier()
+        self.ops = []
+        for block_bounds, halo_start, halo_stop in zip(self.BLOCKS, self.HALO_STARTS, self.HALO_STOPS):
+            seen = [obj for obj in self.OBJECTS if halo_start[0] <= obj[1] and obj[2] < halo_stop[0]]
+            mins = numpy.array([[0, 0, 0]] + [[x_min - halo_start[0], 0, 0] for _, x_min, _ in seen])
+            maxs = numpy.array([[0, 0, 0]] + [[x_max - halo_start[0], 1, 1] for _, _, x_max in seen])
+            features = {
+                "Test Features": {"Value": numpy.array([[0.0]] + [[value] for value, _, _ in seen])},
+                default_features_key: {
+                    "Coord<Minimum>": mins.astype(numpy.float32),
+                    "Coord<Maximum>": maxs.astype(numpy.float32),
+                    "Count": (maxs - mins + 1).prod(axis=1, keepdims=True).astype(numpy.float32),
+                },
+            }
+
+            op = OpBlockObjectPredict(graph=g)
+            op.Features.setValue({0: features})
+            op.SelectedFeatures.setValue(self.SELECTED)
+            op.Classifier.setValue(self.classifier)
+            op.LabelsCount.setValue(2)
+            op.ObjectRegistry.setValue(self.registry)
+            op.HaloOffset.setValue(halo_start)
+            op.BlockBounds.setValue(block_bounds)
+            op.HaloPadding.setValue((4, 4, 4))
+            self.ops.append((op, [value for value, _, _ in seen]))
+
+    def predict(self, block):
+        op, values = self.ops[block]
+        self.classifier.predicted = []
+        probabilities = op.Probabilities([0]).wait()[0]
+        return dict(zip(values, probabilities[1:, 0].tolist())), sorted(self.classifier.predicted)
+
+    def testOwnerFirst(self):
+        first, first_rows = self.predict(0)
+        second, second_rows = self.predict(1)
+        # Only the object owned by the second block is predicted by both
+        assert first_rows == [0.125, 0.25, 0.375, 0.5, 0.75]
+        assert second_rows == [0.625, 0.75]
+        assert len(first_rows) + len(second_rows) == len(self.OBJECTS) + 1
+        for value in [0.125, 0.25]:
+            assert first[value] == second[value] == value
+        # Not part of the block
+        assert second[0.375] == 0
+
+    def testNeighbourFirst(self):
+        second, second_rows = self.predict(1)
+        first, first_rows = self.predict(0)
+        assert second_rows == [0.125, 0.25, 0.625, 0.75]
+        assert first_rows == [0.125, 0.25, 0.375, 0.5]
+        assert first[0.75] == second[0.75] == 0.75
+        assert second[0.375] == 0
+
+
 def getlist(a, n=3):
     try:
         len(a)
@@ -24,6 +24,8 @@ import numpy
 from lazyflow.roi import sliceToRoi
 from lazyflow.graph import Graph, OperatorWrapper
 from lazyflow.operators.ioOperators import OpInputDataReader
+from lazyflow.request import Request
+from lazyflow.utility import Memory
 from ilastik.applets.featureSelection.opFeatureSelection import OpFeatureSelection
 import vigra
 
@@ -32,6 +34,7 @@ import ilastik.ilastik_logging
 ilastik.ilastik_logging.default_config.init()
 
 import unittest
+from unittest import mock
 import tempfile
 
 
@@ -119,6 +122,20 @@ class TestOpFeatureSelection(unittest.TestCase):
                 featureSlice[-1] = featureIndex
                 vigra.impex.writeImage(result[featureSlice], "test_feature" + str(featureIndex) + ".bmp")
 
+    def test_feature_cache_blockshape(self):
+        opFeatures = self.opFeatures[0]
+        # 15 feature channels, 250 MB per worker thread
+        num_threads = max(1, Request.global_thread_pool.num_workers)
+        with mock.patch.object(Memory, "getAvailableRamComputation", return_value=250e6 * num_threads):
+            blockshape = opFeatures._get_feature_cache_blockshape("x")
+
+        tagged_blockshape = dict(zip(opFeatures.OutputImage.meta.getAxisKeys(), blockshape))
+        # halo 7: thinner blocks are dominated by it, thicker ones only waste RAM
+        assert tagged_blockshape["x"] == 64
+        assert tagged_blockshape["y"] == tagged_blockshape["z"] == 100
+        assert tagged_blockshape["t"] == 1
+        assert tagged_blockshape["c"] >= 15
+
     def test_2d(self):
         graph = Graph()
         data2d = numpy.random.random((2, 100, 100, 1, 3))
@@ -94,6 +94,23 @@ class TestOpRelabelSegmentation(unittest.TestCase):
         assert np.all(img[1, 10:20, 10:20, 10:20, 0] == 60)
         assert np.all(img[1, 20:25, 20:25, 20:25, 0] == 70)
 
+    def test_lookup_table_reset(self):
+        segimg = segImage()
+        self.op.Image.setValue(segimg)
+        # no value for the highest object id at t=1
+        self.op.ObjectMap.setValue({0: np.array([10, 20, 30]), 1: np.array([40, 50, 60])})
+        self.op.Features._setReady()  # hack because we do not use features
+        img = self.op.Output.value
+        assert np.all(img[1, 10:20, 10:20, 10:20, 0] == 60)
+        assert np.all(img[1, 20:25, 20:25, 20:25, 0] == 0)
+        assert 1 in self.op._luts
+
+        self.op.ObjectMap.setValue({0: np.array([10, 20, 31]), 1: np.array([40, 50, 60, 71])})
+        assert not self.op._luts
+        img = self.op.Output.value
+        assert np.all(img[0, 20:25, 20:25, 20:25, 0] == 31)
+        assert np.all(img[1, 20:25, 20:25, 20:25, 0] == 71)
+
 
 class TestOpObjectTrain(unittest.TestCase):
 
@@ -271,6 +288,16 @@ class TestOpObjectPredict(unittest.TestCase):
         self.assertTrue(np.all(preds[0] == np.array([0, 1, 2])))
         self.assertTrue(np.all(preds[1] == np.array([0, 1, 1, 2])))
 
+    def test_predict_in_batches(self):
+        probs = self.op.Probabilities([0, 1]).wait()
+        self.featsop.Output.setDirty(slice(None))
+
+        # one time slice per batch
+        self.op.PREDICTION_BATCH_ROWS = 1
+        probs_per_time_slice = self.op.Probabilities([0, 1]).wait()
+        for t in [0, 1]:
+            np.testing.assert_array_equal(probs_per_time_slice[t], probs[t])
+
     def test_probabilities(self):
         ###
         # test whether the probability channel slots and the total probability slot return the same values
@@ -59,3 +59,42 @@ class TestTransferLabelsFunction(object):
         newmin4 = coords_new["Coord<Minimum>"][4]
         newmax4 = coords_new["Coord<Maximum>"][4]
         assert numpy.all(newlost["conflict"] == (newmin4 + (newmax4 - newmin4) / 2.0))
+
+    def test_same_as_all_pairs(self):
+        rng = numpy.random.default_rng(0)
+        coords_old = dict()
+        coords_old["Coord<Minimum>"] = rng.integers(0, 200, (300, 3)).astype(numpy.float32)
+        coords_old["Coord<Maximum>"] = coords_old["Coord<Minimum>"] + rng.integers(0, 30, (300, 3))
+        coords_new = dict()
+        coords_new["Coord<Minimum>"] = rng.integers(0, 200, (400, 3)).astype(numpy.float32)
+        coords_new["Coord<Maximum>"] = coords_new["Coord<Minimum>"] + rng.integers(0, 30, (400, 3))
+        coords_new["Coord<Maximum>"][7] = 250  # one large object
+        labels = rng.integers(0, 3, 300)
+
+        newlabels, oldlost, newlost = OpObjectClassification.transferLabels(labels, coords_old, coords_new, None)
+
+        # compare every old labeled object with every new object
+        def centers_and_radii(coords, rows):
+            rads = 0.5 * (coords["Coord<Maximum>"][rows] - coords["Coord<Minimum>"][rows])
+            return coords["Coord<Minimum>"][rows] + rads, rads
+
+        nonzeros = numpy.nonzero(labels)[0]
+        cents_old, rads_old = centers_and_radii(coords_old, nonzeros)
+        cents_new, rads_new = centers_and_radii(coords_new, slice(1, None))
+        over = rads_old[:, None] + rads_new[None] - numpy.abs(cents_old[:, None] - cents_new[None])
+        overlaps = numpy.where(numpy.all(over > 0, axis=2), numpy.prod(over, axis=2), 0)
+
+        num_overlapping = numpy.count_nonzero(overlaps, axis=1)
+        assert len(oldlost["full"]) == numpy.count_nonzero(num_overlapping == 0)
+        assert len(oldlost["partial"]) == numpy.count_nonzero(num_overlapping > 1)
+
+        best = numpy.where(num_overlapping > 0, numpy.argmax(overlaps, axis=1), -1)
+        expected = numpy.zeros((400,))
+        num_conflicts = 0
+        for iobj in range(399):
+            matched = numpy.nonzero(best == iobj)[0]
+            if len(matched) == 1:
+                expected[iobj + 1] = labels[nonzeros[matched[0]]]
+            num_conflicts += len(matched) > 1
+        assert numpy.all(newlabels == expected)
+        assert len(newlost["conflict"]) == num_conflicts
@@ -0,0 +1,132 @@
+###############################################################################
+#   ilastik: interactive learning and segmentation toolkit
+#
+#       Copyright (C) 2011-2024, the ilastik developers
+#                                <team@ilastik.org>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders of
+# ilastik give you permission to combine ilastik with applets,
+# workflows and plugins which are not covered under the GNU
+# General Public License.
+#
+# See the LICENSE file for details. License information is also available
+# on the ilastik web site at:
+# 		   http://ilastik.org/license.html
+###############################################################################
+import numpy
+import pytest
+
+from lazyflow.graph import Graph
+from ilastik.applets.objectExtraction.objectFeatureTable import ObjectFeatureTable, OpObjectFeatureTable
+from ilastik.applets.objectClassification.opObjectClassification import (
+    make_feature_array,
+    make_feature_array_from_table,
+)
+
+SELECTED = {"Standard Object Features": {"Count": {}, "RegionCenter": {}}}
+
+
+def random_features(num_objects, rng):
+    return {
+        "Standard Object Features": {
+            "Count": rng.random((num_objects + 1, 1)).astype(numpy.float32),
+            "RegionCenter": rng.random((num_objects + 1, 3)).astype(numpy.float32),
+            "Mean": rng.random((num_objects + 1, 1)).astype(numpy.float32),
+        },
+        "Default features": {"Count": rng.random((num_objects + 1, 1)).astype(numpy.float32)},
+    }
+
+
+@pytest.fixture
+def table(monkeypatch):
+    # small, to test the reallocation
+    monkeypatch.setattr(ObjectFeatureTable, "MIN_CAPACITY", 4)
+    table = ObjectFeatureTable()
+    yield table
+    table.close()
+
+
+def test_same_as_make_feature_array(table):
+    rng = numpy.random.default_rng(42)
+    feats = {t: random_features(n, rng) for t, n in enumerate([5, 0, 17, 3])}
+    for t in [2, 0, 3, 1]:
+        table.append(t, feats[t])
+
+    matrix, _, col_names = make_feature_array_from_table(table, [0, 2, 3], SELECTED)
+    expected, _, expected_col_names = make_feature_array({t: feats[t] for t in [0, 2, 3]}, SELECTED)
+    numpy.testing.assert_array_equal(matrix, expected)
+    assert col_names == expected_col_names
+
+    labels = {0: numpy.array([0, 1, 0, 0, 2, 0]), 3: numpy.array([0, 0, 0, 1])}
+    result = make_feature_array_from_table(table, [0, 3], SELECTED, labels)
+    expected = make_feature_array({t: feats[t] for t in [0, 3]}, SELECTED, labels)
+    for value, expected_value in zip(result, expected):
+        numpy.testing.assert_array_equal(value, expected_value)
+
+
+def test_native_dtype(table):
+    rng = numpy.random.default_rng(3)
+    feats = {t: random_features(n, rng) for t, n in enumerate([4, 6])}
+    feats[1]["Standard Object Features"]["Count"] = feats[1]["Standard Object Features"]["Count"].astype(numpy.float64)
+    for t in [0, 1]:
+        table.append(t, feats[t])
+
+    assert table.column("Standard Object Features", "RegionCenter", [0, 1]).dtype == numpy.float32
+    matrix, _, _ = make_feature_array_from_table(table, [0, 1], SELECTED)
+    expected, _, _ = make_feature_array(feats, SELECTED)
+    assert matrix.dtype == expected.dtype == numpy.float64
+    numpy.testing.assert_array_equal(matrix, expected)
+
+
+def test_replace_and_view(table):
+    rng = numpy.random.default_rng(0)
+    first = random_features(3, rng)
+    table.append(0, first)
+    table.append(1, random_features(2, rng))
+    view = table.view([0, 1])
+
+    second = random_features(10, rng)
+    for _ in range(5):
+        table.append(0, second)
+    table.remove(1)
+
+    assert table.times() == [0]
+    assert table.num_rows(0) == 11
+    numpy.testing.assert_array_equal(
+        table.column("Standard Object Features", "Mean", [0]), second["Standard Object Features"]["Mean"]
+    )
+
+    # the view is not affected
+    assert view.times() == [0, 1]
+    assert view.num_rows(0) == 4
+    numpy.testing.assert_array_equal(
+        view.time_slice(0)["Default features"]["Count"], first["Default features"]["Count"]
+    )
+
+
+def test_column_is_not_copied(table):
+    rng = numpy.random.default_rng(1)
+    for t in range(3):
+        table.append(t, random_features(t + 1, rng))
+    column = table.column("Standard Object Features", "RegionCenter", [0, 1, 2])
+    assert column.shape == (9, 3)
+    assert isinstance(column.base, numpy.memmap)
+
+
+def test_operator():
+    rng = numpy.random.default_rng(2)
+    feats = {t: random_features(4, rng) for t in range(3)}
+
+    op = OpObjectFeatureTable(graph=Graph())
+    op.Features.setValue(feats)
+    table = op.Table([1, 2]).wait()
+    assert table.times() == [1, 2]
+    numpy.testing.assert_array_equal(
+        table.time_slice(2)["Standard Object Features"]["Mean"], feats[2]["Standard Object Features"]["Mean"]
+    )
+    op.cleanUp()
@@ -24,11 +24,13 @@ from __future__ import division
 from builtins import range
 from past.utils import old_div
 import unittest
+from functools import partial
 import numpy as np
 import vigra
 from lazyflow.graph import Graph
-from lazyflow.operators import OpLabelVolume
+from lazyflow.operators import OpArrayPiper, OpLabelVolume
 from ilastik.applets.objectExtraction.opObjectExtraction import OpAdaptTimeListRoi, OpRegionFeatures, OpObjectExtraction
+from ilastik.plugins import ObjectFeaturesPlugin
 from ilastik.plugins.manager import pluginManager
 
 import warnings
@@ -211,3 +213,154 @@ class TestOpRegionFeaturesAgainstNumpy(unittest.TestCase):
                 # that means bounding box centers can differ with a maximum of 0.5
                 bbox_center = mins[iobj] + ((maxs[iobj] - mins[iobj]) / 2.0)
                 np.testing.assert_allclose(centers[iobj], bbox_center, atol=0.5)
+
+
+class TestOpRegionFeaturesBlockwise(unittest.TestCase):
+    def setUp(self):
+        g = Graph()
+        self.features = {
+            NAME: {
+                "Count": {},
+                "RegionCenter": {},
+                "Mean": {},
+                "Variance": {},
+                "Sum": {},
+                "Minimum": {},
+                "Maximum": {},
+                "Coord<Minimum>": {},
+                "Coord<Maximum>": {},
+            }
+        }
+
+        self.labelop = OpLabelVolume(graph=g)
+        self.labelop.Input.setValue(binaryImage())
+
+        raw = rawImage() + np.random.rand(*rawImage().shape).astype(np.float32)
+        self.ops = []
+        for block_shape in [None, (1, 16, 16, 16, 1), (1, 7, 50, 3, 1)]:
+            op = OpRegionFeatures(graph=g)
+            op.LabelVolume.connect(self.labelop.Output)
+            op.RawVolume.setValue(raw)
+            op.Features.setValue(self.features)
+            if block_shape is not None:
+                op.BlockShape.setValue(block_shape)
+            self.ops.append(op)
+
+    def test_same_features(self):
+        expected = self.ops[0].Output[:].wait()
+        for op in self.ops[1:]:
+            feats = op.Output[:].wait()
+            for t in range(len(expected)):
+                for key, value in expected[t][NAME].items():
+                    np.testing.assert_allclose(feats[t][NAME][key], value, rtol=1e-5, atol=1e-5, err_msg=key)
+                for key, value in expected[t]["Default features"].items():
+                    np.testing.assert_allclose(feats[t]["Default features"][key], value, rtol=1e-5, err_msg=key)
+
+
+class TestLocalFeaturesBatched(unittest.TestCase):
+    def setUp(self):
+        g = Graph()
+        self.labelop = OpLabelVolume(graph=g)
+        self.labelop.Input.setValue(binaryImage())
+        self.op = OpRegionFeatures(graph=g)
+        self.op.LabelVolume.connect(self.labelop.Output)
+        self.op.RawVolume.setValue(rawImage())
+        self.op.Features.setValue(
+            {NAME: {"Count": {}, "Mean in neighborhood": {"margin": (12, 12, 2)}, "Variance in neighborhood": {}}}
+        )
+        self.plugin = pluginManager.getPluginByName(NAME, "ObjectFeatures").plugin_object
+
+    def tearDown(self):
+        self.plugin.__dict__.pop("compute_local_batch", None)
+
+    def test_same_as_per_object(self):
+        batched = self.op.Output[:].wait()
+
+        # The base class computes one object at a time
+        self.plugin.compute_local_batch = partial(ObjectFeaturesPlugin.compute_local_batch, self.plugin)
+        self.op.forget_previous_features()
+        per_object = self.op.Output[:].wait()
+
+        for t in range(len(batched)):
+            assert set(batched[t][NAME].keys()) == set(per_object[t][NAME].keys())
+            for key, value in per_object[t][NAME].items():
+                np.testing.assert_array_equal(batched[t][NAME][key], value, err_msg=key)
+
+
+class TestPluginConcurrency(unittest.TestCase):
+    def setUp(self):
+        g = Graph()
+        self.labelop = OpLabelVolume(graph=g)
+        self.labelop.Input.setValue(binaryImage())
+        self.op = OpRegionFeatures(graph=g)
+        self.op.LabelVolume.connect(self.labelop.Output)
+        self.op.RawVolume.setValue(rawImage())
+        self.op.Features.setValue({NAME: {"Count": {}, "Mean": {}, "Mean in neighborhood": {"margin": (4, 4, 2)}}})
+        self.plugin = pluginManager.getPluginByName(NAME, "ObjectFeatures").plugin_object
+
+    def tearDown(self):
+        self.plugin.__dict__.pop("concurrency", None)
+
+    def test_same_features(self):
+        expected = self.op.Output[:].wait()
+        for concurrency in ["serial", "process"]:
+            self.plugin.concurrency = concurrency
+            self.op.forget_previous_features()
+            feats = self.op.Output[:].wait()
+            for t in range(len(expected)):
+                assert list(feats[t]) == list(expected[t])
+                for key, value in expected[t][NAME].items():
+                    np.testing.assert_array_equal(feats[t][NAME][key], value, err_msg=key)
+
+
+class TestOpRegionFeaturesIncremental(unittest.TestCase):
+    def setUp(self):
+        g = Graph()
+        self.binary = binaryImage()
+        self.opSegmentation = OpArrayPiper(graph=g)
+        self.opSegmentation.Input.setValue(self.binary)
+        self.labelop = OpLabelVolume(graph=g)
+        self.labelop.Input.connect(self.opSegmentation.Output)
+
+        features = {NAME: {"Count": {}, "Mean": {}, "Mean in neighborhood": {"margin": (2, 2, 2)}}}
+        self.op = OpRegionFeatures(graph=g)
+        self.op.LabelVolume.connect(self.labelop.CachedOutput)
+        self.op.SegmentationVolume.connect(self.opSegmentation.Output)
+        self.op.KeepPreviousFeatures.setValue(True)
+        self.op.RawVolume.setValue(rawImage())
+        self.op.Features.setValue(features)
+
+        self.opExpected = OpRegionFeatures(graph=g)
+        self.opExpected.LabelVolume.connect(self.labelop.CachedOutput)
+        self.opExpected.RawVolume.setValue(rawImage())
+        self.opExpected.Features.setValue(features)
+
+    def test_only_changed_objects_recomputed(self):
+        self.op.Output[0:1].wait()
+
+        recomputed_objects = []
+        extract = self.op._extract
+
+        def counting_extract(image, labels, atlas=None):
+            recomputed_objects.append(int(labels.max()))
+            return extract(image, labels, atlas)
+
+        self.op._extract = counting_extract
+
+        # a new object, away from the others (which are renumbered)
+        self.binary[0, 45:48, 0:3, 0:3, 0] = 1
+        self.opSegmentation.Input.setDirty((slice(0, 1), slice(45, 48), slice(0, 3), slice(0, 3), slice(None)))
+
+        feats = self.op.Output[0:1].wait()[0]
+        assert recomputed_objects == [1]
+
+        expected = self.opExpected.Output[0:1].wait()[0]
+        assert expected[NAME]["Count"].shape[0] == 5
+        for plugin_name, plugin_features in expected.items():
+            assert set(feats[plugin_name].keys()) == set(plugin_features.keys())
+            for key, value in plugin_features.items():
+                np.testing.assert_allclose(feats[plugin_name][key], value, rtol=1e-6, err_msg=key)
+
+    def test_previous_features_not_kept_by_default(self):
+        self.opExpected.Output[0:1].wait()
+        assert not self.opExpected._previous_features
@@ -0,0 +1,71 @@
+import numpy
+import pytest
+import vigra
+
+from lazyflow.classifiers import ParallelVigraRfLazyflowClassifierFactory, ParallelVigraRfLazyflowClassifier
+from lazyflow.classifiers import flatForest
+from lazyflow.classifiers.flatForest import FlatForest
+
+
+@pytest.fixture(params=[False, True], ids=["numpy", "numba"])
+def with_numba(request, monkeypatch):
+    if request.param and not flatForest.WITH_NUMBA:
+        pytest.skip("numba is not available")
+    monkeypatch.setattr(flatForest, "WITH_NUMBA", request.param)
+    return request.param
+
+
+@pytest.fixture
+def training_data():
+    rng = numpy.random.RandomState(0)
+    X = rng.rand(2000, 5).astype(numpy.float32)
+    y = (X[:, 0] + X[:, 1] > 1).astype(numpy.uint32) + 2 * (X[:, 2] > 0.7).astype(numpy.uint32) + 1
+    X_test = rng.rand(5000, 5).astype(numpy.float32)
+    X_test[:10, 3] = numpy.nan
+    return X, y, X_test
+
+
+def test_single_forest_matches_vigra_exactly(training_data, with_numba):
+    X, y, X_test = training_data
+    forest = vigra.learning.RandomForest(10)
+    forest.learnRF(X, y[:, None])
+
+    expected = forest.predictProbabilities(X_test)
+    computed = FlatForest.from_vigra_forests([forest]).predict_probabilities(X_test)
+    assert computed.dtype == numpy.float32
+    assert (computed == expected).all()
+
+
+def test_parallel_classifier_matches_vigra(training_data, with_numba, monkeypatch):
+    X, y, X_test = training_data
+    classifier = ParallelVigraRfLazyflowClassifierFactory(20, num_forests=3).create_and_train(X, y)
+
+    monkeypatch.setattr(ParallelVigraRfLazyflowClassifier, "USE_FLAT_FOREST", False)
+    expected = classifier.predict_probabilities(X_test)
+
+    monkeypatch.setattr(ParallelVigraRfLazyflowClassifier, "USE_FLAT_FOREST", True)
+    computed = classifier.predict_probabilities(X_test)
+    assert classifier._flat_forest
+    assert computed.shape == expected.shape == (len(X_test), 4)
+    # Only the summation order of the forests may differ.
+    numpy.testing.assert_allclose(computed, expected, rtol=1e-6)
+
+
+def test_early_exit_prediction(training_data, with_numba):
+    X, y, X_test = training_data
+    classifier = ParallelVigraRfLazyflowClassifierFactory(40, num_forests=4).create_and_train(X, y)
+    full = classifier.predict_probabilities(X_test)
+
+    # A margin that can't be reached evaluates all trees
+    probabilities, average_trees = classifier.predict_probabilities_early_exit(X_test, margin=1.1, tree_batch_size=8)
+    assert average_trees == 40
+    numpy.testing.assert_allclose(probabilities, full, atol=1e-5)
+
+    probabilities, average_trees = classifier.predict_probabilities_early_exit(X_test, margin=0.5, tree_batch_size=8)
+    assert 8 <= average_trees < 40
+    disagreement = (numpy.argmax(probabilities, axis=-1) != numpy.argmax(full, axis=-1)).mean()
+    assert disagreement < 0.02
+
+    # The same mode through the regular interface
+    classifier.set_early_exit(0.5, tree_batch_size=8)
+    numpy.testing.assert_array_equal(classifier.predict_probabilities(X_test), probabilities)
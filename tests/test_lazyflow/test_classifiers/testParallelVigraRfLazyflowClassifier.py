@@ -1,4 +1,7 @@
 from builtins import object
+import io
+
+import h5py
 import numpy
 from lazyflow.classifiers import ParallelVigraRfLazyflowClassifierFactory, ParallelVigraRfLazyflowClassifier
 
@@ -56,6 +59,24 @@ class TestParallelVigraRfLazyflowClassifier(object):
         assert (0 <= probabilities).all() and (probabilities <= 1.0).all()
         assert (numpy.argmax(probabilities, axis=-1) + 1 == self.expected_classes).all()
 
+    def test_serialization(self):
+        factory = ParallelVigraRfLazyflowClassifierFactory(10, num_forests=3)
+        classifier = factory.create_and_train(self.training_feature_matrix, self.training_labels, ["a", "b"])
+
+        with h5py.File(io.BytesIO(), "w") as f:
+            classifier.serialize_hdf5(f.create_group("classifier"))
+            assert sorted(k for k in f["classifier"].keys() if k.startswith("Forest")) == [
+                "Forest0000",
+                "Forest0001",
+                "Forest0002",
+            ]
+            loaded = ParallelVigraRfLazyflowClassifier.deserialize_hdf5(f["classifier"])
+
+        assert list(loaded.known_classes) == [1, 2]
+        numpy.testing.assert_allclose(
+            loaded.predict_probabilities(self.prediction_data), classifier.predict_probabilities(self.prediction_data)
+        )
+
     def test_pickle_fields(self):
         """
         Classifier factories are meant to be pickled and restored, but that only
@@ -99,3 +120,57 @@ class TestParallelVigraRfLazyflowClassifier(object):
                 "_num_forests",
             ]
         )
+
+    def test_update_and_train(self):
+        factory = ParallelVigraRfLazyflowClassifierFactory(20, num_forests=4)
+        classifier = factory.create_and_train(self.training_feature_matrix, self.training_labels)
+
+        # New samples only: the oldest trees are replaced, the others are kept.
+        extra_features = numpy.array([[2.5, 3.5], [-2.5, 3.5]])
+        extra_labels = (extra_features.prod(axis=-1) >= 0).astype(numpy.uint32) + 1
+        X = numpy.concatenate([self.training_feature_matrix, extra_features])
+        y = numpy.concatenate([self.training_labels, extra_labels])
+
+        updated = factory.update_and_train(classifier, X, y, num_trees_to_replace=5)
+        assert isinstance(updated, ParallelVigraRfLazyflowClassifier)
+        assert list(updated.known_classes) == [1, 2]
+        assert [f.treeCount() for f in updated._forests] == [5] * 4
+        assert updated._forests[:3] == classifier._forests[1:]
+
+        probabilities = updated.predict_probabilities(self.prediction_data)
+        assert probabilities.shape == (4, 2)
+        assert (numpy.argmax(probabilities, axis=-1) + 1 == self.expected_classes).all()
+
+        # Unchanged training data: nothing to do
+        assert factory.update_and_train(updated, X, y) is updated
+
+        # Removed samples: full retrain
+        retrained = factory.update_and_train(updated, X[1:], y[1:])
+        assert not set(retrained._forests) & set(updated._forests)
+
+        # New class: full retrain
+        y_new_class = y.copy()
+        y_new_class[-1] = 3
+        retrained = factory.update_and_train(updated, X, y_new_class)
+        assert list(retrained.known_classes) == [1, 2, 3]
+        assert not set(retrained._forests) & set(updated._forests)
+
+    def test_repeated_updates_keep_forests(self):
+        factory = ParallelVigraRfLazyflowClassifierFactory(30, num_forests=4)
+        X, y = self.training_feature_matrix, self.training_labels
+        classifier = factory.create_and_train(X, y)
+        tree_counts = [f.treeCount() for f in classifier._forests]
+        assert tree_counts == [8, 8, 7, 7]
+
+        rng = numpy.random.default_rng(0)
+        for i in range(6):
+            extra_features = rng.uniform(-4, 4, size=(1, 2))
+            X = numpy.concatenate([X, extra_features])
+            y = numpy.concatenate([y, (extra_features.prod(axis=-1) >= 0).astype(numpy.uint32) + 1])
+            previous_forests = classifier._forests
+            classifier = factory.update_and_train(classifier, X, y, num_trees_to_replace=3)
+
+            # Whole forests are replaced round-robin, the number of forests and trees stays the same
+            assert classifier._forests[:3] == previous_forests[1:]
+            rotation = (i + 1) % 4
+            assert [f.treeCount() for f in classifier._forests] == tree_counts[rotation:] + tree_counts[:rotation]
@@ -0,0 +1,38 @@
+import numpy
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+from lazyflow.classifiers import SklearnLazyflowClassifierFactory, SklearnLazyflowClassifier
+from lazyflow.request import Request
+
+
+@pytest.fixture
+def classifier():
+    rng = numpy.random.RandomState(0)
+    X = rng.rand(500, 3).astype(numpy.float32)
+    y = (X[:, 0] > X[:, 1]).astype(numpy.uint32) + 1
+    factory = SklearnLazyflowClassifierFactory(RandomForestClassifier, n_estimators=10, n_jobs=2, random_state=0)
+    return factory.create_and_train(X, y)
+
+
+def test_chunked_prediction(classifier, monkeypatch):
+    assert isinstance(classifier, SklearnLazyflowClassifier)
+    X = numpy.random.rand(10000, 3).astype(numpy.float32)
+    expected = classifier._sklearn_classifier.predict_proba(X)
+
+    monkeypatch.setattr(SklearnLazyflowClassifier, "MIN_CHUNK_ROWS", 1000)
+    if Request.global_thread_pool.num_workers > 1:
+        assert classifier._get_chunk_rows(X) < len(X)
+
+    probabilities = classifier.predict_probabilities(X)
+    numpy.testing.assert_allclose(probabilities, expected)
+
+
+def test_prediction_limits_n_jobs(classifier):
+    if Request.global_thread_pool.num_workers == 0:
+        pytest.skip("Estimator jobs are only limited if lazyflow runs in parallel.")
+
+    prediction_classifier = classifier._get_prediction_classifier()
+    assert prediction_classifier.n_jobs == 1
+    # The stored estimator is left as configured
+    assert classifier._sklearn_classifier.n_jobs == 2
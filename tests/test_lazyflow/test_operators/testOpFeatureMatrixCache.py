@@ -51,3 +51,68 @@ class TestOpFeatureMatrixCache(object):
         # Just check that all features are present, regardless of order.
         for feature_vec in [[10.5, 10.5], [10.5, 11.5], [20.5, 20.5], [20.5, 21.5]]:
             assert feature_vec in labels_and_features[:, 1:]
+
+    def testMaxSamplesPerClass(self):
+        features = numpy.indices((100, 100)).astype(numpy.float32) + 0.5
+        features = numpy.rollaxis(features, 0, 3)
+        features = vigra.taggedView(features, "xyc")
+
+        labels = numpy.zeros((100, 100, 1), dtype=numpy.uint8)
+        labels[10:60, 10:60] = 1
+        labels[70:75, 70:75] = 2
+        labels = vigra.taggedView(labels, "xyc")
+
+        graph = Graph()
+        opLabelCache = OpBlockedArrayCache(graph=graph)
+        opLabelCache.BlockShape.setValue((10, 10, 1))
+        opLabelCache.Input.setValue(labels)
+
+        opFeatureMatrixCache = OpFeatureMatrixCache(graph=graph)
+        opFeatureMatrixCache.LabelImage.connect(opLabelCache.Output)
+        opFeatureMatrixCache.FeatureImage.setValue(features)
+        opFeatureMatrixCache.MaxSamplesPerClass.setValue(100)
+        opFeatureMatrixCache.SamplingSeed.setValue(42)
+
+        # Label the blocks in two steps
+        opFeatureMatrixCache.LabelImage.setDirty(numpy.s_[10:40, 10:60])
+        opFeatureMatrixCache.LabelAndFeatureMatrix.value
+        opFeatureMatrixCache.LabelImage.setDirty(numpy.s_[40:80, 10:80])
+        labels_and_features = opFeatureMatrixCache.LabelAndFeatureMatrix.value
+
+        # Class 1 is capped, class 2 is complete
+        assert labels_and_features.shape == (125, 3)
+        assert (labels_and_features[:, 0] == 1).sum() == 100
+        assert (labels_and_features[:, 0] == 2).sum() == 25
+        for label, x, y in labels_and_features:
+            assert labels[int(x), int(y), 0] == label
+        # Only the output samples are stored
+        assert sum(len(m) for m in opFeatureMatrixCache._blockwise_feature_matrices.values()) == 125
+
+        # Deterministic: the same samples if all blocks are (re)computed at once
+        opFeatureMatrixCache2 = OpFeatureMatrixCache(graph=graph)
+        opFeatureMatrixCache2.LabelImage.connect(opLabelCache.Output)
+        opFeatureMatrixCache2.FeatureImage.setValue(features)
+        opFeatureMatrixCache2.MaxSamplesPerClass.setValue(100)
+        opFeatureMatrixCache2.SamplingSeed.setValue(42)
+        opFeatureMatrixCache2.LabelImage.setDirty(numpy.s_[:, :])
+        assert (opFeatureMatrixCache2.LabelAndFeatureMatrix.value == labels_and_features).all()
+
+        # A different seed gives a different sample
+        opFeatureMatrixCache2.SamplingSeed.setValue(1)
+        other_sample = opFeatureMatrixCache2.LabelAndFeatureMatrix.value
+        assert other_sample.shape == (125, 3)
+        assert not (other_sample == labels_and_features).all()
+
+        # Erasing labels: pruned samples are needed again
+        labels[10:40, 10:60] = 0
+        opLabelCache.Input.setDirty(numpy.s_[10:40, 10:60])
+        labels_and_features = opFeatureMatrixCache.LabelAndFeatureMatrix.value
+        assert (labels_and_features[:, 0] == 1).sum() == 100
+
+        opFeatureMatrixCache3 = OpFeatureMatrixCache(graph=graph)
+        opFeatureMatrixCache3.LabelImage.connect(opLabelCache.Output)
+        opFeatureMatrixCache3.FeatureImage.setValue(features)
+        opFeatureMatrixCache3.MaxSamplesPerClass.setValue(100)
+        opFeatureMatrixCache3.SamplingSeed.setValue(42)
+        opFeatureMatrixCache3.LabelImage.setDirty(numpy.s_[:, :])
+        assert (opFeatureMatrixCache3.LabelAndFeatureMatrix.value == labels_and_features).all()
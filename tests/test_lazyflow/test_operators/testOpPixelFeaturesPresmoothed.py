@@ -1,4 +1,5 @@
 import numpy
+import pytest
 import vigra
 
 from lazyflow.graph import Graph
@@ -75,3 +76,61 @@ class TestOpPixelFeaturesPresmoothed(object):
 
         assert computed_whole.shape == computed_per_slice.shape
         assert numpy.allclose(computed_whole, computed_per_slice), abs(computed_whole - computed_per_slice).max()
+
+    def test_time_and_channel_requests_match_whole(self):
+        op = OpPixelFeaturesPresmoothed(graph=Graph())
+        op.Scales.setValue([0.7, 1.6])
+        op.FeatureIds.setValue(["GaussianSmoothing", "StructureTensorEigenvalues", "HessianOfGaussianEigenvalues"])
+        op.SelectionMatrix.setValue(numpy.array([[True, True], [False, True], [True, False]]))
+        op.ComputeIn2d.setValue([False] * 2)
+        op.Input.setValue(self.data)
+
+        computed_whole = op.Output[:].wait()
+
+        # each time point on its own
+        per_t = numpy.concatenate([op.Output[t : t + 1].wait() for t in range(self.data.shape[0])], axis=0)
+        numpy.testing.assert_allclose(computed_whole, per_t)
+
+        # channel subsets that do not align with the channels of individual features
+        n_channels = op.Output.meta.shape[1]
+        for c_start, c_stop in [(1, 4), (2, n_channels - 1), (n_channels - 5, n_channels)]:
+            subset = op.Output[:, c_start:c_stop].wait()
+            numpy.testing.assert_allclose(computed_whole[:, c_start:c_stop], subset)
+
+    def test_halo(self):
+        op = OpPixelFeaturesPresmoothed(graph=Graph())
+        op.Scales.setValue([0.7, 1.6, 5.0])
+        op.FeatureIds.setValue(["GaussianSmoothing"])
+        op.SelectionMatrix.setValue(numpy.array([[True, True, False]]))
+        op.ComputeIn2d.setValue([False] * 3)
+        op.Input.setValue(self.data)
+
+        # pre-smoothing with sigma 1.6 and filtering with sigma 0.7
+        assert op.getHalo() == (0, 0, 9, 9, 9)
+
+        op.ComputeIn2d.setValue([True] * 3)
+        assert op.getHalo() == (0, 0, 0, 9, 9)
+
+    @pytest.mark.parametrize("compute_in_2d", [True, False])
+    def test_tiled_computation_matches_whole(self, monkeypatch, compute_in_2d):
+        op = OpPixelFeaturesPresmoothed(graph=Graph())
+        op.Scales.setValue([0.7, 1.0])
+        op.FeatureIds.setValue(["GaussianSmoothing", "GaussianGradientMagnitude", "HessianOfGaussianEigenvalues"])
+        op.SelectionMatrix.setValue(numpy.array([[True, True], [True, False], [False, True]]))
+        op.ComputeIn2d.setValue([compute_in_2d] * 2)
+        # z has to be thicker than two tiles with halo
+        data = vigra.taggedView(numpy.random.rand(1, 2, 40, 19, 20), "tczyx")
+        op.Input.setValue(data)
+
+        computed_whole = op.Output[:].wait()
+
+        # a single layer per tile
+        monkeypatch.setattr(OpPixelFeaturesPresmoothed, "PRESMOOTHING_TILE_BYTES", 1)
+        assert len(op._getTiles(numpy.zeros(5, dtype=int), numpy.array(op.Output.meta.shape))) > 1
+        computed_tiled = op.Output[:].wait()
+        numpy.testing.assert_allclose(computed_whole, computed_tiled, rtol=1e-5, atol=1e-6)
+
+        computed_tiled_roi = op.Output[:, 2:7, 1:33, 3:17, 2:19].wait()
+        numpy.testing.assert_allclose(
+            computed_whole[:, 2:7, 1:33, 3:17, 2:19], computed_tiled_roi, rtol=1e-5, atol=1e-6
+        )
@@ -43,3 +43,30 @@ class TestOpTrainClassifierFromFeatureVectors(object):
         assert isinstance(
             trained_classifier, ParallelVigraRfLazyflowClassifier
         ), "classifier is of the wrong type: {}".format(type(trained_classifier))
+
+    def testClassifierCache(self):
+        labels_and_features = numpy.zeros((4, 3), dtype=numpy.float32)
+        labels_and_features[:, 0] = [1, 1, 2, 2]
+        labels_and_features[:, 1:] = [[10.5, 10.5], [10.5, 11.5], [20.5, 20.5], [20.5, 21.5]]
+        factory = ParallelVigraRfLazyflowClassifierFactory(10)
+
+        graph = Graph()
+
+        def train(matrix, factory):
+            opTrain = OpTrainClassifierFromFeatureVectors(graph=graph)
+            opTrain.ClassifierFactory.setValue(factory)
+            opTrain.MaxLabel.setValue(2)
+            opTrain.LabelAndFeatureMatrix.setValue(matrix)
+            return opTrain.Classifier.value
+
+        trained_classifier = train(labels_and_features, factory)
+        assert isinstance(trained_classifier, ParallelVigraRfLazyflowClassifier)
+
+        # Same data and settings: no training
+        assert train(labels_and_features.copy(), ParallelVigraRfLazyflowClassifierFactory(10)) is trained_classifier
+
+        # Different data or settings: new classifier
+        other_matrix = labels_and_features.copy()
+        other_matrix[0, 1] = 11.5
+        assert train(other_matrix, factory) is not trained_classifier
+        assert train(labels_and_features, ParallelVigraRfLazyflowClassifierFactory(20)) is not trained_classifier
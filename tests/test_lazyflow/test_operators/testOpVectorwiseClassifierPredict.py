@@ -0,0 +1,237 @@
+import threading
+import time
+from functools import partial
+
+import numpy
+import vigra
+
+from lazyflow.classifiers import LazyflowVectorwiseClassifierABC, LazyflowVectorwiseClassifierFactoryABC
+from lazyflow.graph import Operator, OutputSlot
+from lazyflow.operators.classifierOperators import OpVectorwiseClassifierPredict, PredictionBatcher
+from lazyflow.request import Request, RequestPool
+
+
+class CountingClassifier(LazyflowVectorwiseClassifierABC):
+    """Predicts class 1 with the value of the first feature, and records how many rows it saw."""
+
+    def __init__(self, delay=0.0):
+        self.predicted_rows = 0
+        self.predict_calls = 0
+        self.delay = delay
+
+    def predict_probabilities(self, X):
+        self.predicted_rows += len(X)
+        self.predict_calls += 1
+        time.sleep(self.delay)
+        return numpy.stack([X[:, 0], 1 - X[:, 0]], axis=-1).astype(numpy.float32)
+
+    @property
+    def known_classes(self):
+        return [1, 2]
+
+    @property
+    def feature_count(self):
+        return 1
+
+    @property
+    def feature_names(self):
+        return None
+
+    def serialize_hdf5(self, h5py_group):
+        raise NotImplementedError
+
+    @classmethod
+    def deserialize_hdf5(cls, h5py_group):
+        raise NotImplementedError
+
+
+class CountingClassifierFactory(LazyflowVectorwiseClassifierFactoryABC):
+    VERSION = 1
+
+    def create_and_train(self, X, y, feature_names=None):
+        return CountingClassifier()
+
+    @property
+    def description(self):
+        return "counting classifier"
+
+
+class OpClassifierSource(Operator):
+    Classifier = OutputSlot()
+
+    def __init__(self, classifier, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._classifier = classifier
+
+    def setupOutputs(self):
+        self.Classifier.meta.dtype = object
+        self.Classifier.meta.shape = (1,)
+        self.Classifier.meta.classifier_factory = CountingClassifierFactory()
+
+    def execute(self, slot, subindex, roi, result):
+        result[0] = self._classifier
+
+    def propagateDirty(self, slot, subindex, roi):
+        pass
+
+
+def test_predict_only_masked_pixels(graph):
+    features = vigra.taggedView(numpy.random.rand(20, 30, 1).astype(numpy.float32), "yxc")
+    mask = numpy.zeros((20, 30, 1), dtype=numpy.uint8)
+    mask[5:10, 5:15] = 1
+    mask = vigra.taggedView(mask, "yxc")
+
+    classifier = CountingClassifier()
+    opSource = OpClassifierSource(classifier, graph=graph)
+    opPredict = OpVectorwiseClassifierPredict(graph=graph)
+    opPredict.Image.setValue(features)
+    opPredict.LabelsCount.setValue(2)
+    opPredict.Classifier.connect(opSource.Classifier)
+    opPredict.PredictionMask.setValue(mask)
+
+    predictions = opPredict.PMaps[:].wait()
+    assert classifier.predicted_rows == 50
+
+    data = numpy.asarray(features)
+    expected = numpy.concatenate([data, 1 - data], axis=-1) * (numpy.asarray(mask) > 0)
+    numpy.testing.assert_array_equal(predictions, expected)
+
+    # An empty mask skips the block entirely.
+    assert not opPredict.PMaps[10:20, :, :].wait().any()
+    assert classifier.predicted_rows == 50
+
+
+def test_prediction_batcher():
+    classifier = CountingClassifier(delay=0.1)
+    batcher = PredictionBatcher(max_rows=1000, max_concurrent_batches=2)
+    blocks = [numpy.random.rand(10 + i, 1).astype(numpy.float32) for i in range(20)]
+    results = [None] * len(blocks)
+
+    def predict(i):
+        results[i] = batcher.predict_probabilities(classifier, blocks[i])
+
+    with batcher.batching():
+        pool = RequestPool()
+        for i in range(len(blocks)):
+            pool.add(Request(partial(predict, i)))
+        pool.wait()
+
+    for block, result in zip(blocks, results):
+        numpy.testing.assert_array_equal(result, numpy.concatenate([block, 1 - block], axis=-1))
+    assert classifier.predicted_rows == sum(len(block) for block in blocks)
+    if Request.global_thread_pool.num_workers > 1:
+        # Blocks that arrived while the first ones were being predicted were predicted together
+        assert classifier.predict_calls < len(blocks)
+
+    # Without batching, every call goes straight to the classifier
+    classifier.predict_calls = 0
+    batcher.predict_probabilities(classifier, blocks[0])
+    assert classifier.predict_calls == 1
+
+
+class BlockingClassifier(CountingClassifier):
+    """Like CountingClassifier, but predicting waits for the given event"""
+
+    def __init__(self, event):
+        super().__init__()
+        self.event = event
+
+    def predict_probabilities(self, X):
+        assert self.event.wait(timeout=10)
+        return super().predict_probabilities(X)
+
+
+def test_prediction_batcher_slow_batch():
+    event = threading.Event()
+    slow_classifier = BlockingClassifier(event)
+    classifier = CountingClassifier()
+    batcher = PredictionBatcher(max_concurrent_batches=2)
+    block = numpy.random.rand(10, 1).astype(numpy.float32)
+
+    with batcher.batching():
+        slow_req = Request(partial(batcher.predict_probabilities, slow_classifier, block))
+        slow_req.submit()
+        # Not held up by the slow prediction
+        for _ in range(3):
+            result = batcher.predict_probabilities(classifier, block)
+            numpy.testing.assert_array_equal(result, numpy.concatenate([block, 1 - block], axis=-1))
+        assert not event.is_set()
+        event.set()
+        slow_req.wait()
+    assert slow_classifier.predict_calls == 1
+
+
+class ShiftedClassifier(CountingClassifier):
+    """Like CountingClassifier, but with a different prediction for feature values above 0.5"""
+
+    def predict_probabilities(self, X):
+        probabilities = super().predict_probabilities(X)
+        probabilities[X[:, 0] > 0.5] = [0.5, 0.5]
+        return probabilities
+
+
+def test_invalidate_only_changed_blocks(graph):
+    data = numpy.random.rand(20, 30, 1).astype(numpy.float32) / 2
+    data[10:] += 0.5
+    features = vigra.taggedView(data, "yxc")
+
+    opSource = OpClassifierSource(CountingClassifier(), graph=graph)
+    opPredict = OpVectorwiseClassifierPredict(graph=graph)
+    opPredict.Image.setValue(features)
+    opPredict.LabelsCount.setValue(2)
+    opPredict.Classifier.connect(opSource.Classifier)
+    opPredict.InvalidationTolerance.setValue(0.01)
+
+    opPredict.PMaps[0:10].wait()
+    opPredict.PMaps[10:20].wait()
+
+    dirty_rois = []
+    opPredict.PMaps.notifyDirty(lambda slot, roi: dirty_rois.append((tuple(roi.start), tuple(roi.stop))))
+
+    # Only the predictions for the lower block change
+    opSource._classifier = ShiftedClassifier()
+    opSource.Classifier.setDirty()
+    # The samples are compared with the new classifier before predicting with it
+    opPredict.PMaps[0:10].wait()
+    assert dirty_rois == [((10, 0, 0), (20, 30, 2))]
+    assert opPredict.kept_block_fraction == 0.5
+
+    # Without a tolerance, everything is invalidated
+    opPredict.InvalidationTolerance.disconnect()
+    dirty_rois.clear()
+    opSource._classifier = CountingClassifier()
+    opSource.Classifier.setDirty()
+    assert dirty_rois == [((0, 0, 0), (20, 30, 2))]
+
+
+def test_invalidate_block_in_flight(graph):
+    data = numpy.random.rand(20, 30, 1).astype(numpy.float32)
+    features = vigra.taggedView(data, "yxc")
+
+    event = threading.Event()
+    opSource = OpClassifierSource(BlockingClassifier(event), graph=graph)
+    opPredict = OpVectorwiseClassifierPredict(graph=graph)
+    opPredict.Image.setValue(features)
+    opPredict.LabelsCount.setValue(2)
+    opPredict.Classifier.connect(opSource.Classifier)
+    opPredict.InvalidationTolerance.setValue(0.01)
+
+    dirty_rois = []
+    opPredict.PMaps.notifyDirty(lambda slot, roi: dirty_rois.append((tuple(roi.start), tuple(roi.stop))))
+
+    req = opPredict.PMaps[0:10]
+    req.submit()
+    deadline = time.time() + 10
+    while not opPredict._blocks_in_flight and time.time() < deadline:
+        time.sleep(0.01)
+    assert opPredict._blocks_in_flight
+
+    # The block is predicted with the previous classifier, so it's dirty right away
+    opSource._classifier = CountingClassifier()
+    opSource.Classifier.setDirty()
+    assert ((0, 0, 0), (10, 30, 2)) in dirty_rois
+
+    event.set()
+    req.wait()
+    # ...and it isn't kept as a sample of the new classifier
+    assert not opPredict._block_samples